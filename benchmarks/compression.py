@@ -0,0 +1,78 @@
+"""
+Reports size and latency of GET /posts for every response encoding, with the response cache disabled and with
+repeat polls served from it. Server runs in a background thread on a FileDB in a temporary directory.
+
+    python -m benchmarks.compression --posts 20000 --runs 5
+"""
+import argparse
+import http.client
+import statistics
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+from timeit import default_timer
+from typing import Iterator, Optional, Tuple
+
+from benchmarks.file_db_startup import synthetic_posts
+from post_parser.compression import CompressionConfig, ResponseCache, available_encodings
+from post_parser.db import FileDB
+from post_parser.server import RequestHandler, request_handler_wrapper
+
+
+class _Server:
+    def __init__(self, db: FileDB, cache: Optional[ResponseCache]) -> None:
+        handler = request_handler_wrapper(RequestHandler, db, compression=CompressionConfig(), cache=cache)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def get(self, encoding: Optional[str]) -> Tuple[int, float]:
+        """
+        :return: size of response body as sent and request duration in milliseconds
+        """
+        host, port = self.httpd.server_address[:2]
+        conn = http.client.HTTPConnection(host, port)
+        start = default_timer()
+        conn.request('GET', '/posts', headers={'Accept-Encoding': encoding or 'identity'})
+        body = conn.getresponse().read()
+        duration = (default_timer() - start) * 1000
+        conn.close()
+        return len(body), duration
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _measure(server: _Server, encoding: Optional[str], runs: int) -> Iterator[float]:
+    for _ in range(runs):
+        yield server.get(encoding)[1]
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Response compression benchmark')
+    arg_parser.add_argument('--posts', type=int, default=20000, help='posts in database (default: 20000)')
+    arg_parser.add_argument('--runs', type=int, default=5, help='requests per encoding (default: 5)')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = FileDB(directory, 'reddit.txt')
+        db.add_many(list(synthetic_posts(args.posts)))
+        uncached = _Server(db, None)
+        cached = _Server(db, ResponseCache())
+        try:
+            identity_size = uncached.get(None)[0]
+            for encoding in (None,) + available_encodings():
+                size = uncached.get(encoding)[0]
+                cold = statistics.median(_measure(uncached, encoding, args.runs))
+                cached.get(encoding)
+                warm = statistics.median(_measure(cached, encoding, args.runs))
+                print(f'{encoding or "identity":>8}: {size / 2 ** 20:7.2f} MiB ({size / identity_size:6.1%}), '
+                      f'{cold:7.1f}ms uncached, {warm:6.1f}ms cached')
+        finally:
+            uncached.close()
+            cached.close()
+
+
+if __name__ == '__main__':
+    main()
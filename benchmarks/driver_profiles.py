@@ -0,0 +1,111 @@
+"""
+Compares page load time and memory of full and lean chrome drivers on the offline fixture server. Memory is the
+resident set of chromedriver and every browser process started by it, read from /proc, so it runs on Linux.
+
+    python -m benchmarks.driver_profiles --runs 10
+"""
+import argparse
+import os
+import statistics
+from timeit import default_timer
+from typing import Dict, List, Set
+
+from selenium import webdriver
+
+from post_parser.parser import DRIVER_PROFILES, create_drivers
+from .fixture_server import FixtureServer
+
+FIXTURE_PAGES = ['/user_pages/user_page_correct.html']
+
+NAVIGATION_TIMING_SCRIPT = '''
+var timing = performance.timing;
+return [timing.domContentLoadedEventEnd - timing.navigationStart, timing.loadEventEnd - timing.navigationStart];
+'''
+
+
+def _process_tree(root: int) -> Set[int]:
+    """
+    Pids of root and all its descendants
+    """
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as stat:
+                # command in parentheses may contain spaces, parent pid is the second field after it
+                parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(name))
+    tree = {root}
+    pending = [root]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            tree.add(child)
+            pending.append(child)
+    return tree
+
+
+def rss_mb(driver: webdriver.Chrome) -> float:
+    """
+    Resident memory of chromedriver and the browser processes it started, pages shared between them count in
+    every process
+    """
+    total_kb = 0
+    for pid in _process_tree(driver.service.process.pid):
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                total_kb += next((int(line.split()[1]) for line in status if line.startswith('VmRSS:')), 0)
+        except OSError:
+            continue
+    return total_kb / 2 ** 10
+
+
+def _performance_metrics(driver: webdriver.Chrome) -> Dict[str, float]:
+    driver.execute_cdp_cmd('Performance.enable', {})
+    metrics = driver.execute_cdp_cmd('Performance.getMetrics', {})['metrics']
+    return {metric['name']: metric['value'] for metric in metrics}
+
+
+def measure(driver: webdriver.Chrome, url: str, runs: int) -> Dict[str, float]:
+    wall: List[float] = []
+    dom_ready: List[float] = []
+    loaded: List[float] = []
+    for _ in range(runs):
+        start = default_timer()
+        driver.get(url)
+        wall.append((default_timer() - start) * 1000)
+        dom_content_loaded, load_event = driver.execute_script(NAVIGATION_TIMING_SCRIPT)
+        dom_ready.append(dom_content_loaded)
+        loaded.append(load_event)
+    metrics = _performance_metrics(driver)
+    return {
+        'get_ms': statistics.median(wall),
+        'dom_ready_ms': statistics.median(dom_ready),
+        'load_ms': statistics.median(loaded),
+        'rss_mb': rss_mb(driver),
+        'dom_nodes': metrics.get('Nodes', 0),
+    }
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Chrome driver profile benchmark')
+    arg_parser.add_argument('--runs', type=int, default=5, help='page loads per fixture (default: 5)')
+    args = arg_parser.parse_args()
+
+    with FixtureServer() as server:
+        for profile in DRIVER_PROFILES:
+            top_driver, post_drivers = create_drivers(1, profile)
+            try:
+                for page in FIXTURE_PAGES:
+                    result = measure(post_drivers[0], server.url + page, args.runs)
+                    print(f'{profile:>5} {page}: ' + ', '.join(f'{key}={value:.1f}' for key, value in result.items()))
+            finally:
+                top_driver.quit()
+                for post_driver in post_drivers:
+                    post_driver.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Reports throughput and peak resident memory of GET /posts/export for every available format. Server runs in a
+spawned process on a FileDB or SQLite database in a temporary directory, its peak RSS is reset before every export
+and read from /proc after it, so Linux is required. Peak RSS counts pages of the mapped posts file too, anonymous
+memory (heap) is sampled while the export runs.
+
+    python -m benchmarks.export --posts 1000000 --backend file
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from timeit import default_timer
+from typing import List, Optional, Tuple
+
+from benchmarks.file_db_startup import synthetic_posts
+from post_parser.db import DB, FileDB, SQLiteDB
+from post_parser.db.post_file import write_post_file
+from post_parser.export import available_formats
+from post_parser.server import RequestHandler, request_handler_wrapper
+
+HOST = '127.0.0.1'
+READ_SIZE = 2 ** 20
+SAMPLE_SECONDS = 0.05
+
+
+def _open_db(backend: str, directory: str) -> DB:
+    if backend == 'sqlite':
+        return SQLiteDB(os.path.join(directory, 'reddit.sqlite3'))
+    return FileDB(directory, 'reddit.txt')
+
+
+def _serve(backend: str, directory: str, port: int) -> None:
+    handler = request_handler_wrapper(RequestHandler, _open_db(backend, directory))
+    ThreadingHTTPServer((HOST, port), handler).serve_forever()
+
+
+def _fill(backend: str, directory: str, posts: int) -> None:
+    if backend == 'sqlite':
+        db = _open_db(backend, directory)
+        batch = []
+        for post in synthetic_posts(posts):
+            batch.append(post)
+            if len(batch) == 10000:
+                db.add_many(batch)
+                batch = []
+        db.add_many(batch)
+    else:
+        write_post_file(os.path.join(directory, 'reddit.posts'), synthetic_posts(posts))
+
+
+def _status_mb(pid: int, name: str) -> float:
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith(name + ':'):
+                # kilobytes
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _reset_peak_rss(pid: int) -> None:
+    with open(f'/proc/{pid}/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+
+
+def _sample(pid: int, name: str, samples: List[float], done: threading.Event) -> None:
+    while not done.wait(SAMPLE_SECONDS):
+        samples.append(_status_mb(pid, name))
+
+
+def _download(port: int, path: str) -> Tuple[int, float]:
+    """
+    :return: size of body and duration in seconds
+    """
+    conn = http.client.HTTPConnection(HOST, port)
+    start = default_timer()
+    conn.request('GET', path)
+    response = conn.getresponse()
+    size = 0
+    while True:
+        data = response.read(READ_SIZE)
+        if not data:
+            break
+        size += len(data)
+    duration = default_timer() - start
+    conn.close()
+    return size, duration
+
+
+def _wait_for(port: int, process: multiprocessing.Process) -> None:
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection(HOST, port)
+            conn.request('GET', '/metrics')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except ConnectionError:
+            if not process.is_alive():
+                raise RuntimeError('Server process exited')
+            time.sleep(0.1)
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Bulk export benchmark')
+    arg_parser.add_argument('--posts', type=int, default=1000000, help='posts in database (default: 1000000)')
+    arg_parser.add_argument('--backend', choices=('file', 'sqlite'), default='file', help='database (default: file)')
+    arg_parser.add_argument('--port', type=int, default=8097, help='server port (default: 8097)')
+    arg_parser.add_argument('--list', action='store_true', help='measure GET /posts too, for comparison')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = default_timer()
+        _fill(args.backend, directory, args.posts)
+        print(f'{args.posts} posts written to {args.backend} in {default_timer() - start:.1f}s')
+        # spawned server does not inherit memory of posts generated above
+        process = multiprocessing.get_context('spawn').Process(target=_serve,
+                                                               args=(args.backend, directory, args.port), daemon=True)
+        process.start()
+        try:
+            _wait_for(args.port, process)
+            pid: Optional[int] = process.pid
+            assert pid is not None
+            paths = [(export_format, f'/posts/export?format={export_format}')
+                     for export_format in available_formats()]
+            if args.list:
+                paths.append(('list', '/posts'))
+            for name, path in paths:
+                _reset_peak_rss(pid)
+                rss = _status_mb(pid, 'VmRSS')
+                heap = [_status_mb(pid, 'RssAnon')]
+                done = threading.Event()
+                sampler = threading.Thread(target=_sample, args=(pid, 'RssAnon', heap, done))
+                sampler.start()
+                size, duration = _download(args.port, path)
+                done.set()
+                sampler.join()
+                peak = _status_mb(pid, 'VmHWM')
+                print(f'{name:>8}: {duration:6.1f}s, {args.posts / duration:9,.0f} posts/s, '
+                      f'{size / 2 ** 20 / duration:6.1f} MiB/s, {size / 2 ** 20:8.1f} MiB, '
+                      f'peak rss {peak:7.1f} MiB (+{peak - rss:.1f}), peak heap +{max(heap) - heap[0]:.1f} MiB')
+        finally:
+            process.terminate()
+            process.join()
+
+
+if __name__ == '__main__':
+    main()
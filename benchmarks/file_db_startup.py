@@ -0,0 +1,68 @@
+"""
+Compares startup time and peak resident memory of reading FileDB text file with opening the binary posts file.
+Binary file is measured first, text loading grows peak memory for the rest of the process.
+
+    python -m benchmarks.file_db_startup --posts 200000
+"""
+import argparse
+import os
+import random
+import resource
+import tempfile
+from datetime import datetime, timedelta, timezone
+from timeit import default_timer
+from typing import Any, Callable, Iterator, Tuple
+
+from post_parser.db.file_db import read_posts
+from post_parser.db.post_file import PostFile, write_post_file
+from post_parser.post import Post
+
+LOOKUPS = 1000
+
+
+def synthetic_posts(amount: int) -> Iterator[Post]:
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    for n in range(amount):
+        yield Post(post_url=f'https://www.reddit.com/r/bench/comments/{n}/', username=f'u/user_{n % 10000}',
+                   user_karma=n, user_cake_day='March 22, 2017', post_karma=n, comment_karma=n,
+                   post_date=start + timedelta(minutes=n), number_of_comments=n % 1000, number_of_votes=n,
+                   post_category=f'r/category_{n % 500}')
+
+
+def _max_rss_mb() -> float:
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(action: Callable[[], Any]) -> Tuple[Any, float, float]:
+    rss = _max_rss_mb()
+    start = default_timer()
+    result = action()
+    duration = default_timer() - start
+    return result, duration * 1000, _max_rss_mb() - rss
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='FileDB startup benchmark')
+    arg_parser.add_argument('--posts', type=int, default=200000, help='posts in the file (default: 200000)')
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        text_path = os.path.join(directory, 'reddit.txt')
+        binary_path = os.path.join(directory, 'reddit.posts')
+        with open(text_path, 'w', encoding='utf-8') as file:
+            file.writelines(str(post) for post in synthetic_posts(args.posts))
+        write_post_file(binary_path, synthetic_posts(args.posts))
+
+        post_file, duration, rss = measure(lambda: PostFile(binary_path))
+        print(f'binary: open {duration:.3f}ms, peak rss +{rss:.1f} MiB, {len(post_file)} posts')
+        ids = [post_file.id_at(random.randrange(len(post_file))) for _ in range(LOOKUPS)]
+        _, duration, rss = measure(lambda: [post_file[post_file.find(post_id) or 0] for post_id in ids])
+        print(f'binary: {LOOKUPS} lookups by id {duration:.1f}ms, peak rss +{rss:.1f} MiB')
+
+        posts, duration, rss = measure(lambda: list(read_posts(text_path)))
+        print(f'text:   open {duration:.1f}ms, peak rss +{rss:.1f} MiB, {len(posts)} posts')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Measures import time of package modules with python -X importtime in a fresh interpreter for every run.
+
+    python -m benchmarks.import_time post_parser post_parser.server post_parser.parser --runs 5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+IMPORT_TIME_PREFIX = 'import time:'
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Imports module in a new interpreter
+    :return: self and cumulative import time in microseconds of module and every module loaded by its import,
+             modules loaded by interpreter startup are left out
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times: Dict[str, Tuple[int, int]] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith(IMPORT_TIME_PREFIX):
+            continue
+        self_time, cumulative, name = line[len(IMPORT_TIME_PREFIX):].split('|')
+        if not self_time.strip().isdigit():
+            continue
+        times[name.strip()] = int(self_time), int(cumulative)
+        # a top level import is printed after everything it imported
+        if not name[1:].startswith(' '):
+            if name.strip() == module:
+                return times
+            times = {}
+    return times
+
+
+def cumulative_ms(module: str, runs: int = 1) -> float:
+    """
+    Best cumulative import time of module over runs, in milliseconds
+    """
+    return min(import_times(module)[module][1] for _ in range(runs)) / 1000
+
+
+def heaviest(times: Dict[str, Tuple[int, int]], top: int) -> List[Tuple[str, int]]:
+    return sorted(((name, self_time) for name, (self_time, _) in times.items()), key=lambda item: -item[1])[:top]
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Import time benchmark')
+    arg_parser.add_argument('modules', type=str, nargs='*', default=['post_parser', 'post_parser.server'],
+                            help='modules to import (default: post_parser post_parser.server)')
+    arg_parser.add_argument('--runs', type=int, default=5, help='imports of every module (default: 5)')
+    arg_parser.add_argument('--top', type=int, default=5, help='slowest modules to show (default: 5)')
+    args = arg_parser.parse_args()
+
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.runs)]
+        durations = [times[module][1] / 1000 for times in runs]
+        print(f'{module}: median {statistics.median(durations):.1f}ms, best {min(durations):.1f}ms, '
+              f'{len(runs[-1])} modules loaded')
+        for name, self_time in heaviest(runs[-1], args.top):
+            print(f'    {name}: {self_time / 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
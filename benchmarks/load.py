@@ -0,0 +1,368 @@
+"""
+End-to-end load test of the server. Every backend is filled with the same synthetic posts, served by a spawned
+process set up like post_parser.server.run and driven by client threads with a mix of page walks, single posts,
+filters and new posts. Writes a JSON report of throughput and latency percentiles per backend and request kind,
+so reports of two commits can be compared.
+
+PostgreSQL posts are kept in a separate post_parser_bench schema of the database from .env, MongoDB uses database
+of MONGO_BENCH_CONNECTION. Backends that cannot be reached are replaced by SQLite and marked as stand-ins.
+
+    python -m benchmarks.load --backends file,postgres,mongo --posts 100000 --duration 30 --output load.json
+"""
+import argparse
+import http.client
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from timeit import default_timer
+from typing import Any, Callable, DefaultDict, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from dotenv import load_dotenv
+
+from benchmarks.synthetic import SyntheticPosts
+from post_parser.db import DB, FileDB, SQLiteDB, create_postgres_db
+from post_parser.db.constants import CATEGORY_NAME, DATE_NAME, LAST_POST_NAME, MAX_VOTES_NAME, MIN_VOTES_NAME, \
+    PAGINATION_NAME, POSTS_PER_PAGE
+from post_parser.post import Post
+from post_parser.post_schema import PostSchema
+
+HOST = '127.0.0.1'
+BACKENDS = ('file', 'sqlite', 'postgres', 'mongo')
+BENCH_SCHEMA = 'post_parser_bench'
+BENCH_MONGO_CONNECTION = 'mongodb://localhost:27017/post_parser_bench?serverSelectionTimeoutMS=2000'
+STAND_IN = 'sqlite'
+
+PAGE = 'page'
+GET = 'get'
+VOTES = 'votes'
+DATE = 'date'
+WRITE = 'write'
+READ_MIX = f'{PAGE}=50,{GET}=30,{VOTES}=10,{DATE}=10'
+
+
+def _open_db(backend: str, directory: str) -> DB:
+    """
+    :raises: error of the driver if the database server cannot be reached
+    """
+    if backend == 'postgres':
+        return create_postgres_db(BENCH_SCHEMA)
+    if backend == 'mongo':
+        from post_parser.db.nosql_db import MongoDB
+
+        return MongoDB(os.getenv('MONGO_BENCH_CONNECTION', BENCH_MONGO_CONNECTION))
+    if backend == 'sqlite':
+        return SQLiteDB(os.path.join(directory, 'reddit.sqlite3'))
+    return FileDB(directory, 'reddit.txt')
+
+
+def _prepare(backend: str, directory: str) -> Tuple[str, Optional[str]]:
+    """
+    Checks that backend can be reached and empties its benchmark data
+    :return: backend to run and name of the stand-in if backend is replaced
+    """
+    if backend not in ('postgres', 'mongo'):
+        return backend, None
+    try:
+        db = _open_db(backend, directory)
+    except Exception as error:
+        print(f'{backend} is not available ({type(error).__name__}), {STAND_IN} stands in', file=sys.stderr)
+        return STAND_IN, STAND_IN
+    db.drop()
+    db.create()
+    return backend, None
+
+
+def _cleanup(backend: str, directory: str) -> None:
+    if backend == 'postgres':
+        db = create_postgres_db(BENCH_SCHEMA)
+        db.cursor.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;')
+    elif backend == 'mongo':
+        _open_db(backend, directory).drop()
+
+
+def _serve(backend: str, directory: str, port: int) -> None:
+    from post_parser.admission import AdmissionConfig
+    from post_parser.broadcast import Broadcaster
+    from post_parser.compression import CompressionConfig, ResponseCache
+    from post_parser.db.changes import ChangeNotifier
+    from post_parser.group_commit import GroupCommit
+    from post_parser.server import PostHTTPServer, RequestHandler, request_handler_wrapper
+
+    load_dotenv()
+    db = _open_db(backend, directory)
+    compression = CompressionConfig()
+    cache = ResponseCache(compression.cache_bytes, compression.cache_ttl) if compression.cache_bytes > 0 else None
+    handler = request_handler_wrapper(RequestHandler, db, None, compression, cache, ChangeNotifier(), Broadcaster(),
+                                      GroupCommit(db))
+    PostHTTPServer((HOST, port), handler, AdmissionConfig()).serve_forever()
+
+
+def _wait_for(port: int, process: multiprocessing.Process) -> None:
+    for _ in range(300):
+        try:
+            conn = http.client.HTTPConnection(HOST, port)
+            conn.request('GET', '/metrics')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except ConnectionError:
+            if not process.is_alive():
+                raise RuntimeError('Server process exited')
+            time.sleep(0.1)
+    raise RuntimeError('Server did not start')
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Parses comma separated kind=weight pairs, e.g. page=50,get=30
+    """
+    weights: Dict[str, float] = {}
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in (PAGE, GET, VOTES, DATE):
+            raise argparse.ArgumentTypeError(f'Unknown read kind {kind!r}')
+        weights[kind] = float(weight)
+    return weights
+
+
+def percentiles(latencies: Sequence[float]) -> Dict[str, float]:
+    """
+    :param latencies: milliseconds
+    """
+    if len(latencies) < 2:
+        value = latencies[0] if latencies else 0.0
+        return {'p50': value, 'p95': value, 'p99': value, 'max': value}
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {'p50': round(cuts[49], 3), 'p95': round(cuts[94], 3), 'p99': round(cuts[98], 3),
+            'max': round(max(latencies), 3)}
+
+
+class _Results:
+    def __init__(self) -> None:
+        self.latencies: DefaultDict[str, List[float]] = defaultdict(list)
+        self.rejected: DefaultDict[str, int] = defaultdict(int)
+        self.errors: DefaultDict[str, int] = defaultdict(int)
+
+    def merge(self, other: '_Results') -> None:
+        for kind, latencies in other.latencies.items():
+            self.latencies[kind].extend(latencies)
+        for kind, rejected in other.rejected.items():
+            self.rejected[kind] += rejected
+        for kind, errors in other.errors.items():
+            self.errors[kind] += errors
+
+
+class _Client(threading.Thread):
+    """
+    Sends requests until deadline, only requests started after measure_from are recorded
+    """
+
+    def __init__(self, index: int, port: int, args: argparse.Namespace, ids: Sequence[str],
+                 numbers: Iterator[int], measure_from: float, deadline: float) -> None:
+        super().__init__(name=f'load-client-{index}', daemon=True)
+        self.port = port
+        self.args = args
+        self.ids = ids
+        self.numbers = numbers
+        self.measure_from = measure_from
+        self.deadline = deadline
+        self.random = random.Random(args.seed * 1000 + index)
+        self.synthetic = SyntheticPosts(args.seed + index + 1)
+        self.read_kinds = list(args.read_mix)
+        self.read_weights = list(itertools.accumulate(args.read_mix.values()))
+        self.schema = PostSchema()
+        self.results = _Results()
+        self._operations: Dict[str, Callable[[], None]] = {PAGE: self._walk_pages, GET: self._get, VOTES: self._votes,
+                                                           DATE: self._date, WRITE: self._write}
+
+    def run(self) -> None:
+        while default_timer() < self.deadline:
+            if self.random.random() < self.args.write_ratio:
+                kind = WRITE
+            else:
+                kind = self.random.choices(self.read_kinds, cum_weights=self.read_weights)[0]
+            self._operations[kind]()
+
+    def _request(self, kind: str, method: str, path: str, body: Optional[str] = None) -> Optional[bytes]:
+        """
+        :return: body of successful response
+        """
+        start = default_timer()
+        try:
+            conn = http.client.HTTPConnection(HOST, self.port)
+            conn.request(method, path, body)
+            response = conn.getresponse()
+            data = response.read()
+            conn.close()
+        except OSError:
+            if start >= self.measure_from:
+                self.results.errors[kind] += 1
+            return None
+        end = default_timer()
+        if start < self.measure_from or end > self.deadline:
+            return data if response.status < 300 else None
+        if response.status == 503:
+            self.results.rejected[kind] += 1
+        elif response.status >= 300:
+            self.results.errors[kind] += 1
+        else:
+            self.results.latencies[kind].append((end - start) * 1000)
+            return data
+        return None
+
+    def _query(self, kind: str, query: Dict[str, str]) -> Optional[bytes]:
+        return self._request(kind, 'GET', '/posts?' + urlencode({PAGINATION_NAME: 'true', **query}))
+
+    def _walk_pages(self) -> None:
+        """
+        Reads a category page by page, every next page is read with probability next_page
+        """
+        query = {CATEGORY_NAME: self.synthetic.category()}
+        for depth in range(self.args.page_depth):
+            if depth and self.random.random() >= self.args.next_page:
+                return
+            data = self._query(PAGE, query)
+            if data is None:
+                return
+            posts = json.loads(data)
+            if len(posts) < POSTS_PER_PAGE:
+                return
+            query[LAST_POST_NAME] = posts[-1]['id']
+
+    def _get(self) -> None:
+        self._request(GET, 'GET', f'/posts/{self.random.choice(self.ids)}')
+
+    def _votes(self) -> None:
+        votes = self.synthetic.votes()
+        self._query(VOTES, {MIN_VOTES_NAME: str(votes), MAX_VOTES_NAME: str(votes * 2)})
+
+    def _date(self) -> None:
+        self._query(DATE, {DATE_NAME: self.synthetic.day().date().isoformat()})
+
+    def _write(self) -> None:
+        self._request(WRITE, 'POST', '/posts', self.schema.dumps(self.synthetic.post(next(self.numbers))))
+
+
+def drive(port: int, args: argparse.Namespace, ids: Sequence[str]) -> _Results:
+    """
+    Runs client threads against server on port for warmup and duration seconds
+    """
+    # numbers of new posts follow the ones loaded, so every write adds a post
+    numbers = itertools.count(args.posts)
+    start = default_timer()
+    measure_from = start + args.warmup
+    deadline = measure_from + args.duration
+    clients = [_Client(index, port, args, ids, numbers, measure_from, deadline) for index in range(args.threads)]
+    for client in clients:
+        client.start()
+    results = _Results()
+    for client in clients:
+        client.join()
+        results.merge(client.results)
+    return results
+
+
+def report(results: _Results, duration: float) -> Dict[str, Any]:
+    kinds: Dict[str, Any] = {}
+    for kind in sorted(set(results.latencies) | set(results.rejected) | set(results.errors)):
+        latencies = results.latencies[kind]
+        kinds[kind] = {'requests': len(latencies), 'throughput': round(len(latencies) / duration, 1),
+                       'rejected': results.rejected[kind], 'errors': results.errors[kind],
+                       'latency_ms': percentiles(latencies)}
+    every = [latency for latencies in results.latencies.values() for latency in latencies]
+    reads = [latency for kind, latencies in results.latencies.items() if kind != WRITE for latency in latencies]
+    return {'requests': len(every), 'throughput': round(len(every) / duration, 1),
+            'rejected': sum(results.rejected.values()), 'errors': sum(results.errors.values()),
+            'latency_ms': percentiles(every), 'read_latency_ms': percentiles(reads),
+            'write_latency_ms': percentiles(results.latencies[WRITE]), 'kinds': kinds}
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_backend(backend: str, args: argparse.Namespace, posts: List[Post], ids: Sequence[str]) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        served, stand_in = _prepare(backend, directory)
+        start = default_timer()
+        _open_db(served, directory).add_many(posts)
+        fill_seconds = default_timer() - start
+        print(f'{backend}: {len(posts)} posts written in {fill_seconds:.1f}s', file=sys.stderr)
+        # spawned server does not inherit memory of posts generated here
+        process = multiprocessing.get_context('spawn').Process(target=_serve, args=(served, directory, args.port),
+                                                               daemon=True)
+        process.start()
+        try:
+            _wait_for(args.port, process)
+            results = drive(args.port, args, ids)
+        finally:
+            process.terminate()
+            process.join()
+            if stand_in is None:
+                _cleanup(served, directory)
+    result = {'backend': backend, 'stand_in': stand_in, 'fill_seconds': round(fill_seconds, 3),
+              **report(results, args.duration)}
+    latency = result['latency_ms']
+    print(f'{backend}: {result["throughput"]:,.0f} requests/s, p50 {latency["p50"]:.1f} ms, '
+          f'p95 {latency["p95"]:.1f} ms, p99 {latency["p99"]:.1f} ms, '
+          f'{result["rejected"]} rejected, {result["errors"]} errors', file=sys.stderr)
+    return result
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Server load benchmark')
+    arg_parser.add_argument('--backends', default='file,postgres,mongo',
+                            help=f'comma separated backends of {", ".join(BACKENDS)} (default: file,postgres,mongo)')
+    arg_parser.add_argument('--posts', type=int, default=100000, help='posts loaded before the run (default: 100000)')
+    arg_parser.add_argument('--threads', type=int, default=16, help='client threads (default: 16)')
+    arg_parser.add_argument('--duration', type=float, default=20, help='measured seconds per backend (default: 20)')
+    arg_parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before (default: 2)')
+    arg_parser.add_argument('--write-ratio', type=float, default=0.1,
+                            help='share of requests adding a post (default: 0.1)')
+    arg_parser.add_argument('--read-mix', type=parse_mix, default=parse_mix(READ_MIX),
+                            help=f'weights of read kinds (default: {READ_MIX})')
+    arg_parser.add_argument('--page-depth', type=int, default=5,
+                            help='most pages of a category read one after another (default: 5)')
+    arg_parser.add_argument('--next-page', type=float, default=0.5,
+                            help='probability that the next page is read (default: 0.5)')
+    arg_parser.add_argument('--seed', type=int, default=0, help='random seed of posts and clients (default: 0)')
+    arg_parser.add_argument('--port', type=int, default=8098, help='server port (default: 8098)')
+    arg_parser.add_argument('--output', help='file the JSON report is written to (default: stdout)')
+    args = arg_parser.parse_args()
+    backends = args.backends.split(',')
+    for backend in backends:
+        if backend not in BACKENDS:
+            arg_parser.error(f'unknown backend {backend!r}')
+
+    load_dotenv()
+    posts = list(SyntheticPosts(args.seed).posts(args.posts))
+    ids = [post.id for post in posts]
+    result = {'commit': _commit(), 'created': datetime.now(timezone.utc).isoformat(),
+              'python': platform.python_version(), 'config': {**vars(args), 'backends': backends},
+              'backends': {backend: run_backend(backend, args, posts, ids) for backend in backends}}
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Measures rows per second of PostgresDB.bulk_import and bulk_export against add() one post at a time.
+Runs in a separate schema of the database from .env.
+
+    python -m benchmarks.postgres_bulk --rows 1000000 --add-rows 10000
+"""
+import argparse
+import io
+from datetime import datetime, timedelta, timezone
+from timeit import default_timer
+from typing import Iterator
+
+from dotenv import load_dotenv
+
+from post_parser.db import PostgresDB, create_postgres_db
+from post_parser.db.sql_db import CREATE_TABLES
+from post_parser.post import Post
+
+BENCH_SCHEMA = 'post_parser_bench'
+USERS = 10000
+START_DATE = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+def synthetic_posts(rows: int) -> Iterator[Post]:
+    for n in range(rows):
+        user = n % USERS
+        yield Post(post_url=f'https://www.reddit.com/r/bench/comments/{n}/', username=f'u/user_{user}',
+                   user_karma=user * 7, user_cake_day='March 22, 2017', post_karma=user * 5, comment_karma=user * 2,
+                   post_date=START_DATE + timedelta(minutes=n), number_of_comments=n % 1000,
+                   number_of_votes=(n * 7919) % 100000, post_category=f'r/category_{n % 500}')
+
+
+def _reset_schema(db: PostgresDB) -> None:
+    db.cursor.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA};')
+    db.cursor.execute(CREATE_TABLES)
+    db.migrate()
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='PostgreSQL bulk import and export benchmark')
+    arg_parser.add_argument('--rows', type=int, default=1000000, help='posts to import (default: 1000000)')
+    arg_parser.add_argument('--add-rows', type=int, default=10000,
+                            help='posts to insert one by one for comparison (default: 10000)')
+    args = arg_parser.parse_args()
+
+    load_dotenv()
+    # connection uses the bench schema from the start, tables of the default schema are left untouched
+    db = create_postgres_db(BENCH_SCHEMA)
+    try:
+        _reset_schema(db)
+        start = default_timer()
+        for post in synthetic_posts(args.add_rows):
+            db.add(post)
+        duration = default_timer() - start
+        print(f'add: {args.add_rows} rows in {duration:.1f}s, {args.add_rows / duration:.0f} rows/s')
+
+        _reset_schema(db)
+        start = default_timer()
+        rows = db.bulk_import(synthetic_posts(args.rows))
+        duration = default_timer() - start
+        print(f'bulk_import: {rows} rows in {duration:.1f}s, {rows / duration:.0f} rows/s')
+
+        output = io.StringIO()
+        start = default_timer()
+        db.bulk_export(output)
+        duration = default_timer() - start
+        print(f'bulk_export: {rows} rows in {duration:.1f}s, {rows / duration:.0f} rows/s, '
+              f'{len(output.getvalue()) / 2 ** 20:.1f} MiB')
+    finally:
+        db.cursor.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;')
+        db.conn.close()
+
+
+if __name__ == '__main__':
+    main()
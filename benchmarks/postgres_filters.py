@@ -0,0 +1,89 @@
+"""
+Times filtered post selects on synthetic rows before and after PostgresDB.migrate() adds indexes.
+Rows are generated server side in a separate schema, connection is read from the same env as the server.
+
+    python -m benchmarks.postgres_filters --rows 1000000 --runs 5
+"""
+import argparse
+import statistics
+from timeit import default_timer
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from post_parser.db import PostgresDB, create_postgres_db
+from post_parser.db.sql_db import CREATE_TABLES, _generate_filtered_select_clause, _generate_filter_params
+
+BENCH_SCHEMA = 'post_parser_bench'
+USERS = 10000
+CATEGORIES = 500
+
+GENERATE_ROWS = '''INSERT INTO users
+SELECT 'u/user_' || n, n * 7, 'March 22, 2017', n * 5, n * 2
+FROM generate_series(1, %(users)s) n;
+
+INSERT INTO posts
+SELECT md5(n::text), 'https://www.reddit.com/r/bench/comments/' || n, now() - (n %% 3650) * interval '1 day',
+    n %% 1000, (n::bigint * 7919) %% 100000, 'r/category_' || (n %% %(categories)s), 'u/user_' || (1 + n %% %(users)s)
+FROM generate_series(1, %(rows)s) n;
+
+ANALYZE users;
+ANALYZE posts;
+'''
+
+QUERIES: Dict[str, Dict[str, str]] = {
+    'category': {'category': 'r/category_42', 'pagination': 'true'},
+    'votes': {'minVotes': '50000', 'maxVotes': '50100', 'pagination': 'true'},
+    'date': {'date': '2020-01-01', 'pagination': 'true'},
+    'category_last_post': {'category': 'r/category_42', 'lastPost': '8', 'pagination': 'true'},
+}
+
+
+def measure(db: PostgresDB, runs: int) -> Dict[str, float]:
+    results = {}
+    for name, query in QUERIES.items():
+        timings: List[float] = []
+        for _ in range(runs):
+            start = default_timer()
+            db.cursor.execute(_generate_filtered_select_clause(query), _generate_filter_params(query))
+            db.cursor.fetchall()
+            timings.append((default_timer() - start) * 1000)
+        results[name] = statistics.median(timings)
+    return results
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='PostgreSQL filtered select benchmark')
+    arg_parser.add_argument('--rows', type=int, default=1000000, help='synthetic posts to generate (default: 1000000)')
+    arg_parser.add_argument('--runs', type=int, default=5, help='runs per query (default: 5)')
+    args = arg_parser.parse_args()
+
+    load_dotenv()
+    # connection uses the bench schema from the start, tables of the default schema are left untouched
+    db = create_postgres_db(BENCH_SCHEMA)
+    try:
+        db.cursor.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA};')
+        db.cursor.execute(CREATE_TABLES)
+        start = default_timer()
+        db.cursor.execute(GENERATE_ROWS, {'rows': args.rows, 'users': USERS, 'categories': CATEGORIES})
+        db.conn.commit()
+        print(f'generated {args.rows} posts in {default_timer() - start:.1f}s')
+
+        before = measure(db, args.runs)
+        start = default_timer()
+        db.migrate()
+        db.cursor.execute('ANALYZE posts;')
+        print(f'built indexes in {default_timer() - start:.1f}s')
+        after = measure(db, args.runs)
+
+        for name in QUERIES:
+            print(f'{name:>20}: seq scan {before[name]:.1f}ms, indexed {after[name]:.1f}ms')
+    finally:
+        db.conn.rollback()
+        db.cursor.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;')
+        db.conn.commit()
+        db.conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Synthetic posts with distributions resembling a month of reddit top: category and author popularity follow Zipf's
+law, votes and karma are log-normal with a long tail, comments are a small share of votes and posts cluster in
+the evening hours. Generation is deterministic for a seed, so runs of different commits load the same data.
+
+    python -m benchmarks.synthetic --posts 10
+"""
+import argparse
+import bisect
+import itertools
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Sequence
+
+from post_parser.post import Post
+
+CATEGORIES = 300
+USERS = 20000
+DAYS = 30
+START = datetime(2021, 3, 1, tzinfo=timezone.utc)
+ZIPF_EXPONENT = 1.1
+# log-normal parameters: median of votes is e ** 3 (about 20), a few posts get hundreds of thousands
+VOTES_MU = 3.0
+VOTES_SIGMA = 1.8
+KARMA_MU = 8.0
+KARMA_SIGMA = 2.0
+MAX_VOTES = 500000
+# relative posting activity of every hour of a UTC day, highest in the evening
+HOUR_WEIGHTS = [1 + math.sin((hour - 14) / 24 * 2 * math.pi) * 0.7 for hour in range(24)]
+
+
+def zipf_cumulative_weights(amount: int, exponent: float = ZIPF_EXPONENT) -> List[float]:
+    """
+    Cumulative weights of ranks 1..amount for random.choices and bisect
+    """
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, amount + 1)))
+
+
+class _User:
+    def __init__(self, username: str, karma: int, cake_day: str, post_share: float) -> None:
+        self.username = username
+        self.karma = karma
+        self.cake_day = cake_day
+        self.post_karma = int(karma * post_share)
+        self.comment_karma = karma - self.post_karma
+
+
+class SyntheticPosts:
+    """
+    Generator of posts of one data set. Categories and users are the same for every instance with the same
+    categories and users, posts differ by seed and number
+    """
+
+    def __init__(self, seed: int = 0, categories: int = CATEGORIES, users: int = USERS, days: int = DAYS) -> None:
+        self.random = random.Random(seed)
+        self.days = days
+        self.categories = [f'r/category_{rank}' for rank in range(categories)]
+        self.category_weights = zipf_cumulative_weights(categories)
+        users_random = random.Random(users)
+        self.users = [_User(f'u/user_{rank}', int(users_random.lognormvariate(KARMA_MU, KARMA_SIGMA)),
+                            (START - timedelta(days=users_random.randrange(4000))).strftime('%B %d, %Y'),
+                            users_random.random())
+                      for rank in range(users)]
+        self.user_weights = zipf_cumulative_weights(users)
+        self.hour_weights = list(itertools.accumulate(HOUR_WEIGHTS))
+
+    def _pick(self, cumulative_weights: Sequence[float]) -> int:
+        return bisect.bisect_left(cumulative_weights, self.random.random() * cumulative_weights[-1])
+
+    def category(self) -> str:
+        """
+        Category chosen as often as posts of it are written
+        """
+        return self.categories[self._pick(self.category_weights)]
+
+    def day(self) -> datetime:
+        return START + timedelta(days=self.random.randrange(self.days))
+
+    def votes(self) -> int:
+        return min(int(self.random.lognormvariate(VOTES_MU, VOTES_SIGMA)), MAX_VOTES)
+
+    def post(self, number: int) -> Post:
+        """
+        :param number: makes post url and so post id unique
+        """
+        user = self.users[self._pick(self.user_weights)]
+        category = self.category()
+        votes = self.votes()
+        post_date = self.day() + timedelta(hours=self._pick(self.hour_weights),
+                                           seconds=self.random.randrange(3600))
+        return Post(post_url=f'https://www.reddit.com/{category}/comments/{number:x}/', username=user.username,
+                    user_karma=user.karma, user_cake_day=user.cake_day, post_karma=user.post_karma,
+                    comment_karma=user.comment_karma, post_date=post_date,
+                    number_of_comments=int(votes * self.random.betavariate(2, 18)), number_of_votes=votes,
+                    post_category=category)
+
+    def posts(self, amount: int, first: int = 0) -> Iterator[Post]:
+        for number in range(first, first + amount):
+            yield self.post(number)
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Prints synthetic posts')
+    arg_parser.add_argument('--posts', type=int, default=10, help='posts to print (default: 10)')
+    arg_parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    args = arg_parser.parse_args()
+    for post in SyntheticPosts(args.seed).posts(args.posts):
+        print(str(post), end='')
+
+
+if __name__ == '__main__':
+    main()
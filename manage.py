@@ -0,0 +1,16 @@
+from post_parser import create_manage_arg_parser
+from post_parser.manage import import_file, export_file, migrate
+
+
+if __name__ == '__main__':
+    arg_parser = create_manage_arg_parser()
+    args = arg_parser.parse_args()
+    if args.command == 'import':
+        import_file(args.path, args.database)
+    elif args.command == 'export':
+        export_file(args.path, args.database)
+    else:
+        if args.source == args.target:
+            arg_parser.error('--from and --to must be different databases')
+        migrate(args.source, args.target, args.state, args.resume, args.batch_size, args.queue_batches, args.tail,
+                args.interval)
@@ -1,3 +1,29 @@
-from .cli import create_server_arg_parser, create_parser_arg_parser
-from .parser import run as run_parser
-from .server import run as run_server
+"""
+Scraper and server are imported on first access, so command line tools and backends do not pay for selenium,
+aiohttp and marshmallow they never use
+"""
+import importlib
+from typing import TYPE_CHECKING, Any, Dict, Tuple
+
+from .cli import create_server_arg_parser, create_parser_arg_parser, create_manage_arg_parser
+
+if TYPE_CHECKING:
+    from .parser import run as run_parser
+    from .server import run as run_server
+
+__all__ = ['create_server_arg_parser', 'create_parser_arg_parser', 'create_manage_arg_parser', 'run_parser',
+           'run_server']
+
+_LAZY_ATTRIBUTES: Dict[str, Tuple[str, str]] = {
+    'run_parser': ('.parser', 'run'),
+    'run_server': ('.server', 'run'),
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    module_name, attribute = _LAZY_ATTRIBUTES[name]
+    value = getattr(importlib.import_module(module_name, __name__), attribute)
+    globals()[name] = value
+    return value
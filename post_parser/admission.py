@@ -0,0 +1,76 @@
+"""
+Admission control of the server. Reads and writes have separate budgets of requests handled at once, so a burst
+of uploads cannot starve queries and the other way round. Connections beyond the handler threads of both budgets
+wait in a bounded queue, anything more is answered with 503 and Retry-After right away instead of getting a thread.
+Long polls of the change feed move from the read budget to a budget of their own while they wait, so idle pollers
+do not keep queries out
+"""
+import threading
+from dataclasses import dataclass
+from typing import Dict
+
+from .metrics import ADMISSION_REJECTED_TOTAL, REQUESTS_IN_FLIGHT
+
+READ = 'read'
+WRITE = 'write'
+# long poll waiting for a change
+POLL = 'poll'
+# connection rejected because the queue is full, before its request is read
+QUEUE = 'queue'
+
+WRITE_METHODS = frozenset(('POST', 'PUT', 'DELETE'))
+
+
+@dataclass
+class AdmissionConfig:
+    max_reads: int = 64
+    max_writes: int = 16
+    max_polls: int = 16
+    # connections accepted while all handler threads are busy
+    queue_size: int = 128
+    # seconds rejected clients are asked to wait
+    retry_after: int = 1
+
+    @property
+    def max_connections(self) -> int:
+        return self.max_reads + self.max_writes + self.max_polls
+
+
+def request_kind(method: str) -> str:
+    return WRITE if method in WRITE_METHODS else READ
+
+
+class AdmissionControl:
+    def __init__(self, config: AdmissionConfig) -> None:
+        self.config = config
+        self._limits = {READ: config.max_reads, WRITE: config.max_writes, POLL: config.max_polls}
+        self._in_flight: Dict[str, int] = {READ: 0, WRITE: 0, POLL: 0}
+        self._lock = threading.Lock()
+
+    def in_flight(self, kind: str) -> int:
+        return self._in_flight[kind]
+
+    def try_acquire(self, kind: str) -> bool:
+        """
+        Takes a place in the budget of kind without waiting
+        :return: False if the budget is used up, the request should be rejected
+        """
+        with self._lock:
+            if self._in_flight[kind] >= self._limits[kind]:
+                ADMISSION_REJECTED_TOTAL.inc(kind=kind)
+                return False
+            self._in_flight[kind] += 1
+        REQUESTS_IN_FLIGHT.inc(kind=kind)
+        return True
+
+    def release(self, kind: str) -> None:
+        with self._lock:
+            self._in_flight[kind] -= 1
+        REQUESTS_IN_FLIGHT.dec(kind=kind)
+
+    def rejected_response(self) -> bytes:
+        """
+        Whole 503 response sent to connections rejected before their request is read
+        """
+        return (f'HTTP/1.0 503 Service Unavailable\r\nRetry-After: {self.config.retry_after}\r\n'
+                f'Content-Length: 0\r\nConnection: close\r\n\r\n').encode('ascii')
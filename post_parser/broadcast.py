@@ -0,0 +1,215 @@
+"""
+Fan-out of server-sent events to subscribers of the post stream. Subscriber sockets are handed over by request
+handlers and written by a single selector thread, so idle subscribers cost a socket and a buffer, not a thread.
+Publishers only queue events, a subscriber whose buffer outgrows max_buffer is disconnected instead of slowing
+down writes
+"""
+import selectors
+import socket
+import threading
+from collections import deque
+from timeit import default_timer
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .metrics import STREAM_DROPPED_TOTAL, STREAM_EVENTS_TOTAL, STREAM_SUBSCRIBERS_TOTAL
+
+# bytes queued for a subscriber that does not read fast enough
+MAX_BUFFER = 256 * 2 ** 10
+MAX_SUBSCRIBERS = 1000
+# idle connections get a comment line this often, proxies keep them open and dead peers are found
+HEARTBEAT_SECONDS = 15.0
+HEARTBEAT = b':\n\n'
+
+DROPPED_SLOW = 'slow'
+DROPPED_CLOSED = 'closed'
+
+
+def encode_event(event: str, data: str) -> bytes:
+    """
+    Encodes one server-sent event, every line of data gets its own data field
+    """
+    lines = ''.join(f'data: {line}\n' for line in data.split('\n'))
+    return f'event: {event}\n{lines}\n'.encode('utf-8')
+
+
+class _Subscriber:
+    def __init__(self, sock: socket.socket, preamble: bytes) -> None:
+        self.sock = sock
+        self.chunks: Deque[bytes] = deque([preamble] if preamble else [])
+        self.size = len(preamble)
+        self.events = selectors.EVENT_READ
+
+
+class Broadcaster:
+    def __init__(self, max_buffer: int = MAX_BUFFER, max_subscribers: int = MAX_SUBSCRIBERS,
+                 heartbeat: float = HEARTBEAT_SECONDS) -> None:
+        self.max_buffer = max_buffer
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.dropped = 0
+        self._subscribers: Dict[socket.socket, _Subscriber] = {}
+        # filled by handler threads, taken by the selector thread
+        self._joining: Deque[Tuple[socket.socket, bytes]] = deque()
+        self._events: Deque[bytes] = deque()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers) + len(self._joining)
+
+    @property
+    def full(self) -> bool:
+        return self.subscribers >= self.max_subscribers
+
+    def subscribe(self, sock: socket.socket, preamble: bytes = b'') -> None:
+        """
+        Takes over sock. Events published from now on are sent to it until the client disconnects or falls behind
+        :param preamble: bytes sent before the first event, e.g. response headers
+        """
+        with self._lock:
+            if self._closed:
+                sock.close()
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='post-stream', daemon=True)
+                self._thread.start()
+            self._joining.append((sock, preamble))
+        STREAM_SUBSCRIBERS_TOTAL.inc()
+        self._wake()
+
+    def publish(self, event: bytes) -> None:
+        """
+        Queues encoded event for all subscribers, never blocks on them
+        """
+        if not self.subscribers:
+            return
+        self._events.append(event)
+        STREAM_EVENTS_TOTAL.inc()
+        self._wake()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wake()
+        if thread is not None:
+            thread.join()
+        else:
+            self._close_all()
+
+    def _wake(self) -> None:
+        try:
+            self._wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            # selector thread is woken already
+            pass
+
+    def _run(self) -> None:
+        next_heartbeat = default_timer() + self.heartbeat
+        while not self._closed:
+            for key, mask in self._selector.select(max(0.0, next_heartbeat - default_timer())):
+                if key.data is None:
+                    self._drain_wakeup()
+                else:
+                    self._handle(key.data, mask)
+            self._add_joining()
+            self._fan_out()
+            if default_timer() >= next_heartbeat:
+                for subscriber in list(self._subscribers.values()):
+                    self._send(subscriber, HEARTBEAT)
+                next_heartbeat = default_timer() + self.heartbeat
+        self._close_all()
+
+    def _drain_wakeup(self) -> None:
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _add_joining(self) -> None:
+        while self._joining:
+            sock, preamble = self._joining.popleft()
+            sock.setblocking(False)
+            subscriber = _Subscriber(sock, preamble)
+            self._subscribers[sock] = subscriber
+            self._selector.register(sock, subscriber.events, subscriber)
+            self._flush(subscriber)
+
+    def _fan_out(self) -> None:
+        events: List[bytes] = []
+        while self._events:
+            events.append(self._events.popleft())
+        if not events:
+            return
+        data = b''.join(events)
+        for subscriber in list(self._subscribers.values()):
+            self._send(subscriber, data)
+
+    def _handle(self, subscriber: _Subscriber, mask: int) -> None:
+        if mask & selectors.EVENT_READ:
+            # clients do not send anything after the request, readable socket is a closed one
+            try:
+                data = subscriber.sock.recv(4096)
+            except BlockingIOError:
+                data = b'\0'
+            except OSError:
+                data = b''
+            if not data:
+                self._drop(subscriber, DROPPED_CLOSED)
+                return
+        if mask & selectors.EVENT_WRITE:
+            self._flush(subscriber)
+
+    def _send(self, subscriber: _Subscriber, data: bytes) -> None:
+        if subscriber.size + len(data) > self.max_buffer:
+            self._drop(subscriber, DROPPED_SLOW)
+            return
+        subscriber.chunks.append(data)
+        subscriber.size += len(data)
+        self._flush(subscriber)
+
+    def _flush(self, subscriber: _Subscriber) -> None:
+        chunks = subscriber.chunks
+        try:
+            while chunks:
+                sent = subscriber.sock.send(chunks[0])
+                subscriber.size -= sent
+                if sent < len(chunks[0]):
+                    chunks[0] = chunks[0][sent:]
+                    break
+                chunks.popleft()
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._drop(subscriber, DROPPED_CLOSED)
+            return
+        # write readiness is watched only while something is queued
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if chunks else selectors.EVENT_READ
+        if events != subscriber.events:
+            subscriber.events = events
+            self._selector.modify(subscriber.sock, events, subscriber)
+
+    def _drop(self, subscriber: _Subscriber, reason: str) -> None:
+        del self._subscribers[subscriber.sock]
+        self._selector.unregister(subscriber.sock)
+        subscriber.sock.close()
+        self.dropped += 1
+        STREAM_DROPPED_TOTAL.inc(reason=reason)
+
+    def _close_all(self) -> None:
+        self._add_joining()
+        for sock in list(self._subscribers):
+            self._selector.unregister(sock)
+            sock.close()
+        self._subscribers.clear()
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import io
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .post import Post
+
+_LOGGER = logging.getLogger(__name__)
+
+HARVESTED = 'harvested'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CURSOR = 'cursor'
+
+SERVER_UNAVAILABLE = 'server unavailable'
+
+FSYNC_BATCH = 32
+FSYNC_INTERVAL = 1.0
+
+ResultCallback = Callable[[str, Optional[Post], str], None]
+
+
+@dataclass
+class CheckpointState:
+    harvested: Dict[str, Any] = field(default_factory=dict)
+    completed: Dict[str, str] = field(default_factory=dict)
+    failed: Dict[str, str] = field(default_factory=dict)
+    cursor: Optional[Tuple[Optional[str], int]] = None
+
+    @property
+    def pending(self) -> List[Tuple[str, Any]]:
+        """
+        Harvested posts that were neither parsed nor failed, in harvest order
+        """
+        return [(url, payload) for url, payload in self.harvested.items()
+                if url not in self.completed and url not in self.failed]
+
+
+def _load(path: str) -> CheckpointState:
+    state = CheckpointState()
+    try:
+        with io.open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be cut by a crash in the middle of a write
+                    _LOGGER.warning('Skipped broken checkpoint record')
+                    continue
+                event = record['event']
+                if event == HARVESTED:
+                    state.harvested[record['url']] = record.get('payload')
+                elif event == COMPLETED:
+                    state.completed[record['url']] = record['id']
+                elif event == FAILED:
+                    state.failed[record['url']] = record['reason']
+                elif event == CURSOR:
+                    state.cursor = (record['after'], record['skip'])
+    except FileNotFoundError:
+        pass
+    return state
+
+
+def _ends_with_newline(path: str) -> bool:
+    with io.open(path, 'rb') as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b'\n'
+
+
+class Checkpoint:
+    """
+    Append-only progress log of a parser run. Records are fsynced in batches, so a crash loses at most
+    FSYNC_BATCH records or FSYNC_INTERVAL seconds of progress
+    """
+
+    def __init__(self, path: str, resume: bool = False) -> None:
+        self.path = path
+        self.state = _load(path) if resume else CheckpointState()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = io.open(path, 'a' if resume else 'w', encoding='utf-8')
+        if resume and self.file.tell() > 0 and not _ends_with_newline(path):
+            self.file.write('\n')
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+        if resume:
+            _LOGGER.info(f'Resuming from checkpoint: {len(self.state.completed)} completed, '
+                         f'{len(self.state.failed)} failed, {len(self.state.pending)} pending')
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.unsynced += 1
+            if self.unsynced >= FSYNC_BATCH or time.monotonic() - self.synced_at >= FSYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def harvest(self, url: str, payload: Any = None) -> None:
+        self.state.harvested[url] = payload
+        self._append({'event': HARVESTED, 'url': url, 'payload': payload})
+
+    def complete(self, url: str, post_id: str) -> None:
+        self.state.completed[url] = post_id
+        self._append({'event': COMPLETED, 'url': url, 'id': post_id})
+
+    def fail(self, url: str, reason: str) -> None:
+        self.state.failed[url] = reason
+        self._append({'event': FAILED, 'url': url, 'reason': reason})
+
+    def cursor(self, after: Optional[str], skip: int) -> None:
+        """
+        Remembers listing page being harvested, so resume starts from it instead of the first page
+        """
+        self.state.cursor = (after, skip)
+        self._append({'event': CURSOR, 'after': after, 'skip': skip})
+
+    def on_result(self, url: str, post: Optional[Post], reason: str = '') -> None:
+        """
+        Stores outcome of a harvested post. Server outages are not failures, such posts stay pending
+        """
+        if post:
+            self.complete(url, post.id)
+        elif reason != SERVER_UNAVAILABLE:
+            self.fail(url, reason)
+
+    def take(self, url: str, payload: Any = None) -> bool:
+        """
+        Records a freshly fed post as harvested
+        :return: False if the post was already harvested by this or previous run
+        """
+        if url in self.state.harvested:
+            return False
+        self.harvest(url, payload)
+        return True
+
+    def feed(self, items: Iterable[Tuple[str, Any]]) -> Iterator[Tuple[str, Any]]:
+        """
+        Yields pending posts of previous run first, then new posts of `items` recording them as harvested
+        """
+        yield from self.state.pending
+        for url, payload in items:
+            if self.take(url, payload):
+                yield url, payload
+
+    def close(self) -> None:
+        with self.lock:
+            self._sync()
+            self.file.close()
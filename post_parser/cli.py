@@ -1,5 +1,7 @@
 import argparse
 
+DATABASES = ['mongo', 'postgres', 'sqlite', 'file']
+
 
 def create_parser_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='Reddit month top parser')
@@ -9,11 +11,109 @@ def create_parser_arg_parser() -> argparse.ArgumentParser:
                         help='an integer for posts offset (default: 0)')
     parser.add_argument('-w', '--workers', type=int, default=1, metavar='WORKERS',
                         help='sets a number of posts parsed in the same moment (default: 1)')
+    parser.add_argument('--processes', type=int, default=1, metavar='PROCESSES',
+                        help='worker processes, posts are sharded between them by id hash (default: 1)')
+    parser.add_argument('--checkpoint', type=str, default='./parser-checkpoint.jsonl', metavar='PATH',
+                        help='file progress of the run is logged to (default: ./parser-checkpoint.jsonl)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the run logged in checkpoint file instead of starting over')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile the whole run with cProfile')
+    parser.add_argument('--profile-dir', type=str, default='./profiles', metavar='PATH',
+                        help='directory profiles are written to (default: ./profiles)')
+    parser.add_argument('--driver-profile', type=str, default='full', choices=['lean', 'full'],
+                        help='lean blocks images, media, fonts and third-party domains (default: full)')
+    parser.add_argument('--driver-profile-dir', type=str, default=None, metavar='DIR',
+                        help='lean drivers keep warm profiles in DIR between runs, runs at the same time need '
+                             'different DIRs (default: temporary profile per driver)')
+    parser.add_argument('-e', '--engine', type=str, default='selenium', choices=['selenium', 'http'],
+                        help='http reads reddit json listing without a browser (default: selenium)')
+    pipeline = parser.add_argument_group('http engine pipeline')
+    pipeline.add_argument('--feed-prefetch', type=int, default=100, metavar='POSTS',
+                          help='listing posts buffered ahead of post stage (default: 100)')
+    pipeline.add_argument('--post-concurrency', type=int, default=4, metavar='TASKS',
+                          help='post stage tasks (default: 4)')
+    pipeline.add_argument('--user-concurrency', type=int, default=32, metavar='TASKS',
+                          help='user stage tasks (default: 32)')
+    pipeline.add_argument('--upload-concurrency', type=int, default=16, metavar='TASKS',
+                          help='upload stage tasks (default: 16)')
+    pipeline.add_argument('--max-in-flight', type=int, default=200, metavar='REQUESTS',
+                          help='requests in flight across all stages (default: 200)')
+    pipeline.add_argument('--rate-limit', type=float, default=10.0, metavar='RPS',
+                          help='requests per second to every reddit host from all processes, 0 disables (default: 10)')
+    pipeline.add_argument('--burst', type=int, default=20, metavar='REQUESTS',
+                          help='requests allowed in a burst above rate limit (default: 20)')
+    pipeline.add_argument('--max-retries', type=int, default=5, metavar='RETRIES',
+                          help='retries of a request answered with 429 or 5xx (default: 5)')
     return parser
 
 
 def create_server_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='Server for reddit month top parser to store parsed data')
-    parser.add_argument('-d', '--database', type=str, default='mongo', choices=['mongo', 'postgres', 'file'],
+    parser.add_argument('-d', '--database', type=str, default='mongo', choices=DATABASES,
                         help='which database you want to use (default: mongodb)')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile sampled requests and requests with ?__profile=1 query')
+    parser.add_argument('--profile-rate', type=float, default=0.01, metavar='FRACTION',
+                        help='fraction of requests profiled when --profile is set (default: 0.01)')
+    parser.add_argument('--profile-dir', type=str, default='./profiles', metavar='PATH',
+                        help='directory per route .pstats files are written to (default: ./profiles)')
+    parser.add_argument('--log-file', type=str, default='server.log', metavar='PATH',
+                        help='log file, rotated by size (default: server.log)')
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 2 ** 20, metavar='BYTES',
+                        help='log file size that triggers rotation (default: 10 MiB)')
+    parser.add_argument('--log-backups', type=int, default=5, metavar='FILES',
+                        help='rotated log files kept (default: 5)')
+    parser.add_argument('--log-sample-rate', type=float, default=1.0, metavar='FRACTION',
+                        help='fraction of 2xx requests written to access log (default: 1.0)')
+    parser.add_argument('--compress-min-bytes', type=int, default=1024, metavar='BYTES',
+                        help='smaller responses are not compressed (default: 1024)')
+    parser.add_argument('--response-cache-mb', type=int, default=64, metavar='MIB',
+                        help='memory for encoded post lists kept until next write, 0 disables cache (default: 64)')
+    parser.add_argument('--response-cache-ttl', type=float, default=30.0, metavar='SECONDS',
+                        help='age after which cached post lists are rebuilt (default: 30)')
+    parser.add_argument('--group-commit-ms', type=float, default=2.0, metavar='MS',
+                        help='time concurrent POST /posts wait to be written in one transaction (default: 2)')
+    parser.add_argument('--no-group-commit', action='store_true', help='write every POST /posts on its own')
+    parser.add_argument('--max-reads', type=int, default=64, metavar='REQUESTS',
+                        help='GET requests handled at once, more are answered with 503 (default: 64)')
+    parser.add_argument('--max-writes', type=int, default=16, metavar='REQUESTS',
+                        help='POST, PUT and DELETE requests handled at once, more are answered with 503 (default: 16)')
+    parser.add_argument('--max-polls', type=int, default=16, metavar='REQUESTS',
+                        help='change feed long polls waiting at once, more are answered with 503 (default: 16)')
+    parser.add_argument('--accept-queue', type=int, default=128, metavar='CONNECTIONS',
+                        help='connections waiting while all handler threads are busy (default: 128)')
+    parser.add_argument('--retry-after', type=int, default=1, metavar='SECONDS',
+                        help='Retry-After of 503 responses (default: 1)')
+    return parser
+
+
+def create_manage_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Maintenance commands for reddit month top parser storage')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_command = commands.add_parser('import', help='load posts from a text file, PostgreSQL uses COPY')
+    import_command.add_argument('path', type=str, help='file in FileDB text format')
+    import_command.add_argument('-d', '--database', type=str, default='postgres', choices=DATABASES,
+                                help='database posts are loaded into (default: postgres)')
+    export_command = commands.add_parser('export', help='dump posts to a text file, PostgreSQL uses COPY')
+    export_command.add_argument('path', type=str, help='file to write in FileDB text format')
+    export_command.add_argument('-d', '--database', type=str, default='postgres', choices=DATABASES,
+                                help='database posts are read from (default: postgres)')
+    migrate_command = commands.add_parser('migrate', help='copy posts from one database to another')
+    migrate_command.add_argument('--from', dest='source', type=str, required=True, choices=DATABASES,
+                                 help='database posts are read from')
+    migrate_command.add_argument('--to', dest='target', type=str, required=True, choices=DATABASES,
+                                 help='database posts are written to')
+    migrate_command.add_argument('--batch-size', type=int, default=1000, metavar='POSTS',
+                                 help='posts read and written at once (default: 1000)')
+    migrate_command.add_argument('--queue-batches', type=int, default=4, metavar='BATCHES',
+                                 help='batches read ahead of the writer (default: 4)')
+    migrate_command.add_argument('--state', type=str, default='./migrate-state.json', metavar='PATH',
+                                 help='file last transferred post id is saved to (default: ./migrate-state.json)')
+    migrate_command.add_argument('--resume', action='store_true',
+                                 help='continue after the last post saved in state file instead of starting over')
+    migrate_command.add_argument('--tail', action='store_true',
+                                 help='keep copying new, changed and deleted posts after initial copy')
+    migrate_command.add_argument('--interval', type=float, default=5.0, metavar='SECONDS',
+                                 help='pause between tail passes (default: 5.0)')
     return parser
@@ -0,0 +1,217 @@
+"""
+Content-Encoding negotiation, compressors and cache of encoded responses. gzip is always available, zstd and br
+are offered when zstandard and brotli packages are installed
+"""
+import functools
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from timeit import default_timer
+from typing import Dict, Hashable, Optional, Tuple
+
+GZIP = 'gzip'
+BROTLI = 'br'
+ZSTD = 'zstd'
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+
+@dataclass
+class CompressionConfig:
+    # smaller bodies are sent as they are, compression headers would eat the gain
+    min_size: int = 1024
+    # lists of more posts are serialized and compressed in chunks of this size while they are written
+    stream_posts: int = 1000
+    cache_bytes: int = 64 * 2 ** 20
+    # bounds staleness after writes made around the server, e.g. by manage.py
+    cache_ttl: float = 30.0
+
+
+class Compressor(ABC):
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def flush(self) -> bytes:
+        pass
+
+
+class IdentityCompressor(Compressor):
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+
+class GzipCompressor(Compressor):
+    def __init__(self) -> None:
+        # wbits 31 writes gzip header and trailer
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor(Compressor):
+    def __init__(self) -> None:
+        import brotli
+
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(Compressor):
+    def __init__(self) -> None:
+        import zstandard
+
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+@functools.lru_cache(maxsize=None)
+def available_encodings() -> Tuple[str, ...]:
+    """
+    Encodings the server can produce, most preferred first
+    """
+    encodings = []
+    try:
+        import zstandard  # noqa: F401
+        encodings.append(ZSTD)
+    except ImportError:
+        pass
+    try:
+        import brotli  # noqa: F401
+        encodings.append(BROTLI)
+    except ImportError:
+        pass
+    encodings.append(GZIP)
+    return tuple(encodings)
+
+
+def _parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+    return weights
+
+
+def negotiate(accept_encoding: Optional[str], encodings: Optional[Tuple[str, ...]] = None) -> Optional[str]:
+    """
+    Chooses encoding of response from Accept-Encoding header, server preference breaks ties of client weights
+    :param encodings: encodings to choose from, available_encodings() by default
+    :return: chosen encoding or None for identity
+    """
+    if not accept_encoding:
+        return None
+    weights = _parse_accept_encoding(accept_encoding)
+    chosen = None
+    chosen_weight = 0.0
+    for encoding in encodings if encodings is not None else available_encodings():
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > chosen_weight:
+            chosen, chosen_weight = encoding, weight
+    return chosen
+
+
+def create_compressor(encoding: Optional[str]) -> Compressor:
+    if encoding == ZSTD:
+        return ZstdCompressor()
+    if encoding == BROTLI:
+        return BrotliCompressor()
+    if encoding == GZIP:
+        return GzipCompressor()
+    return IdentityCompressor()
+
+
+def compress(data: bytes, encoding: Optional[str]) -> bytes:
+    compressor = create_compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    encoding: Optional[str]
+    created: float
+
+
+class ResponseCache:
+    """
+    LRU cache of encoded response bodies limited by their total size. Every write bumps data generation and
+    drops all entries, a body is stored only if generation did not change since its data was read
+    """
+
+    def __init__(self, max_bytes: int = CompressionConfig.cache_bytes,
+                 ttl: float = CompressionConfig.cache_ttl) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.generation = 0
+        self._entries: 'OrderedDict[Hashable, CachedResponse]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.size = 0
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if default_timer() - entry.created > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, body: bytes, encoding: Optional[str], generation: int) -> None:
+        """
+        :param generation: generation read before the data of body was read
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CachedResponse(body, encoding, default_timer())
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable) -> None:
+        self.size -= len(self._entries.pop(key).body)
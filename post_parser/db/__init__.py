@@ -1,5 +1,33 @@
+"""
+Backends are imported on first access, so only the driver of the database in use gets loaded
+"""
+import importlib
+from typing import TYPE_CHECKING, Any, Dict
+
 from .base import DB
 from .exceptions import PostNotFoundException
-from .file_db import FileDB
-from .nosql_db import MongoDB
-from .sql_db import PostgresDB
+from .factory import create_db, create_postgres_db
+
+if TYPE_CHECKING:
+    from .file_db import FileDB
+    from .nosql_db import MongoDB
+    from .sql_db import PostgresDB
+    from .sqlite_db import SQLiteDB
+
+__all__ = ['DB', 'PostNotFoundException', 'FileDB', 'MongoDB', 'PostgresDB', 'SQLiteDB', 'create_db',
+           'create_postgres_db']
+
+_LAZY_ATTRIBUTES: Dict[str, str] = {
+    'FileDB': '.file_db',
+    'MongoDB': '.nosql_db',
+    'PostgresDB': '.sql_db',
+    'SQLiteDB': '.sqlite_db',
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
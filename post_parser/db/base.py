@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import Any, Iterator, List, Dict, Sequence
 
 from post_parser.post import Post
+from .changes import CHANGES_LIMIT, Change
+from .constants import PAGINATION_NAME
+from .projection import project
+from .stats import TOP_USERS, PostStats, StatsAccumulator
 
 
 class DB(ABC):
@@ -76,3 +80,65 @@ class DB(ABC):
         :return: True if post was deleted else False
         """
         ...
+
+    @abstractmethod
+    def changes(self, since: int, limit: int = CHANGES_LIMIT) -> List[Change]:
+        """
+        Latest change of every post written after change since, oldest first
+        :param since: sequence number of the last change seen, 0 for all
+        :param limit: maximum number of changes
+        """
+        ...
+
+    def get_projected(self, query: Dict[str, str], fields: Sequence[str]) -> List[Dict[str, Any]]:
+        """
+        Gets posts by filter with only given fields, backends override it to read only what the fields need
+        :param fields: names from constants.POST_FIELDS
+        """
+        return [project(post, fields) for post in self.get_filtered(query)]
+
+    def iter_posts(self, after: str = '', batch_size: int = 1000) -> Iterator[Post]:
+        """
+        Streams all posts ordered by id, backends override it to read in batches
+        :param after: only posts with id greater than after are returned
+        :param batch_size: posts read from database at once
+        """
+        for post in sorted(self.get_all(), key=lambda post: post.id):
+            if post.id > after:
+                yield post
+
+    def iter_filtered(self, query: Dict[str, str], batch_size: int = 1000) -> Iterator[Post]:
+        """
+        Streams posts matching filters of get_filtered ordered by id, pagination is ignored. Backends override it
+        to read in batches
+        :param batch_size: posts read from database at once
+        """
+        return iter(self.get_filtered({name: value for name, value in query.items() if name != PAGINATION_NAME}))
+
+    def add_many(self, posts: List[Post]) -> int:
+        """
+        Adds posts, existing posts are replaced. Backends override it to write posts in one round trip
+        :return: number of written posts
+        """
+        for post in posts:
+            if not self.add(post):
+                self.update(post.id, post)
+        return len(posts)
+
+    def add_batch(self, posts: List[Post]) -> List[bool]:
+        """
+        Adds posts that do not exist yet, like add called for every post. Backends override it to write posts in
+        one transaction
+        :return: result of add for every post, False for a repeated id
+        """
+        return [self.add(post) for post in posts]
+
+    def stats(self, top_users: int = TOP_USERS) -> PostStats:
+        """
+        Aggregates all posts, backends override it to keep statistics up to date or to group in database
+        :param top_users: number of users with the most karma returned
+        """
+        accumulator = StatsAccumulator()
+        for post in self.iter_posts():
+            accumulator.add(post)
+        return accumulator.stats(top_users)
@@ -0,0 +1,160 @@
+"""
+Append-only change log of FileDB, one line per change: sequence number, '+' for added or updated post or '-' for
+deleted one, and post id. Opening reads only the last line, the log is read into memory by the first since() call
+and only the latest change of every post is kept; it is compacted then when most of its lines are superseded.
+Changes read and written since are indexed by sequence number, so since() starts at its cursor.
+Posts stored before the log was created are numbered by that call too, between two '*' marker lines
+"""
+import bisect
+import io
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+ADDED = '+'
+DELETED = '-'
+# marker lines around changes of posts stored before the log was created
+MARKER = '*'
+BACKFILL_START = 'start'
+BACKFILL_END = 'end'
+
+# log is rewritten on load and its index rebuilt when they have this many times more entries than posts tracked
+COMPACT_RATIO = 2
+COMPACT_MIN_LINES = 1000
+# enough bytes from the end of the log for its last line
+TAIL_BYTES = 256
+
+# sequence number, post id, deleted
+LogEntry = Tuple[int, str, bool]
+
+
+class ChangeLog:
+    def __init__(self, path: str, existing: Callable[[], Iterable[str]]) -> None:
+        """
+        :param existing: ids of stored posts, they are the first changes of a new log
+        """
+        self.path = path
+        self._existing = existing
+        created = not os.path.exists(path)
+        self.last_seq = 0 if created else _read_last_seq(path)
+        # read by the first since(), insertion order is order of sequence numbers, an entry is moved to the end
+        # when its post changes again
+        self._latest: Optional[Dict[str, Tuple[int, bool]]] = None
+        # sequence numbers in ascending order and their posts, entries superseded by a later change stay until the
+        # index is rebuilt
+        self._seqs: List[int] = []
+        self._ids: List[str] = []
+        self._lock = threading.Lock()
+        self._file = io.open(path, 'a', encoding='ascii')
+        if created:
+            self._write([_line(0, MARKER, BACKFILL_START)])
+
+    def _write(self, lines: List[str]) -> None:
+        self._file.writelines(lines)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _load(self) -> Dict[str, Tuple[int, bool]]:
+        """
+        Reads the log, numbers posts stored before it if that is not done yet and compacts it
+        """
+        latest: Dict[str, Tuple[int, bool]] = {}
+        lines = 0
+        backfill = False
+        with io.open(self.path, 'r', encoding='ascii') as file:
+            for line in file:
+                seq, operation, post_id = line.rstrip('\n').split(';')
+                lines += 1
+                if operation == MARKER:
+                    backfill = post_id == BACKFILL_START
+                    continue
+                latest.pop(post_id, None)
+                latest[post_id] = int(seq), operation == DELETED
+        self._latest = latest
+        self._rebuild_index()
+        if backfill:
+            # posts changed since the log was created have their own lines, an interrupted backfill goes on
+            self._append((post_id, False) for post_id in self._existing() if post_id not in latest)
+            self._write([_line(self.last_seq, MARKER, BACKFILL_END)])
+        if _superseded(lines, len(latest)):
+            self._compact()
+        return latest
+
+    def _rebuild_index(self) -> None:
+        assert self._latest is not None
+        self._ids = list(self._latest)
+        self._seqs = [seq for seq, _ in self._latest.values()]
+
+    def _compact(self) -> None:
+        assert self._latest is not None
+        temp_path = self.path + '.tmp'
+        with io.open(temp_path, 'w', encoding='ascii') as file:
+            file.writelines(_line(seq, DELETED if deleted else ADDED, post_id)
+                            for post_id, (seq, deleted) in self._latest.items())
+            file.flush()
+            os.fsync(file.fileno())
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = io.open(self.path, 'a', encoding='ascii')
+
+    def _append(self, changes: Iterable[Tuple[str, bool]]) -> None:
+        lines = []
+        for post_id, deleted in changes:
+            self.last_seq += 1
+            if self._latest is not None:
+                self._latest.pop(post_id, None)
+                self._latest[post_id] = self.last_seq, deleted
+                self._seqs.append(self.last_seq)
+                self._ids.append(post_id)
+            lines.append(_line(self.last_seq, DELETED if deleted else ADDED, post_id))
+        self._write(lines)
+        if self._latest is not None and _superseded(len(self._seqs), len(self._latest)):
+            self._rebuild_index()
+
+    def append(self, changes: Iterable[Tuple[str, bool]]) -> None:
+        """
+        Numbers and writes changes
+        :param changes: post id and whether post was deleted
+        """
+        with self._lock:
+            self._append(changes)
+
+    def since(self, seq: int, limit: int) -> List[LogEntry]:
+        """
+        Latest changes with sequence number greater than seq, oldest first
+        """
+        with self._lock:
+            latest = self._latest if self._latest is not None else self._load()
+            entries: List[LogEntry] = []
+            index = bisect.bisect_right(self._seqs, seq)
+            while index < len(self._seqs) and len(entries) < limit:
+                post_id = self._ids[index]
+                entry_seq, deleted = latest[post_id]
+                if entry_seq == self._seqs[index]:
+                    entries.append((entry_seq, post_id, deleted))
+                index += 1
+        return entries
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _superseded(entries: int, posts: int) -> bool:
+    return entries >= COMPACT_MIN_LINES and entries > COMPACT_RATIO * posts
+
+
+def _line(seq: int, operation: str, post_id: str) -> str:
+    return f'{seq};{operation};{post_id}\n'
+
+
+def _read_last_seq(path: str) -> int:
+    """
+    Sequence number of the last complete line, marker lines carry the last number before them
+    """
+    with io.open(path, 'rb') as file:
+        size = file.seek(0, io.SEEK_END)
+        file.seek(max(0, size - TAIL_BYTES))
+        lines = file.read().split(b'\n')
+    # text after the last newline is empty or a line cut by a crash, the first one may be cut by the seek
+    complete = lines[:-1] if size <= TAIL_BYTES else lines[1:-1]
+    return int(complete[-1].split(b';')[0]) if complete else 0
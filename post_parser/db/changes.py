@@ -0,0 +1,53 @@
+"""
+Change feed: every write of a post gets the next number of a change sequence. Only the latest change of every
+post is kept, deleted posts leave a tombstone, so reading changes after a cursor is enough to sync a copy
+"""
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .constants import POST_FIELDS
+from .projection import project
+from ..post import Post
+
+# changes returned at once
+CHANGES_LIMIT = 1000
+
+
+@dataclass(frozen=True)
+class Change:
+    seq: int
+    post_id: str
+    # None for tombstone of deleted post
+    post: Optional[Post] = None
+
+    @property
+    def deleted(self) -> bool:
+        return self.post is None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'seq': self.seq, 'id': self.post_id, 'deleted': self.deleted,
+                'post': None if self.post is None else project(self.post, POST_FIELDS)}
+
+
+class ChangeNotifier:
+    """
+    Wakes long-polling readers of the change feed after writes made through the server
+    """
+
+    def __init__(self) -> None:
+        self.version = 0
+        self._condition = threading.Condition()
+
+    def notify(self) -> None:
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def wait(self, version: int, timeout: float) -> bool:
+        """
+        Waits until a write after version was read
+        :return: False on timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.version != version, timeout)
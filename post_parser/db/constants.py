@@ -1 +1,17 @@
 POSTS_PER_PAGE = 30
+
+MIN_VOTES_NAME = 'minVotes'
+MAX_VOTES_NAME = 'maxVotes'
+CATEGORY_NAME = 'category'
+DATE_NAME = 'date'
+LAST_POST_NAME = 'lastPost'
+PAGINATION_NAME = 'pagination'
+FIELDS_NAME = 'fields'
+
+FILTER_NAMES = (CATEGORY_NAME, DATE_NAME, MIN_VOTES_NAME, MAX_VOTES_NAME, LAST_POST_NAME)
+
+# fields of serialized post
+POST_FIELDS = ('id', 'post_url', 'username', 'user_karma', 'user_cake_day', 'post_karma', 'comment_karma',
+               'post_date', 'number_of_comments', 'number_of_votes', 'post_category')
+# fields kept with user, not with post
+USER_FIELDS = frozenset(('user_karma', 'user_cake_day', 'post_karma', 'comment_karma'))
@@ -0,0 +1,54 @@
+import logging
+import os
+from typing import TYPE_CHECKING, Optional
+
+from .base import DB
+
+if TYPE_CHECKING:
+    from .sql_db import PostgresDB
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def create_db(database_name: str) -> DB:
+    """
+    Connects to database chosen by name, connection settings are read from environment.
+    Only the chosen backend and its driver are imported
+    """
+    db: DB
+    if database_name == 'mongo':
+        from .nosql_db import MongoDB
+
+        conn_string = os.getenv('MONGO_CONNECTION', 'mongodb://localhost:27017')
+        db = MongoDB(conn_string)
+
+        _LOGGER.info('MongoDB connected')
+    elif database_name == 'postgres':
+        db = create_postgres_db()
+
+        _LOGGER.info('PostgreSQL connected')
+    elif database_name == 'sqlite':
+        from .sqlite_db import SQLiteDB
+
+        db = SQLiteDB()
+
+        _LOGGER.info(f'SQLite database {db.path} opened')
+    else:
+        from .file_db import FileDB
+
+        db = FileDB()
+
+        _LOGGER.info('File created')
+    return db
+
+
+def create_postgres_db(schema: Optional[str] = None) -> 'PostgresDB':
+    """
+    Connects to PostgreSQL database from environment
+    :param schema: schema used instead of the default one, e.g. by tests and benchmarks
+    """
+    from .sql_db import PostgresDB
+
+    return PostgresDB(name=os.getenv('POSTGRES_NAME', 'postgres'), user=os.getenv('POSTGRES_USERNAME', 'postgres'),
+                      password=os.getenv('POSTGRES_PASSWORD', 'root'), host=os.getenv('POSTGRES_HOST', 'localhost'),
+                      port=int(os.getenv('POSTGRES_PORT', '5432')), schema=schema)
@@ -1,133 +1,239 @@
 import io
+import itertools
 import os
+import threading
 from datetime import datetime
-from typing import List, Dict
-
-from dateutil.parser import parse
+from typing import AbstractSet, Any, Iterable, Iterator, List, Dict, Optional, Sequence
 
 from .base import DB
-from .constants import POSTS_PER_PAGE
+from .change_log import ChangeLog
+from .changes import CHANGES_LIMIT, Change
+from .constants import POSTS_PER_PAGE, CATEGORY_NAME, DATE_NAME, MIN_VOTES_NAME, MAX_VOTES_NAME, LAST_POST_NAME, \
+    PAGINATION_NAME
 from .exceptions import PostNotFoundException
-from ..post import Post
+from .post_file import PostFile, write_post_file
+from .stats import TOP_USERS, PostStats, StatsAccumulator, post_day
+from ..post import Post, as_datetime
 from ..utils import get_config
 
-CONFIG = get_config().get('file', {})
-OUTPUT_PATH = CONFIG.get('path', './output')
-FILE_NAME = CONFIG.get('name', f'reddit-{datetime.now().strftime("%Y%m%d")}.txt')
-
-
-def _filter_posts(posts: List[Post], query: Dict[str, str]) -> List[Post]:
-    if 'category' in query:
-        posts = [post for post in posts if post.post_category == query["category"]]
-    if 'date' in query:
-        posts = [post for post in posts if str(post.post_date.date()) == query["category"]]
-    if 'minVotes' in query:
-        posts = [post for post in posts if post.number_of_votes >= int(query["minVotes"])]
-    if 'maxVotes' in query:
-        posts = [post for post in posts if post.number_of_votes <= int(query["maxVotes"])]
-    posts = sorted(posts, key=lambda post: post.id)
-
-    pagination = query.get('pagination', '')
-    last_id = query.get('lastPost', '')
-    if pagination == 'true':
-        if not last_id:
-            page = 1
-        else:
-            index = len(posts)
-            for num, post in enumerate(posts):
-                if post.id == last_id:
-                    index = num
-                    break
-            page = index // POSTS_PER_PAGE + 2
-        posts = posts[POSTS_PER_PAGE * (page - 1): POSTS_PER_PAGE * page]
-    else:
-        if last_id:
-            posts = []
-
-    return posts
+OUTPUT_PATH = './output'
+# file of the current day is used when config has no name
+FILE_NAME: Optional[str] = None
+POSTS_FILE_EXTENSION = '.posts'
+CHANGES_FILE_EXTENSION = '.changes'
+
+
+def _filter_indexes(posts: PostFile, query: Dict[str, str]) -> Iterator[int]:
+    """
+    Indexes of posts matching query, only columns used by query are read
+    """
+    category = query[CATEGORY_NAME].encode('utf-8') if CATEGORY_NAME in query else None
+    min_votes = int(query[MIN_VOTES_NAME]) if MIN_VOTES_NAME in query else None
+    max_votes = int(query[MAX_VOTES_NAME]) if MAX_VOTES_NAME in query else None
+    start = 0
+    last_id = query.get(LAST_POST_NAME, '')
+    if last_id:
+        start = posts.bisect(last_id)
+        if start < len(posts) and posts.id_at(start) == last_id:
+            start += 1
+    for index in range(start, len(posts)):
+        if category is not None and posts.category_at(index) != category:
+            continue
+        if min_votes is not None and posts.votes_at(index) < min_votes:
+            continue
+        if max_votes is not None and posts.votes_at(index) > max_votes:
+            continue
+        if DATE_NAME in query and post_day(posts.date_at(index)) != query[DATE_NAME]:
+            continue
+        yield index
+
+
+def _page_indexes(posts: PostFile, query: Dict[str, str]) -> Iterable[int]:
+    indexes = _filter_indexes(posts, query)
+    if query.get(PAGINATION_NAME, '') == 'true':
+        return itertools.islice(indexes, POSTS_PER_PAGE)
+    if query.get(LAST_POST_NAME, ''):
+        return ()
+    return indexes
+
+
+def _filter_posts(posts: PostFile, query: Dict[str, str]) -> List[Post]:
+    return [posts[index] for index in _page_indexes(posts, query)]
+
+
+def parse_post_line(line: str) -> Post:
+    """
+    Parses post from line written by str(post)
+    """
+    _, post_url, username, user_karma, user_cake_day, post_karma, comment_karma, post_date, \
+    number_of_comments, number_of_votes, post_category = line.replace('\n', '').split(';')
+    return Post(post_url=post_url, username=username, user_karma=int(user_karma), user_cake_day=user_cake_day,
+                post_karma=int(post_karma), comment_karma=int(comment_karma), post_date=as_datetime(post_date),
+                number_of_comments=int(number_of_comments), number_of_votes=int(number_of_votes),
+                post_category=post_category)
+
+
+def read_posts(path: str) -> Iterator[Post]:
+    """
+    Lazily reads posts from file in FileDB format
+    """
+    with io.open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield parse_post_line(line)
 
 
 class FileDB(DB):
-    def __init__(self) -> None:
-        self.current_posts: List[Post] = []
-        self.path: str = os.path.join(OUTPUT_PATH, FILE_NAME)
+    """
+    Posts are kept in a binary posts file sorted by id and read through mmap, see post_file. Every write
+    rewrites the file and swaps the mapping, readers keep using the old mapping until they are done
+    """
+
+    def __init__(self, directory: Optional[str] = None, name: Optional[str] = None) -> None:
+        """
+        :param directory: directory of posts file, 'path' of 'file' config section by default
+        :param name: name of text posts file, 'name' of 'file' config section by default
+        """
+        config = get_config().get('file', {})
+        self.directory: str = directory or config.get('path', OUTPUT_PATH)
+        name = name or config.get('name', FILE_NAME) or f'reddit-{datetime.now().strftime("%Y%m%d")}.txt'
+        self.text_path: str = os.path.join(self.directory, name)
+        self.path: str = os.path.splitext(self.text_path)[0] + POSTS_FILE_EXTENSION
+        self._lock = threading.Lock()
+        # built by the first stats() call and kept up to date by writes
+        self._stats: Optional[StatsAccumulator] = None
         self.create()
-        self._init_from_file()
-
-    def _write_to_file(self) -> None:
-        with io.open(self.path, 'w', encoding='utf-8') as file:
-            file.writelines([str(post) for post in self.current_posts])
-
-    def _init_from_file(self) -> None:
-        try:
-            with io.open(self.path, 'r', encoding='utf-8') as file:
-                for line in file.readlines():
-                    _, post_url, username, user_karma, user_cake_day, post_karma, comment_karma, post_date, \
-                    number_of_comments, number_of_votes, post_category = line.replace('\n', '').split(';')
-                    self.current_posts.append(
-                        Post(post_url=post_url, username=username, user_karma=int(user_karma),
-                             user_cake_day=user_cake_day, post_karma=int(post_karma),
-                             comment_karma=int(comment_karma), post_date=parse(post_date),
-                             number_of_comments=int(number_of_comments), number_of_votes=int(number_of_votes),
-                             post_category=post_category))
-        except FileNotFoundError:
-            pass
+        self.posts = PostFile(self.path)
+        # posts written before the change log existed are its first changes
+        self.change_log = ChangeLog(os.path.splitext(self.text_path)[0] + CHANGES_FILE_EXTENSION, self._post_ids)
+
+    def _post_ids(self) -> Iterator[str]:
+        posts = self.posts
+        return (posts.id_at(index) for index in range(len(posts)))
+
+    def _rewrite(self, posts: List[Post], removed: AbstractSet[str] = frozenset()) -> None:
+        replaced = {post.id for post in posts} | removed
+        if self._stats is not None:
+            for post_id in replaced:
+                index = self.posts.find(post_id)
+                if index is not None:
+                    self._stats.remove(self.posts[index])
+            for post in posts:
+                self._stats.add(post)
+        # log goes first, a crash before the file is replaced leaves a change of the current post, not a lost one
+        self.change_log.append([(post.id, False) for post in posts] +
+                               [(post_id, True) for post_id in sorted(removed - {post.id for post in posts})])
+        kept = (self.posts.raw(index) for index in range(len(self.posts)) if self.posts.id_at(index) not in replaced)
+        write_post_file(self.path, itertools.chain(kept, posts))
+        self.posts = PostFile(self.path)
 
     def count(self) -> int:
-        return len(self.current_posts)
+        return len(self.posts)
 
     def drop(self) -> None:
-        with io.open(self.path, 'w', encoding='utf-8'):
-            pass
+        with self._lock:
+            self.change_log.append((self.posts.id_at(index), True) for index in range(len(self.posts)))
+            write_post_file(self.path, [])
+            self.posts = PostFile(self.path)
+            if self._stats is not None:
+                self._stats = StatsAccumulator()
 
     def create(self) -> None:
-        try:
-            os.makedirs(OUTPUT_PATH)
-        except FileExistsError:
-            pass
-        try:
-            with io.open(self.path, 'r', encoding='utf-8'):
-                pass
-        except FileNotFoundError:
-            with io.open(self.path, 'w', encoding='utf-8'):
-                pass
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            return
+        # text file of earlier versions is converted once
+        if os.path.exists(self.text_path):
+            write_post_file(self.path, read_posts(self.text_path))
+        else:
+            write_post_file(self.path, [])
 
     def get_all(self) -> List[Post]:
-        return self.current_posts
+        return list(self.posts)
 
     def get_filtered(self, query: Dict[str, str]) -> List[Post]:
-        return _filter_posts(self.current_posts.copy(), query)
+        return _filter_posts(self.posts, query)
+
+    def get_projected(self, query: Dict[str, str], fields: Sequence[str]) -> List[Dict[str, Any]]:
+        posts = self.posts
+        return [posts.fields_at(index, fields) for index in _page_indexes(posts, query)]
 
     def get_by_id(self, post_id: str) -> Post:
-        for post in self.current_posts:
-            if post.id == post_id:
-                return post
-        raise PostNotFoundException
+        posts = self.posts
+        index = posts.find(post_id)
+        if index is None:
+            raise PostNotFoundException
+        return posts[index]
+
+    def iter_posts(self, after: str = '', batch_size: int = 1000) -> Iterator[Post]:
+        posts = self.posts
+        start = posts.bisect(after)
+        if start < len(posts) and posts.id_at(start) == after:
+            start += 1
+        for index in range(start, len(posts)):
+            yield posts[index]
+
+    def iter_filtered(self, query: Dict[str, str], batch_size: int = 1000) -> Iterator[Post]:
+        posts = self.posts
+        for index in _filter_indexes(posts, query):
+            yield posts[index]
+
+    def changes(self, since: int, limit: int = CHANGES_LIMIT) -> List[Change]:
+        # writes log their changes before the posts file is swapped, the lock keeps both in step
+        with self._lock:
+            posts = self.posts
+            entries = self.change_log.since(since, limit)
+        changes = []
+        for seq, post_id, deleted in entries:
+            index = None if deleted else posts.find(post_id)
+            changes.append(Change(seq, post_id, None if index is None else posts[index]))
+        return changes
+
+    def stats(self, top_users: int = TOP_USERS) -> PostStats:
+        with self._lock:
+            if self._stats is None:
+                self._stats = StatsAccumulator()
+                for post in self.posts:
+                    self._stats.add(post)
+            return self._stats.stats(top_users)
 
     def add(self, post: Post) -> bool:
-        if post not in self.current_posts:
-            self.current_posts.append(post)
-            self._write_to_file()
+        with self._lock:
+            if self.posts.find(post.id) is not None:
+                return False
+            self._rewrite([post])
             return True
-        return False
+
+    def add_many(self, posts: List[Post]) -> int:
+        with self._lock:
+            self._rewrite(list({post.id: post for post in posts}.values()))
+        return len(posts)
+
+    def add_batch(self, posts: List[Post]) -> List[bool]:
+        with self._lock:
+            results = []
+            added: Dict[str, Post] = {}
+            for post in posts:
+                results.append(post.id not in added and self.posts.find(post.id) is None)
+                if results[-1]:
+                    added[post.id] = post
+            # one rewrite and one change log fsync for the whole batch
+            if added:
+                self._rewrite(list(added.values()))
+            return results
 
     def update(self, post_id: str, new_post: Post) -> bool:
-        try:
-            post = self.get_by_id(post_id)
-            if new_post not in self.current_posts:
-                self.current_posts = [p if p != post else new_post for p in self.current_posts]
-                self._write_to_file()
-            else:
-                raise PostNotFoundException
+        with self._lock:
+            if self.posts.find(post_id) is None:
+                return False
+            if new_post.id != post_id and self.posts.find(new_post.id) is not None:
+                return False
+            self._rewrite([new_post], removed={post_id})
             return True
-        except PostNotFoundException:
-            return False
 
     def delete(self, post_id: str) -> bool:
-        try:
-            post = self.get_by_id(post_id)
-            self.current_posts.remove(post)
-            self._write_to_file()
+        with self._lock:
+            if self.posts.find(post_id) is None:
+                return False
+            self._rewrite([], removed={post_id})
             return True
-        except PostNotFoundException:
-            return False
@@ -1,22 +1,31 @@
 import logging
-from typing import List, Dict, Any
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, List, Dict, Any, Sequence, Tuple
 
-from pymongo import MongoClient, DESCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReplaceOne, ReturnDocument
+from pymongo.cursor import Cursor
 from pymongo.database import Collection
 from pymongo.errors import CollectionInvalid
 
 from .base import DB
-from .constants import POSTS_PER_PAGE
+from .changes import CHANGES_LIMIT, Change
+from .constants import POSTS_PER_PAGE, USER_FIELDS, CATEGORY_NAME, DATE_NAME, MIN_VOTES_NAME, MAX_VOTES_NAME, \
+    LAST_POST_NAME, PAGINATION_NAME
 from .exceptions import PostNotFoundException
-from ..post import Post
+from .projection import needs_user
+from .stats import TOP_USERS, VOTE_BUCKETS, PostStats
+from ..post import Post, as_datetime
 from ..utils import get_config
 
 _LOGGER = logging.getLogger(__name__)
 
-CONFIG = get_config().get('mongo', {})
-
-POSTS_COLLECTION_NAME = CONFIG.get('posts_collection_name', 'posts')
-USERS_COLLECTION_NAME = CONFIG.get('users_collection_name', 'users')
+POSTS_COLLECTION_NAME = 'posts'
+USERS_COLLECTION_NAME = 'users'
+# compacted log of changes: latest change of every post, like an oplog that keeps one entry per document
+CHANGES_COLLECTION_NAME = 'post_changes'
+COUNTERS_COLLECTION_NAME = 'counters'
+CHANGES_COUNTER = 'post_changes'
 
 POST_ONLY_FIELDS = {
     '_id': 0,
@@ -25,13 +34,64 @@ POST_ONLY_FIELDS = {
 USER_ONLY_FIELDS = {
     '_id': 0
 }
+CHANGE_FIELDS = {
+    '_id': 0,
+    'id': 1,
+    'seq': 1,
+    'deleted': 1
+}
+USER_KARMA_FIELDS = {
+    '_id': 0,
+    'username': 1,
+    'user_karma': 1
+}
+
+# number of vote range upper bounds the post reached, same as bisect_right over VOTE_BUCKETS
+VOTE_BUCKET_EXPRESSION = {'$add': [{'$cond': [{'$gte': ['$number_of_votes', bound]}, 1, 0]} for bound in VOTE_BUCKETS]}
+# documents written before post_date was stored as a date keep it as a string until create() converts them
+POST_DAY_EXPRESSION = {'$dateToString': {'format': '%Y-%m-%d', 'date': {'$toDate': '$post_date'}}}
+
+# Indexes follow the filter API like the ones of PostgreSQL: equality on category or range on votes or day, all
+# followed by id, so pages ordered by id and continued after lastPost are read from the index
+FILTER_INDEXES = [
+    [('post_category', ASCENDING), ('id', ASCENDING)],
+    [('number_of_votes', ASCENDING), ('id', ASCENDING)],
+    [('post_date', ASCENDING), ('id', ASCENDING)],
+]
+# strings of post_date written by server requests before it was stored as a date
+POST_DATE_TO_DATE = [{'$set': {'post_date': {'$toDate': '$post_date'}}}]
+
+# documents fetched per round trip of a cursor, default first batch is 101 documents
+FIND_BATCH_SIZE = 1000
+
+STATS_PIPELINE = [{'$facet': {
+    'categories': [{'$group': {'_id': '$post_category', 'posts': {'$sum': 1}}}],
+    'votes': [{'$group': {'_id': VOTE_BUCKET_EXPRESSION, 'posts': {'$sum': 1}}}],
+    'days': [{'$group': {'_id': POST_DAY_EXPRESSION, 'posts': {'$sum': 1}}}],
+}}]
+
+
+def _top_users_pipeline(posts_collection_name: str, top_users: int) -> List[Dict[str, Any]]:
+    """
+    Users with the most karma walked along their karma index, users stay after their posts are deleted and the
+    lookup of one of their posts skips them
+    """
+    return [{'$sort': {'user_karma': DESCENDING, 'username': ASCENDING}},
+            {'$lookup': {'from': posts_collection_name, 'let': {'username': '$username'},
+                         'pipeline': [{'$match': {'$expr': {'$eq': ['$username', '$$username']}}}, {'$limit': 1},
+                                      {'$project': {'_id': 1}}],
+                         'as': 'posts'}},
+            {'$match': {'posts': {'$ne': []}}},
+            {'$limit': top_users},
+            {'$project': USER_KARMA_FIELDS}]
 
 
 def _generate_post_document(post: Post) -> Dict[str, Any]:
     return {
         'id': post.id,
         'post_url': post.post_url,
-        'post_date': post.post_date,
+        # posts written through the server keep post date as a string, a date can be compared by range
+        'post_date': as_datetime(post.post_date),
         'number_of_comments': post.number_of_comments,
         'number_of_votes': post.number_of_votes,
         'post_category': post.post_category,
@@ -49,32 +109,49 @@ def _generate_user_document(post: Post) -> Dict[str, Any]:
         }
 
 
+def _day_range(day: str) -> Dict[str, datetime]:
+    """
+    Range of post dates within day in UTC, like the day index of PostgreSQL
+    """
+    start = datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return {'$gte': start, '$lt': start + timedelta(days=1)}
+
+
 def _generate_filter(query: Dict[str, str]) -> Dict[str, Any]:
     find: Dict[str, Any] = {}
-    if 'category' in query:
-        find['post_category'] = query['category']
-    if 'date' in query:
-        find['post_date'] = query['date']
-    if 'minVotes' in query:
-        find['number_of_votes'] = {'$gte': int(query['minVotes'])}
-    if 'maxVotes' in query:
+    if CATEGORY_NAME in query:
+        find['post_category'] = query[CATEGORY_NAME]
+    if DATE_NAME in query:
+        find['post_date'] = _day_range(query[DATE_NAME])
+    if MIN_VOTES_NAME in query:
+        find['number_of_votes'] = {'$gte': int(query[MIN_VOTES_NAME])}
+    if MAX_VOTES_NAME in query:
         if 'number_of_votes' not in find:
             find['number_of_votes'] = {}
-        find['number_of_votes']['$lte'] = int(query['maxVotes'])
-    if 'lastPost' in query:
-        find['id'] = {'$gt': query['lastPost']}
+        find['number_of_votes']['$lte'] = int(query[MAX_VOTES_NAME])
+    if LAST_POST_NAME in query:
+        find['id'] = {'$gt': query[LAST_POST_NAME]}
     return find
 
 
 class MongoDB(DB):
 
     def __init__(self, conn_string: str) -> None:
-        client = MongoClient(conn_string)
+        # dates are read back as aware UTC datetimes, like PostgreSQL returns them
+        client = MongoClient(conn_string, tz_aware=True)
+        config = get_config().get('mongo', {})
 
+        self.posts_collection_name: str = config.get('posts_collection_name', POSTS_COLLECTION_NAME)
+        self.users_collection_name: str = config.get('users_collection_name', USERS_COLLECTION_NAME)
+        self.changes_collection_name: str = config.get('changes_collection_name', CHANGES_COLLECTION_NAME)
         self.db = client.get_database()
+        self.posts: Collection = self.db.get_collection(self.posts_collection_name)
+        self.users: Collection = self.db.get_collection(self.users_collection_name)
+        self.post_changes: Collection = self.db.get_collection(self.changes_collection_name)
+        self.counters: Collection = self.db.get_collection(COUNTERS_COLLECTION_NAME)
+        # held from taking sequence numbers until their changes are written, so they become visible in order
+        self._changes_lock = threading.Lock()
         self.create()
-        self.posts: Collection = self.db.get_collection(POSTS_COLLECTION_NAME)
-        self.users: Collection = self.db.get_collection(USERS_COLLECTION_NAME)
 
     def _post_exists(self, post_id: str) -> bool:
         return self.posts.count_documents({'id': post_id}) == 1
@@ -83,40 +160,155 @@ class MongoDB(DB):
         return self.users.count_documents({'username': username}) == 1
 
     def count(self) -> int:
-        return self.db.get_collection(POSTS_COLLECTION_NAME).count()
+        # read from collection metadata instead of counting documents
+        return self.posts.estimated_document_count()
 
     def drop(self) -> None:
-        self.db.drop_collection(POSTS_COLLECTION_NAME)
-        self.db.drop_collection(USERS_COLLECTION_NAME)
+        self.db.drop_collection(self.posts_collection_name)
+        self.db.drop_collection(self.users_collection_name)
+        self.db.drop_collection(self.changes_collection_name)
+        self.counters.delete_one({'_id': CHANGES_COUNTER})
 
     def create(self) -> None:
         try:
-            self.db.create_collection(POSTS_COLLECTION_NAME)
-            self.db.get_collection(POSTS_COLLECTION_NAME).create_index([('id', DESCENDING)], unique=True)
-            self.db.create_collection(USERS_COLLECTION_NAME)
-            self.db.get_collection(USERS_COLLECTION_NAME).create_index([('username', DESCENDING)], unique=True)
+            self.db.create_collection(self.posts_collection_name)
+            self.db.get_collection(self.posts_collection_name).create_index([('id', DESCENDING)], unique=True)
+            self.db.create_collection(self.users_collection_name)
+            self.db.get_collection(self.users_collection_name).create_index([('username', DESCENDING)], unique=True)
         except CollectionInvalid:
             _LOGGER.info('Collections already exists')
+        # indexes of stats top users, creating an existing index does nothing
+        self.db.get_collection(self.users_collection_name).create_index([('user_karma', DESCENDING),
+                                                                         ('username', ASCENDING)])
+        self.db.get_collection(self.posts_collection_name).create_index([('username', ASCENDING)])
+        self.posts.update_many({'post_date': {'$type': 'string'}}, POST_DATE_TO_DATE)
+        for keys in FILTER_INDEXES:
+            self.posts.create_index(keys)
+        self.post_changes.create_index([('id', ASCENDING)], unique=True)
+        self.post_changes.create_index([('seq', ASCENDING)])
+        # posts written before the change feed existed are its first changes
+        if self.post_changes.find_one({}, {'_id': 1}) is None:
+            self._record_changes((document['id'], False) for document in self.posts.find({}, {'_id': 0, 'id': 1}))
+
+    def _record_changes(self, changes: Iterable[Tuple[str, bool]]) -> None:
+        """
+        Numbers changes with a block of the changes counter and keeps them as the latest changes of their posts.
+        Numbers become visible in order to readers of one process only: a block taken by another process writing
+        to the same database may be written after a later one, and a reader past the later one skips it
+        :param changes: post id and whether post was deleted
+        """
+        changes = list(changes)
+        if not changes:
+            return
+        with self._changes_lock:
+            counter = self.counters.find_one_and_update({'_id': CHANGES_COUNTER}, {'$inc': {'seq': len(changes)}},
+                                                        upsert=True, return_document=ReturnDocument.AFTER)
+            # upsert returns the counter even when it did not exist
+            assert counter is not None
+            first = counter['seq'] - len(changes) + 1
+            # ordered bulk write applies changes one after another, readers see a prefix of the block
+            self.post_changes.bulk_write([ReplaceOne({'id': post_id}, {'id': post_id, 'seq': first + number,
+                                                                       'deleted': deleted}, upsert=True)
+                                          for number, (post_id, deleted) in enumerate(changes)], ordered=True)
+
+    def changes(self, since: int, limit: int = CHANGES_LIMIT) -> List[Change]:
+        entries = list(self.post_changes.find({'seq': {'$gt': since}}, CHANGE_FIELDS).sort('seq').limit(limit))
+        ids = [entry['id'] for entry in entries if not entry['deleted']]
+        documents = {document.pop('id'): document for document in self.posts.find({'id': {'$in': ids}}, {'_id': 0})}
+        usernames = list({document['username'] for document in documents.values()})
+        users = {user['username']: user for user in self.users.find({'username': {'$in': usernames}},
+                                                                   USER_ONLY_FIELDS)}
+        changes = []
+        for entry in entries:
+            document = documents.get(entry['id'])
+            post = None
+            if document is not None:
+                post = Post(**{**users[document['username']], **document})
+            changes.append(Change(entry['seq'], entry['id'], post))
+        return changes
+
+    def stats(self, top_users: int = TOP_USERS) -> PostStats:
+        groups = next(self.posts.aggregate(STATS_PIPELINE))
+        categories = {group['_id']: group['posts'] for group in groups['categories']}
+        users: List[Tuple[str, int]] = []
+        if top_users > 0:
+            users = [(user['username'], user['user_karma'])
+                     for user in self.users.aggregate(_top_users_pipeline(self.posts_collection_name, top_users))]
+        return PostStats(total=sum(categories.values()), categories=categories,
+                         votes={group['_id']: group['posts'] for group in groups['votes']},
+                         days={group['_id']: group['posts'] for group in groups['days']}, top_users=users)
+
+    def _with_users(self, documents: List[Dict[str, Any]]) -> List[Post]:
+        """
+        Joins post documents with their users read by one query
+        """
+        usernames = list({document['username'] for document in documents})
+        users = {user['username']: user for user in self.users.find({'username': {'$in': usernames}},
+                                                                   USER_ONLY_FIELDS)}
+        return [Post(**{**users[document['username']], **document}) for document in documents]
+
+    def _find_filtered(self, query: Dict[str, str], projection: Dict[str, Any]) -> Cursor:
+        results = self.posts.find(_generate_filter(query), projection).sort('id')
+        if query.get(PAGINATION_NAME, '') == 'true':
+            return results.limit(POSTS_PER_PAGE)
+        return results.batch_size(FIND_BATCH_SIZE)
+
+    def explain_filtered(self, query: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Returns explain output of the find run by get_filtered(query)
+        """
+        return self._find_filtered(query, POST_ONLY_FIELDS).explain()
 
     def get_all(self) -> List[Post]:
-        results = self.posts.find({}, POST_ONLY_FIELDS)
-        posts = []
-        for post in results:
-            user = self.users.find_one({'username': post['username']}, USER_ONLY_FIELDS)
-            merged = {**user, **post}
-            posts.append(Post(**merged))
-        return posts
+        return self._with_users(list(self.posts.find({}, POST_ONLY_FIELDS).batch_size(FIND_BATCH_SIZE)))
 
     def get_filtered(self, query: Dict[str, str]) -> List[Post]:
-        results = self.posts.find(_generate_filter(query), POST_ONLY_FIELDS).sort('id')
-        if query.get('pagination', '') == 'true':
-            results = results.limit(POSTS_PER_PAGE)
-        posts = []
-        for post in results:
-            user = self.users.find_one({'username': post['username']}, USER_ONLY_FIELDS)
-            merged = {**user, **post}
-            posts.append(Post(**merged))
-        return posts
+        return self._with_users(list(self._find_filtered(query, POST_ONLY_FIELDS)))
+
+    def get_projected(self, query: Dict[str, str], fields: Sequence[str]) -> List[Dict[str, Any]]:
+        post_fields = [field for field in fields if field not in USER_FIELDS]
+        projection = {'_id': 0, **{field: 1 for field in post_fields}}
+        if needs_user(fields):
+            projection['username'] = 1
+        documents = list(self._find_filtered(query, projection))
+        if needs_user(fields):
+            user_projection = {'_id': 0, 'username': 1, **{field: 1 for field in fields if field in USER_FIELDS}}
+            usernames = list({document['username'] for document in documents})
+            users = {user['username']: user for user in self.users.find({'username': {'$in': usernames}},
+                                                                       user_projection)}
+            documents = [{**users[document['username']], **document} for document in documents]
+        return [{field: document[field] for field in fields} for document in documents]
+
+    def iter_posts(self, after: str = '', batch_size: int = 1000) -> Iterator[Post]:
+        return self._iter_batches({}, after, batch_size)
+
+    def iter_filtered(self, query: Dict[str, str], batch_size: int = 1000) -> Iterator[Post]:
+        return self._iter_batches(_generate_filter(query), query.get(LAST_POST_NAME, ''), batch_size)
+
+    def _iter_batches(self, find: Dict[str, Any], after: str, batch_size: int) -> Iterator[Post]:
+        """
+        Reads posts matching find ordered by id, batch_size posts and their users at a time
+        """
+        while True:
+            documents = list(self.posts.find({**find, 'id': {'$gt': after}}, POST_ONLY_FIELDS).sort('id')
+                             .limit(batch_size))
+            if not documents:
+                return
+            posts = self._with_users(documents)
+            yield from posts
+            if len(posts) < batch_size:
+                return
+            after = posts[-1].id
+
+    def add_many(self, posts: List[Post]) -> int:
+        if not posts:
+            return 0
+        self.posts.bulk_write([ReplaceOne({'id': post.id}, _generate_post_document(post), upsert=True)
+                               for post in posts])
+        self.users.bulk_write([ReplaceOne({'username': post.username}, _generate_user_document(post), upsert=True)
+                               for post in posts])
+        self._record_changes((post.id, False) for post in posts)
+        return len(posts)
 
     def get_by_id(self, post_id: str) -> Post:
         if not self._post_exists(post_id):
@@ -134,6 +326,7 @@ class MongoDB(DB):
             self.users.insert_one(_generate_user_document(post))
         else:
             self.users.find_one_and_replace({'username': post.username}, _generate_user_document(post))
+        self._record_changes([(post.id, False)])
         return True
 
     def update(self, post_id: str, new_post: Post) -> bool:
@@ -144,10 +337,13 @@ class MongoDB(DB):
             self.users.find_one_and_replace({'username': new_post.username}, _generate_user_document(new_post))
         else:
             self.users.insert_one(_generate_user_document(new_post))
+        renamed = [(post_id, True)] if new_post.id != post_id else []
+        self._record_changes(renamed + [(new_post.id, False)])
         return True
 
     def delete(self, post_id: str) -> bool:
         if not self._post_exists(post_id):
             return False
         self.posts.delete_one({'id': post_id})
+        self._record_changes([(post_id, True)])
         return True
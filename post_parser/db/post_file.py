@@ -0,0 +1,207 @@
+"""
+Binary posts file read through mmap.
+
+Layout, all numbers little endian:
+    header   magic, version, number of records, offset of string heap
+    records  fixed width, sorted by post id: id, post date, numeric columns and (offset, length) of every string
+             in the heap
+    heap     utf-8 strings
+
+Opening a file reads only the header. Records are decoded when accessed, so memory in use is proportional
+to pages actually touched.
+"""
+import io
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from ..post import Post, as_datetime
+
+MAGIC = b'RPDB'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHQQ')
+# id, post date in microseconds since epoch, utc offset in seconds, number of comments, number of votes,
+# user karma, post karma, comment karma, then offset and length of post url, username, cake day and category
+RECORD = struct.Struct('<32sqiqqqqq' + 'QI' * 4)
+ID_SIZE = 32
+NUMBERS = struct.Struct('<qiqqqqq')
+STRING_REFS = struct.Struct('<' + 'QI' * 4)
+VOTES_OFFSET = ID_SIZE + struct.calcsize('<qiq')
+VOTES = struct.Struct('<q')
+CATEGORY_REF_OFFSET = ID_SIZE + NUMBERS.size + struct.calcsize('<QI') * 3
+STRING_REF = struct.Struct('<QI')
+
+# positions of numeric columns and of string references in unpacked RECORD
+NUMBER_COLUMNS = {'number_of_comments': 3, 'number_of_votes': 4, 'user_karma': 5, 'post_karma': 6,
+                  'comment_karma': 7}
+STRING_COLUMNS = {'post_url': 8, 'username': 10, 'user_cake_day': 12, 'post_category': 14}
+
+NAIVE_OFFSET = -2 ** 31
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# raw record: id, packed numeric columns and encoded strings
+RawRecord = Tuple[bytes, bytes, Tuple[bytes, bytes, bytes, bytes]]
+
+
+class PostFileError(ValueError):
+    pass
+
+
+def _encode_date(post_date: datetime) -> Tuple[int, int]:
+    offset = post_date.utcoffset()
+    if offset is None:
+        return (post_date.replace(tzinfo=timezone.utc) - EPOCH) // timedelta(microseconds=1), NAIVE_OFFSET
+    return (post_date - EPOCH) // timedelta(microseconds=1), int(offset.total_seconds())
+
+
+def _decode_date(microseconds: int, offset: int) -> datetime:
+    moment = EPOCH + timedelta(microseconds=microseconds)
+    if offset == NAIVE_OFFSET:
+        return moment.replace(tzinfo=None)
+    return moment.astimezone(timezone(timedelta(seconds=offset)))
+
+
+def encode_post(post: Post) -> RawRecord:
+    microseconds, offset = _encode_date(as_datetime(post.post_date))
+    numbers = NUMBERS.pack(microseconds, offset, post.number_of_comments, post.number_of_votes, post.user_karma,
+                           post.post_karma, post.comment_karma)
+    strings = (post.post_url.encode('utf-8'), post.username.encode('utf-8'), post.user_cake_day.encode('utf-8'),
+               post.post_category.encode('utf-8'))
+    return post.id.encode('ascii'), numbers, strings
+
+
+def write_post_file(path: str, records: Iterable[Union[Post, RawRecord]]) -> int:
+    """
+    Writes records sorted by id to a temporary file and renames it to path, so readers never see a partial file.
+    Records of an open PostFile can be passed as raw records to skip decoding
+    :return: number of written records
+    """
+    raw = sorted((record if isinstance(record, tuple) else encode_post(record) for record in records),
+                 key=lambda record: record[0])
+    heap_offset = HEADER.size + RECORD.size * len(raw)
+    temp_path = path + '.tmp'
+    with io.open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0, len(raw), heap_offset))
+        heap_position = heap_offset
+        for post_id, numbers, strings in raw:
+            refs: List[int] = []
+            for value in strings:
+                refs += [heap_position, len(value)]
+                heap_position += len(value)
+            file.write(post_id + numbers + STRING_REFS.pack(*refs))
+        for _, _, strings in raw:
+            file.write(b''.join(strings))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return len(raw)
+
+
+class PostFile:
+    """
+    Read-only view of a posts file
+    """
+
+    def __init__(self, path: str) -> None:
+        with io.open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise PostFileError(f'{path} is too short for a posts file')
+        magic, version, _, self.count, self.heap_offset = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise PostFileError(f'{path} is not a posts file of version {VERSION}')
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _record_offset(self, index: int) -> int:
+        return HEADER.size + RECORD.size * index
+
+    def _string(self, offset: int, length: int) -> str:
+        return self.map[offset:offset + length].decode('utf-8')
+
+    def id_at(self, index: int) -> str:
+        offset = self._record_offset(index)
+        return self.map[offset:offset + ID_SIZE].decode('ascii')
+
+    def votes_at(self, index: int) -> int:
+        return VOTES.unpack_from(self.map, self._record_offset(index) + VOTES_OFFSET)[0]
+
+    def category_at(self, index: int) -> bytes:
+        offset, length = STRING_REF.unpack_from(self.map, self._record_offset(index) + CATEGORY_REF_OFFSET)
+        return self.map[offset:offset + length]
+
+    def date_at(self, index: int) -> datetime:
+        microseconds, utc_offset = struct.unpack_from('<qi', self.map, self._record_offset(index) + ID_SIZE)
+        return _decode_date(microseconds, utc_offset)
+
+    def __getitem__(self, index: int) -> Post:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        _, microseconds, utc_offset, number_of_comments, number_of_votes, user_karma, post_karma, comment_karma, \
+            url_offset, url_length, username_offset, username_length, cake_day_offset, cake_day_length, \
+            category_offset, category_length = RECORD.unpack_from(self.map, self._record_offset(index))
+        return Post(post_url=self._string(url_offset, url_length),
+                    username=self._string(username_offset, username_length), user_karma=user_karma,
+                    user_cake_day=self._string(cake_day_offset, cake_day_length), post_karma=post_karma,
+                    comment_karma=comment_karma, post_date=_decode_date(microseconds, utc_offset),
+                    number_of_comments=number_of_comments, number_of_votes=number_of_votes,
+                    post_category=self._string(category_offset, category_length))
+
+    def fields_at(self, index: int, fields: Sequence[str]) -> Dict[str, Any]:
+        """
+        Post at index as dict of given fields, strings and date of other fields are not decoded
+        """
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        record = RECORD.unpack_from(self.map, self._record_offset(index))
+        values: Dict[str, Any] = {}
+        for field in fields:
+            if field in NUMBER_COLUMNS:
+                values[field] = record[NUMBER_COLUMNS[field]]
+            elif field in STRING_COLUMNS:
+                column = STRING_COLUMNS[field]
+                values[field] = self._string(record[column], record[column + 1])
+            elif field == 'post_date':
+                values[field] = _decode_date(record[1], record[2])
+            else:
+                values[field] = record[0].decode('ascii')
+        return values
+
+    def __iter__(self) -> Iterator[Post]:
+        for index in range(self.count):
+            yield self[index]
+
+    def raw(self, index: int) -> RawRecord:
+        """
+        Record as it is stored, for rewriting file without decoding posts
+        """
+        offset = self._record_offset(index)
+        refs = STRING_REFS.unpack_from(self.map, offset + ID_SIZE + NUMBERS.size)
+        strings = tuple(self.map[refs[num]:refs[num] + refs[num + 1]] for num in range(0, 8, 2))
+        return self.map[offset:offset + ID_SIZE], self.map[offset + ID_SIZE:offset + ID_SIZE + NUMBERS.size], \
+            (strings[0], strings[1], strings[2], strings[3])
+
+    def bisect(self, post_id: str) -> int:
+        """
+        Index of the first record with id greater or equal to post_id
+        """
+        key = post_id.encode('ascii')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self._record_offset(middle)
+            if self.map[offset:offset + ID_SIZE] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, post_id: str) -> Optional[int]:
+        index = self.bisect(post_id)
+        if index < self.count and self.id_at(index) == post_id:
+            return index
+        return None
@@ -0,0 +1,47 @@
+"""
+Sparse posts: only fields requested with ?fields= are read from database and serialized
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .constants import POST_FIELDS, USER_FIELDS
+from ..post import Post
+
+Projection = Tuple[str, ...]
+
+
+def parse_fields(value: Optional[str]) -> Optional[Projection]:
+    """
+    Parses comma separated field names, duplicates are dropped and order of POST_FIELDS is kept
+    :return: None if value is empty
+    :raises ValueError: on unknown field
+    """
+    if not value:
+        return None
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = names.difference(POST_FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+    return tuple(name for name in POST_FIELDS if name in names)
+
+
+def needs_user(fields: Sequence[str]) -> bool:
+    return not USER_FIELDS.isdisjoint(fields)
+
+
+def project(post: Post, fields: Sequence[str]) -> Dict[str, Any]:
+    return {name: getattr(post, name) for name in fields}
+
+
+def json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps_projected(rows: List[Dict[str, Any]]) -> str:
+    """
+    Serializes projected posts like PostSchema serializes whole posts
+    """
+    return json.dumps(rows, default=json_default)
@@ -1,17 +1,34 @@
+import functools
 import logging
-from typing import List, Dict
+import re
+import sys
+import threading
+from timeit import default_timer
+from typing import Any, IO, Iterable, Iterator, List, Dict, FrozenSet, Match, NamedTuple, Optional, Sequence, Set, \
+    Tuple
 
 import psycopg2
+import psycopg2.sql
 
 from .base import DB
-from .constants import POSTS_PER_PAGE
+from .constants import POSTS_PER_PAGE, MIN_VOTES_NAME, MAX_VOTES_NAME, CATEGORY_NAME, DATE_NAME, LAST_POST_NAME, \
+    PAGINATION_NAME, FILTER_NAMES, POST_FIELDS
+from .changes import CHANGES_LIMIT, Change
 from .exceptions import PostNotFoundException
-from ..post import Post
+from .projection import Projection, needs_user
+from .stats import TOP_USERS, VOTE_BUCKETS, PostStats
+from ..post import Post, as_datetime
 
 _LOGGER = logging.getLogger(__name__)
 
+# count() is kept up to date by writes of this connection and read again after this many seconds, so writes of
+# other processes are seen too
+COUNT_TTL = 60.0
+
 DROP_TABLES = '''DROP TABLE IF EXISTS posts;
 DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS post_tombstones;
+DROP SEQUENCE IF EXISTS post_changes_seq;
 '''
 
 CREATE_TABLES = '''CREATE TABLE IF NOT EXISTS users(
@@ -40,6 +57,39 @@ CONSTRAINT fk_user
 );
 '''
 
+# Indexes follow the filter API: equality on category or day and range on votes, all ordered by id.
+# Day is taken in UTC because DATE() of timestamptz depends on session time zone and can't be indexed
+CREATE_INDEXES = '''CREATE INDEX IF NOT EXISTS posts_category_id_idx ON posts (post_category, id);
+CREATE INDEX IF NOT EXISTS posts_votes_id_idx ON posts (number_of_votes, id);
+CREATE INDEX IF NOT EXISTS posts_day_id_idx ON posts (((post_date AT TIME ZONE 'UTC')::date), id);
+CREATE INDEX IF NOT EXISTS posts_user_name_idx ON posts (user_name);
+'''
+
+CREATE_STATS_INDEXES = '''CREATE INDEX IF NOT EXISTS users_karma_idx ON users (user_karma DESC, username);
+'''
+
+# every write takes the next number of post_changes_seq, existing posts are numbered when the column is added.
+# Deleted posts leave a tombstone with the number of the delete
+CREATE_CHANGE_FEED = '''CREATE SEQUENCE IF NOT EXISTS post_changes_seq;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS change_seq bigint NOT NULL DEFAULT nextval('post_changes_seq');
+CREATE INDEX IF NOT EXISTS posts_change_seq_idx ON posts (change_seq);
+CREATE TABLE IF NOT EXISTS post_tombstones (
+post_id char(32),
+change_seq bigint NOT NULL,
+PRIMARY KEY (post_id)
+);
+CREATE INDEX IF NOT EXISTS post_tombstones_change_seq_idx ON post_tombstones (change_seq);
+'''
+
+MIGRATIONS = [CREATE_INDEXES, CREATE_STATS_INDEXES, CREATE_CHANGE_FEED]
+
+# secondary indexes are rebuilt by migrate() after loading into an empty table, it is faster than keeping them updated
+DROP_INDEXES = '''DROP INDEX IF EXISTS posts_category_id_idx, posts_votes_id_idx, posts_day_id_idx, posts_user_name_idx;
+'''
+
+POSTS_EMPTY = '''SELECT NOT EXISTS (SELECT 1 FROM posts);
+'''
+
 POST_TABLE_LENGTH = '''SELECT COUNT(*)
 FROM posts p;
 '''
@@ -54,6 +104,24 @@ ORDER BY p.id ASC
 {};
 '''
 
+SELECT_POSTS_PROJECTED = '''SELECT {}
+FROM posts p
+{}{}
+ORDER BY p.id ASC
+{};
+'''
+
+USERS_JOIN = '''INNER JOIN users u
+ON u.username = p.user_name
+'''
+
+PROJECTED_COLUMNS = {
+    'id': 'p.id', 'post_url': 'p.post_url', 'username': 'p.user_name', 'user_karma': 'u.user_karma',
+    'user_cake_day': 'u.user_cake_day', 'post_karma': 'u.post_karma', 'comment_karma': 'u.comment_karma',
+    'post_date': 'p.post_date', 'number_of_comments': 'p.number_of_comments',
+    'number_of_votes': 'p.number_of_votes', 'post_category': 'p.post_category'
+}
+
 SELECT_ALL_POSTS = '''SELECT p.post_url, u.username, u.user_karma, u.user_cake_day, u.post_karma, u.comment_karma,
     p.post_date, p.number_of_comments, p.number_of_votes, p.post_category
 FROM posts p
@@ -61,6 +129,16 @@ INNER JOIN users u
 ON u.username = p.user_name;
 '''
 
+SELECT_POSTS_AFTER = '''SELECT p.post_url, u.username, u.user_karma, u.user_cake_day, u.post_karma, u.comment_karma,
+    p.post_date, p.number_of_comments, p.number_of_votes, p.post_category
+FROM posts p
+INNER JOIN users u
+ON u.username = p.user_name
+WHERE p.id > %(after)s
+ORDER BY p.id ASC
+LIMIT %(limit)s;
+'''
+
 SELECT_POST_BY_ID = '''SELECT p.post_url, u.username, u.user_karma, u.user_cake_day, u.post_karma, u.comment_karma,
     p.post_date, p.number_of_comments, p.number_of_votes, p.post_category
 FROM posts p
@@ -74,29 +152,68 @@ FROM posts p
 WHERE p.id = %(post_id)s;
 '''
 
-INSERT_USER = '''INSERT INTO users
-VALUES (%(username)s, %(user_karma)s, %(user_cake_day)s, %(post_karma)s, %(comment_karma)s)
-ON CONFLICT DO NOTHING;
-'''
-
-INSERT_POST = '''INSERT INTO posts
+# user is upserted in the same statement, foreign key is checked after both inserts
+INSERT_POST = '''WITH new_user AS (
+    INSERT INTO users
+    VALUES (%(username)s, %(user_karma)s, %(user_cake_day)s, %(post_karma)s, %(comment_karma)s)
+    ON CONFLICT DO NOTHING
+)
+INSERT INTO posts
 VALUES (%(id)s, %(post_url)s, %(post_date)s, %(number_of_comments)s, %(number_of_votes)s, %(post_category)s,
 %(username)s);
 '''
 
-DELETE_POST_BY_ID = '''DELETE FROM posts p
-WHERE p.id = %(post_id)s;
+# posts of one group commit in one statement, arrays are unnested in batch order so the first of repeated ids wins.
+# Returns ids of added posts
+INSERT_POSTS = '''WITH batch AS (
+    SELECT *
+    FROM unnest(%(ids)s::varchar[], %(post_urls)s::varchar[], %(post_dates)s::timestamptz[],
+        %(numbers_of_comments)s::int[], %(numbers_of_votes)s::bigint[], %(post_categories)s::varchar[],
+        %(usernames)s::varchar[], %(user_karmas)s::bigint[], %(user_cake_days)s::varchar[],
+        %(post_karmas)s::bigint[], %(comment_karmas)s::bigint[])
+        WITH ORDINALITY AS b(id, post_url, post_date, number_of_comments, number_of_votes, post_category, username,
+            user_karma, user_cake_day, post_karma, comment_karma, ord)
+), new_users AS (
+    INSERT INTO users
+    SELECT username, user_karma, user_cake_day, post_karma, comment_karma
+    FROM batch
+    ORDER BY ord
+    ON CONFLICT DO NOTHING
+)
+INSERT INTO posts (id, post_url, post_date, number_of_comments, number_of_votes, post_category, user_name)
+SELECT id, post_url, post_date, number_of_comments, number_of_votes, post_category, username
+FROM batch
+ORDER BY ord
+ON CONFLICT DO NOTHING
+RETURNING id;
 '''
 
-UPDATE_POST_BY_ID = '''
-INSERT INTO users
-VALUES (%(username)s, %(user_karma)s, %(user_cake_day)s, %(post_karma)s, %(comment_karma)s)
-ON CONFLICT (username) DO UPDATE SET
-    user_karma = %(user_karma)s,
-    user_cake_day = %(user_cake_day)s,
-    post_karma = %(post_karma)s,
-    comment_karma = %(comment_karma)s;
+DELETE_POST_BY_ID = '''WITH deleted AS (
+    DELETE FROM posts p
+    WHERE p.id = %(post_id)s
+    RETURNING p.id
+)
+INSERT INTO post_tombstones
+SELECT id, nextval('post_changes_seq') FROM deleted
+ON CONFLICT (post_id) DO UPDATE SET change_seq = EXCLUDED.change_seq;
+'''
 
+UPDATE_POST_BY_ID = '''WITH updated_user AS (
+    INSERT INTO users
+    SELECT %(username)s::varchar, %(user_karma)s::bigint, %(user_cake_day)s::varchar, %(post_karma)s::bigint,
+        %(comment_karma)s::bigint
+    WHERE EXISTS (SELECT 1 FROM posts WHERE id = %(update_id)s)
+    ON CONFLICT (username) DO UPDATE SET
+        user_karma = EXCLUDED.user_karma,
+        user_cake_day = EXCLUDED.user_cake_day,
+        post_karma = EXCLUDED.post_karma,
+        comment_karma = EXCLUDED.comment_karma
+), renamed AS (
+    INSERT INTO post_tombstones
+    SELECT id, nextval('post_changes_seq') FROM posts
+    WHERE id = %(update_id)s AND id <> %(id)s
+    ON CONFLICT (post_id) DO UPDATE SET change_seq = EXCLUDED.change_seq
+)
 UPDATE posts p
 SET id = %(id)s,
     post_url = %(post_url)s,
@@ -104,80 +221,462 @@ SET id = %(id)s,
     number_of_comments = %(number_of_comments)s,
     number_of_votes = %(number_of_votes)s,
     post_category = %(post_category)s,
-    user_name = %(username)s
+    user_name = %(username)s,
+    change_seq = nextval('post_changes_seq')
 WHERE p.id = %(update_id)s;
 '''
 
-MIN_VOTES_NAME = 'minVotes'
-MAX_VOTES_NAME = 'maxVotes'
-CATEGORY_NAME = 'category'
-DATE_NAME = 'date'
-LAST_POST_NAME = 'lastPost'
-PAGINATION_NAME = 'pagination'
+# changes after since, post columns are null for tombstones. Both branches stop at limit on their own index
+SELECT_CHANGES = '''SELECT c.change_seq, c.id, p.post_url, u.username, u.user_karma, u.user_cake_day, u.post_karma,
+    u.comment_karma, p.post_date, p.number_of_comments, p.number_of_votes, p.post_category
+FROM (
+    (SELECT change_seq, id FROM posts WHERE change_seq > %(since)s ORDER BY change_seq LIMIT %(limit)s)
+    UNION ALL
+    (SELECT change_seq, post_id FROM post_tombstones WHERE change_seq > %(since)s ORDER BY change_seq
+     LIMIT %(limit)s)
+    ORDER BY change_seq
+    LIMIT %(limit)s
+) c
+LEFT JOIN posts p
+ON p.id = c.id AND p.change_seq = c.change_seq
+LEFT JOIN users u
+ON u.username = p.user_name
+ORDER BY c.change_seq;
+'''
 
+# one statement sees one snapshot, groupings are read from covering indexes.
+# width_bucket with thresholds array returns number of thresholds less or equal to value
+SELECT_STATS = f'''SELECT
+    (SELECT COALESCE(json_object_agg(post_category, posts), '{{}}')
+     FROM (SELECT post_category, COUNT(*) AS posts FROM posts GROUP BY post_category) categories),
+    (SELECT COALESCE(json_object_agg(bucket, posts), '{{}}')
+     FROM (SELECT width_bucket(number_of_votes, ARRAY[{', '.join(map(str, VOTE_BUCKETS))}]::bigint[]) AS bucket,
+               COUNT(*) AS posts
+           FROM posts GROUP BY bucket) votes),
+    (SELECT COALESCE(json_object_agg(day, posts), '{{}}')
+     FROM (SELECT (post_date AT TIME ZONE 'UTC')::date AS day, COUNT(*) AS posts FROM posts GROUP BY day) days),
+    (SELECT COALESCE(json_agg(json_build_array(username, user_karma)), '[]')
+     FROM (SELECT u.username, u.user_karma
+           FROM users u
+           WHERE EXISTS (SELECT 1 FROM posts p WHERE p.user_name = u.username)
+           ORDER BY u.user_karma DESC, u.username ASC
+           LIMIT %(limit)s) top_users);
+'''
 
-def _generate_filtered_select_clause(query: Dict[str, str]) -> str:
-    if not query:
-        return SELECT_ALL_POSTS
+STAGING_COLUMNS = ('id', 'post_url', 'post_date', 'number_of_comments', 'number_of_votes', 'post_category',
+                   'username', 'user_karma', 'user_cake_day', 'post_karma', 'comment_karma')
+
+CREATE_STAGING_TABLE = '''CREATE TEMPORARY TABLE IF NOT EXISTS posts_staging (
+ord bigserial,
+id char(32) not null,
+post_url varchar not null,
+post_date timestamp with time zone not null,
+number_of_comments int not null,
+number_of_votes bigint not null,
+post_category varchar not null,
+username varchar not null,
+user_karma bigint not null,
+user_cake_day varchar not null,
+post_karma bigint not null,
+comment_karma bigint not null
+);
+TRUNCATE posts_staging;
+'''
+
+COPY_READ_SIZE = 2 ** 16
+
+COPY_TO_STAGING = f'''COPY posts_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN;'''
+
+# later rows of the same user or post win, both upserts run in one implicit transaction
+UPSERT_FROM_STAGING = '''INSERT INTO users
+SELECT DISTINCT ON (username) username, user_karma, user_cake_day, post_karma, comment_karma
+FROM posts_staging
+ORDER BY username, ord DESC
+ON CONFLICT (username) DO UPDATE SET
+    user_karma = EXCLUDED.user_karma,
+    user_cake_day = EXCLUDED.user_cake_day,
+    post_karma = EXCLUDED.post_karma,
+    comment_karma = EXCLUDED.comment_karma;
+
+INSERT INTO posts
+SELECT DISTINCT ON (id) id, post_url, post_date, number_of_comments, number_of_votes, post_category, username
+FROM posts_staging
+ORDER BY id, ord DESC
+ON CONFLICT (id) DO UPDATE SET
+    post_url = EXCLUDED.post_url,
+    post_date = EXCLUDED.post_date,
+    number_of_comments = EXCLUDED.number_of_comments,
+    number_of_votes = EXCLUDED.number_of_votes,
+    post_category = EXCLUDED.post_category,
+    user_name = EXCLUDED.user_name,
+    change_seq = nextval('post_changes_seq');
+
+TRUNCATE posts_staging;
+'''
+
+# columns and separator of FileDB lines, see Post.__str__
+COPY_FILE_LINES = '''COPY (
+    SELECT p.id, p.post_url, u.username, u.user_karma, u.user_cake_day, u.post_karma, u.comment_karma,
+        to_char(p.post_date AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS.US+00:00'), p.number_of_comments,
+        p.number_of_votes, p.post_category
+    FROM posts p
+    INNER JOIN users u
+    ON u.username = p.user_name
+    ORDER BY p.id
+) TO STDOUT WITH (FORMAT text, DELIMITER ';');
+'''
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+_PARAM_PATTERN = re.compile(r'%\((\w+)\)s')
+
+
+class Statement(NamedTuple):
+    name: str
+    prepare: str
+    execute: str
+
+
+def _prepared_statement(name: str, sql: str) -> Statement:
+    """
+    Turns single statement with %(name)s params into PREPARE text with $n params and matching EXECUTE text
+    """
+    params: List[str] = []
+
+    def placeholder(match: Match[str]) -> str:
+        if match.group(1) not in params:
+            params.append(match.group(1))
+        return f'${params.index(match.group(1)) + 1}'
+
+    body = _PARAM_PATTERN.sub(placeholder, sql).strip().rstrip(';')
+    args = ', '.join(f'%({param})s' for param in params)
+    execute = f'EXECUTE {name} ({args});' if params else f'EXECUTE {name};'
+    return Statement(name, f'PREPARE {name} AS {body};', execute)
+
+
+def _filter_clauses(filters: FrozenSet[str], paginated: bool) -> Tuple[str, str]:
+    """
+    :return: WHERE and LIMIT clauses of filtered select
+    """
     statements = []
     limit = ''
-    if CATEGORY_NAME in query:
+    if CATEGORY_NAME in filters:
         statements.append('p.post_category = %(category)s')
-    if DATE_NAME in query:
-        statements.append(f'DATE(p.post_date) = %(date)s')
-    if MIN_VOTES_NAME in query:
+    if DATE_NAME in filters:
+        statements.append("(p.post_date AT TIME ZONE 'UTC')::date = %(date)s")
+    if MIN_VOTES_NAME in filters:
         statements.append(f'p.number_of_votes >= %(min_votes)s')
-    if MAX_VOTES_NAME in query:
+    if MAX_VOTES_NAME in filters:
         statements.append(f'p.number_of_votes <=  %(max_votes)s')
-    page = query.get(PAGINATION_NAME, '')
-    if LAST_POST_NAME in query:
+    if LAST_POST_NAME in filters:
         statements.insert(0, f'p.id > %(last_post)s')
-    if page == 'true':
+    if paginated:
         limit = f'LIMIT {POSTS_PER_PAGE}'
     if len(statements) == 0:
         where = ''
     else:
         where = 'WHERE ' + ' AND '.join(statements)
-    return SELECT_POSTS_FILTERED.format(where, limit)
+    return where, limit
+
+
+@functools.lru_cache(maxsize=None)
+def _filtered_select_clause(filters: FrozenSet[str], paginated: bool) -> str:
+    return SELECT_POSTS_FILTERED.format(*_filter_clauses(filters, paginated))
+
+
+def _filter_key(query: Dict[str, str]) -> Tuple[FrozenSet[str], bool]:
+    return frozenset(name for name in FILTER_NAMES if name in query), query.get(PAGINATION_NAME, '') == 'true'
+
+
+def _generate_filtered_select_clause(query: Dict[str, str]) -> str:
+    if not query:
+        return SELECT_ALL_POSTS
+    return _filtered_select_clause(*_filter_key(query))
+
+
+@functools.lru_cache(maxsize=None)
+def _filtered_statement(filters: FrozenSet[str], paginated: bool) -> Statement:
+    names = sorted(filter_name.lower() for filter_name in filters)
+    name = '_'.join(['filtered'] + names + (['page'] if paginated else []))
+    return _prepared_statement(name, _filtered_select_clause(filters, paginated))
+
+
+@functools.lru_cache(maxsize=None)
+def _batch_statement(filters: FrozenSet[str]) -> Statement:
+    """
+    Filtered select of the next %(limit)s posts after %(last_post)s
+    """
+    where, _ = _filter_clauses(filters | {LAST_POST_NAME}, False)
+    names = sorted(filter_name.lower() for filter_name in filters | {LAST_POST_NAME})
+    return _prepared_statement('_'.join(['batch'] + names), SELECT_POSTS_FILTERED.format(where, 'LIMIT %(limit)s'))
+
+
+@functools.lru_cache(maxsize=None)
+def _projected_statement(fields: Projection, filters: FrozenSet[str], paginated: bool) -> Statement:
+    """
+    Filtered select of given fields only, users are joined only for user fields
+    """
+    columns = ', '.join(PROJECTED_COLUMNS[field] for field in fields)
+    join = USERS_JOIN if needs_user(fields) else ''
+    where, limit = _filter_clauses(filters, paginated)
+    # field set as bit mask keeps the name under 63 characters
+    mask = sum(1 << POST_FIELDS.index(field) for field in fields)
+    names = sorted(filter_name.lower() for filter_name in filters)
+    name = '_'.join([f'projected_{mask}'] + names + (['page'] if paginated else []))
+    return _prepared_statement(name, SELECT_POSTS_PROJECTED.format(columns, join, where, limit))
+
+
+COUNT_POSTS_STATEMENT = _prepared_statement('count_posts', POST_TABLE_LENGTH)
+SELECT_ALL_STATEMENT = _prepared_statement('select_all_posts', SELECT_ALL_POSTS)
+SELECT_AFTER_STATEMENT = _prepared_statement('select_posts_after', SELECT_POSTS_AFTER)
+SELECT_BY_ID_STATEMENT = _prepared_statement('select_post_by_id', SELECT_POST_BY_ID)
+INSERT_POST_STATEMENT = _prepared_statement('insert_post', INSERT_POST)
+INSERT_POSTS_STATEMENT = _prepared_statement('insert_posts', INSERT_POSTS)
+UPDATE_POST_STATEMENT = _prepared_statement('update_post_by_id', UPDATE_POST_BY_ID)
+DELETE_POST_STATEMENT = _prepared_statement('delete_post_by_id', DELETE_POST_BY_ID)
+STATS_STATEMENT = _prepared_statement('select_stats', SELECT_STATS)
+CHANGES_STATEMENT = _prepared_statement('select_changes', SELECT_CHANGES)
+
+
+def _post_params(post: Post) -> Dict[str, Any]:
+    return {'username': post.username, 'user_karma': post.user_karma, 'user_cake_day': post.user_cake_day,
+            'post_karma': post.post_karma, 'comment_karma': post.comment_karma, 'id': post.id,
+            'post_url': post.post_url, 'post_date': post.post_date, 'number_of_comments': post.number_of_comments,
+            'number_of_votes': post.number_of_votes, 'post_category': post.post_category}
+
+
+def _batch_params(posts: List[Post]) -> Dict[str, Any]:
+    return {'ids': [post.id for post in posts], 'post_urls': [post.post_url for post in posts],
+            # posts written through the server keep post date as a string, a text array is not cast to timestamps
+            'post_dates': [as_datetime(post.post_date) for post in posts],
+            'numbers_of_comments': [post.number_of_comments for post in posts],
+            'numbers_of_votes': [post.number_of_votes for post in posts],
+            'post_categories': [post.post_category for post in posts],
+            'usernames': [post.username for post in posts],
+            'user_karmas': [post.user_karma for post in posts],
+            'user_cake_days': [post.user_cake_day for post in posts],
+            'post_karmas': [post.post_karma for post in posts],
+            'comment_karmas': [post.comment_karma for post in posts]}
+
+
+def _copy_text(value: str) -> str:
+    if '\\' in value or '\t' in value or '\n' in value or '\r' in value:
+        return value.translate(_COPY_ESCAPES)
+    return value
+
+
+def _copy_row(post: Post) -> str:
+    post_date = as_datetime(post.post_date).isoformat()
+    return f'{post.id}\t{_copy_text(post.post_url)}\t{post_date}\t{post.number_of_comments}\t' \
+           f'{post.number_of_votes}\t{_copy_text(post.post_category)}\t{_copy_text(post.username)}\t' \
+           f'{post.user_karma}\t{_copy_text(post.user_cake_day)}\t{post.post_karma}\t{post.comment_karma}\n'
+
+
+class _CopyReader:
+    """
+    Readable view of posts in COPY text format for copy_expert, rows are rendered only when COPY asks for more data
+    """
+
+    def __init__(self, posts: Iterable[Post]) -> None:
+        self.posts = iter(posts)
+        self.buffer = ''
+        self.rows = 0
+
+    def read(self, size: Optional[int] = -1) -> str:
+        size = size if size is not None and size >= 0 else sys.maxsize
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        for post in self.posts:
+            row = _copy_row(post)
+            self.rows += 1
+            chunks.append(row)
+            length += len(row)
+            if length >= size:
+                break
+        data = ''.join(chunks)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def _generate_filter_params(query: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        'min_votes': int(query.get(MIN_VOTES_NAME, '0')), 'max_votes': int(query.get(MAX_VOTES_NAME, '0')),
+        'category': query.get(CATEGORY_NAME, ''), 'date': query.get(DATE_NAME, ''),
+        'last_post': query.get(LAST_POST_NAME, '')
+    }
 
 
 class PostgresDB(DB):
-    def __init__(self, name: str, user: str, password: str, host: str, port: int) -> None:
-        self.conn: psycopg2.connect = psycopg2.connect(dbname=name, user=user, password=password, host=host, port=port)
-        self.cursor: psycopg2.extensions.cursor = self.conn.cursor()
+    def __init__(self, name: str, user: str, password: str, host: str, port: int, schema: Optional[str] = None
+                 ) -> None:
+        """
+        :param schema: schema tables are created and used in instead of the default search path, created if missing
+        """
+        # search path is set by the connection, so create() below never touches tables of the default schema
+        options = f'-c search_path={schema}' if schema is not None else None
+        self.conn: psycopg2.connect = psycopg2.connect(dbname=name, user=user, password=password, host=host, port=port,
+                                                       options=options)
+        # every call is a single statement, so it commits by itself without an extra COMMIT round trip
+        self.conn.autocommit = True
+        self._local = threading.local()
+        self._prepared: Set[str] = set()
+        self._prepare_lock = threading.Lock()
+        self._count: Optional[int] = None
+        self._count_read = 0.0
+        self._count_lock = threading.Lock()
+        if schema is not None:
+            self.cursor.execute(psycopg2.sql.SQL('CREATE SCHEMA IF NOT EXISTS {}').format(
+                psycopg2.sql.Identifier(schema)))
         self.create()
 
+    @property
+    def cursor(self) -> psycopg2.extensions.cursor:
+        """
+        Cursor of the calling thread, server threads share the connection but a cursor keeps results of one statement
+        """
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._local.cursor = self.conn.cursor()
+        return cursor
+
+    def _execute(self, statement: Statement, params: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Prepares statement once per connection and executes it, so only params are sent and plan is reused
+        """
+        if statement.name not in self._prepared:
+            with self._prepare_lock:
+                if statement.name not in self._prepared:
+                    self.cursor.execute(statement.prepare)
+                    self._prepared.add(statement.name)
+        self.cursor.execute(statement.execute, params)
+
     def count(self) -> int:
-        self.cursor.execute(POST_TABLE_LENGTH)
-        res = self.cursor.fetchone()
-        return res[0]
+        """
+        Returns maintained number of posts, COUNT(*) is run only when it is unknown or older than COUNT_TTL
+        """
+        with self._count_lock:
+            if self._count is None or default_timer() - self._count_read > COUNT_TTL:
+                self._execute(COUNT_POSTS_STATEMENT)
+                self._count = self.cursor.fetchone()[0]
+                self._count_read = default_timer()
+            return self._count
+
+    def _count_added(self, posts: int) -> None:
+        """
+        :param posts: change of number of posts, negative for deleted ones
+        """
+        with self._count_lock:
+            if self._count is not None:
+                self._count += posts
+
+    def _forget_count(self) -> None:
+        with self._count_lock:
+            self._count = None
 
     def drop(self) -> None:
         self.cursor.execute(DROP_TABLES)
-        self.conn.commit()
+        self._forget_count()
 
     def create(self) -> None:
         self.cursor.execute(CREATE_TABLES)
-        self.conn.commit()
+        self.migrate()
+        self._forget_count()
+
+    def migrate(self) -> None:
+        """
+        Applies schema changes made after tables were created, every step is idempotent
+        """
+        for migration in MIGRATIONS:
+            self.cursor.execute(migration)
+
+    def explain_filtered(self, query: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Returns json plan Postgres chooses for get_filtered(query)
+        """
+        self.cursor.execute('EXPLAIN (FORMAT JSON) ' + _generate_filtered_select_clause(query),
+                            _generate_filter_params(query))
+        return self.cursor.fetchone()[0][0]
+
+    def bulk_import(self, posts: Iterable[Post]) -> int:
+        """
+        Streams posts into staging table with COPY and upserts users and posts from it with two statements
+        :return: number of rows copied
+        """
+        self.cursor.execute(CREATE_STAGING_TABLE)
+        reader = _CopyReader(posts)
+        self.cursor.copy_expert(COPY_TO_STAGING, reader, size=COPY_READ_SIZE)
+        self.cursor.execute(POSTS_EMPTY)
+        initial_load = self.cursor.fetchone()[0]
+        if initial_load:
+            self.cursor.execute(DROP_INDEXES)
+        try:
+            self.cursor.execute(UPSERT_FROM_STAGING)
+        finally:
+            self._forget_count()
+            if initial_load:
+                self.migrate()
+        return reader.rows
+
+    def iter_posts(self, after: str = '', batch_size: int = 1000) -> Iterator[Post]:
+        while True:
+            self._execute(SELECT_AFTER_STATEMENT, {'after': after, 'limit': batch_size})
+            posts = [Post(*row) for row in self.cursor.fetchall()]
+            yield from posts
+            if len(posts) < batch_size:
+                return
+            after = posts[-1].id
+
+    def iter_filtered(self, query: Dict[str, str], batch_size: int = 1000) -> Iterator[Post]:
+        statement = _batch_statement(_filter_key(query)[0])
+        params = {**_generate_filter_params(query), 'limit': batch_size}
+        while True:
+            self._execute(statement, params)
+            posts = [Post(*row) for row in self.cursor.fetchall()]
+            yield from posts
+            if len(posts) < batch_size:
+                return
+            params['last_post'] = posts[-1].id
+
+    def add_many(self, posts: List[Post]) -> int:
+        return self.bulk_import(posts)
+
+    def bulk_export(self, file: IO[str]) -> None:
+        """
+        Streams all posts to file in FileDB line format with COPY
+        """
+        self.cursor.copy_expert(COPY_FILE_LINES, file)
+
+    def stats(self, top_users: int = TOP_USERS) -> PostStats:
+        self._execute(STATS_STATEMENT, {'limit': top_users})
+        categories, votes, days, users = self.cursor.fetchone()
+        return PostStats(total=sum(categories.values()), categories=categories,
+                         votes={int(bucket): posts for bucket, posts in votes.items()}, days=days,
+                         top_users=[(username, karma) for username, karma in users])
+
+    def changes(self, since: int, limit: int = CHANGES_LIMIT) -> List[Change]:
+        self._execute(CHANGES_STATEMENT, {'since': since, 'limit': limit})
+        return [Change(row[0], row[1], None if row[2] is None else Post(*row[2:])) for row in self.cursor.fetchall()]
 
     def get_all(self) -> List[Post]:
-        self.cursor.execute(SELECT_ALL_POSTS)
+        self._execute(SELECT_ALL_STATEMENT)
         rows = self.cursor.fetchall()
         results = [Post(*row) for row in rows]
         return results
 
     def get_filtered(self, query: Dict[str, str]) -> List[Post]:
-        self.cursor.execute(_generate_filtered_select_clause(query), {
-            'min_votes': int(query.get(MIN_VOTES_NAME, '0')), 'max_votes': int(query.get(MAX_VOTES_NAME, '0')),
-            'category': query.get(CATEGORY_NAME, ''), 'date': query.get(DATE_NAME, ''),
-            'last_post': query.get(LAST_POST_NAME, '')
-        })
+        if not query:
+            return self.get_all()
+        self._execute(_filtered_statement(*_filter_key(query)), _generate_filter_params(query))
         rows = self.cursor.fetchall()
         results = [Post(*row) for row in rows]
         return results
 
+    def get_projected(self, query: Dict[str, str], fields: Sequence[str]) -> List[Dict[str, Any]]:
+        self._execute(_projected_statement(tuple(fields), *_filter_key(query)), _generate_filter_params(query))
+        return [dict(zip(fields, row)) for row in self.cursor.fetchall()]
+
     def get_by_id(self, post_id: str) -> Post:
-        self.cursor.execute(SELECT_POST_BY_ID, {'post_id': post_id})
+        self._execute(SELECT_BY_ID_STATEMENT, {'post_id': post_id})
         results = self.cursor.fetchone()
         if results:
             return Post(*results)
@@ -185,45 +684,29 @@ class PostgresDB(DB):
 
     def add(self, post: Post) -> bool:
         try:
-
-            self.cursor.execute(INSERT_USER, {'username': post.username, 'user_karma': post.user_karma,
-                                              'user_cake_day': post.user_cake_day, 'post_karma': post.post_karma,
-                                              'comment_karma': post.comment_karma})
-
-            self.cursor.execute(INSERT_POST, {'id': post.id, 'post_url': post.post_url, 'post_date': post.post_date,
-                                              'number_of_comments': post.number_of_comments, 'username': post.username,
-                                              'number_of_votes': post.number_of_votes,
-                                              'post_category': post.post_category})
-
-            self.conn.commit()
-            return True
+            self._execute(INSERT_POST_STATEMENT, _post_params(post))
         except psycopg2.errors.UniqueViolation:
-            self.conn.commit()
             return False
+        self._count_added(1)
+        return True
+
+    def add_batch(self, posts: List[Post]) -> List[bool]:
+        self._execute(INSERT_POSTS_STATEMENT, _batch_params(posts))
+        added = {row[0] for row in self.cursor.fetchall()}
+        self._count_added(len(added))
+        results = []
+        for post in posts:
+            results.append(post.id in added)
+            added.discard(post.id)
+        return results
 
     def update(self, post_id: str, new_post: Post) -> bool:
-        try:
-            old_post = self.get_by_id(post_id)
-            self.cursor.execute(UPDATE_POST_BY_ID, {'username': new_post.username, 'user_karma': new_post.user_karma,
-                                                    'user_cake_day': new_post.user_cake_day,
-                                                    'post_karma': new_post.post_karma,
-                                                    'comment_karma': new_post.comment_karma, 'id': new_post.id,
-                                                    'post_url': new_post.post_url, 'post_date': new_post.post_date,
-                                                    'number_of_comments': new_post.number_of_comments,
-                                                    'number_of_votes': new_post.number_of_votes,
-                                                    'update_username': old_post.username,
-                                                    'post_category': new_post.post_category, 'update_id': post_id})
-            self.conn.commit()
-            return True
-        except PostNotFoundException:
-            pass
-        return False
+        self._execute(UPDATE_POST_STATEMENT, {**_post_params(new_post), 'update_id': post_id})
+        return self.cursor.rowcount > 0
 
     def delete(self, post_id: str) -> bool:
-        try:
-            self.get_by_id(post_id)
-            self.cursor.execute(DELETE_POST_BY_ID, {'post_id': post_id})
-            self.conn.commit()
+        self._execute(DELETE_POST_STATEMENT, {'post_id': post_id})
+        if self.cursor.rowcount > 0:
+            self._count_added(-1)
             return True
-        except PostNotFoundException:
-            return False
+        return False
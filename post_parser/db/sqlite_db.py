@@ -0,0 +1,498 @@
+import functools
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple
+
+from .base import DB
+from .constants import POSTS_PER_PAGE, MIN_VOTES_NAME, MAX_VOTES_NAME, CATEGORY_NAME, DATE_NAME, LAST_POST_NAME, \
+    PAGINATION_NAME, FILTER_NAMES
+from .changes import CHANGES_LIMIT, Change
+from .exceptions import PostNotFoundException
+from .projection import Projection, needs_user
+from .stats import TOP_USERS, VOTE_BUCKETS, PostStats, post_day
+from ..post import Post, as_datetime
+from ..utils import get_config
+
+_LOGGER = logging.getLogger(__name__)
+
+DATABASE_PATH = './output/reddit.sqlite3'
+
+BUSY_TIMEOUT = 5.0
+
+# WAL lets readers work while a writer commits, NORMAL sync is durable in WAL mode except for power loss
+PRAGMAS = '''PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA foreign_keys = ON;
+'''
+
+DROP_TABLES = '''DROP TABLE IF EXISTS posts;
+DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS post_tombstones;
+DROP TABLE IF EXISTS change_sequence;
+'''
+
+# post_day keeps UTC day of post_date, so date filter is an indexed equality
+CREATE_TABLES = '''CREATE TABLE IF NOT EXISTS users(
+username text not null,
+user_karma integer not null,
+user_cake_day text not null,
+post_karma integer not null,
+comment_karma integer not null,
+PRIMARY KEY (username)
+);
+
+CREATE TABLE IF NOT EXISTS posts (
+id text not null,
+post_url text not null,
+post_date text not null,
+post_day text not null,
+number_of_comments integer not null,
+number_of_votes integer not null,
+post_category text not null,
+user_name text not null,
+change_seq integer not null default 0,
+PRIMARY KEY (id),
+CONSTRAINT fk_user
+    FOREIGN KEY(user_name)
+        REFERENCES users(username)
+        ON DELETE CASCADE
+        ON UPDATE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS posts_category_id_idx ON posts (post_category, id);
+CREATE INDEX IF NOT EXISTS posts_votes_id_idx ON posts (number_of_votes, id);
+CREATE INDEX IF NOT EXISTS posts_day_id_idx ON posts (post_day, id);
+CREATE INDEX IF NOT EXISTS posts_user_name_idx ON posts (user_name);
+CREATE INDEX IF NOT EXISTS users_karma_idx ON users (user_karma DESC, username);
+'''
+
+# posts of databases created before the change feed are numbered in rowid order
+ADD_CHANGE_SEQ = '''ALTER TABLE posts ADD COLUMN change_seq integer not null default 0;
+UPDATE posts SET change_seq = rowid;
+'''
+
+# triggers number every write, sqlite has no sequences, so the last number is kept in a one row table.
+# INSERT OR REPLACE fires only the insert trigger, deletes of replaced rows leave no tombstones
+CREATE_CHANGE_FEED = '''CREATE TABLE IF NOT EXISTS change_sequence(
+value integer not null
+);
+INSERT INTO change_sequence
+SELECT COALESCE(MAX(change_seq), 0) FROM posts
+WHERE NOT EXISTS (SELECT 1 FROM change_sequence);
+
+CREATE TABLE IF NOT EXISTS post_tombstones(
+post_id text not null,
+change_seq integer not null,
+PRIMARY KEY (post_id)
+);
+
+CREATE INDEX IF NOT EXISTS posts_change_seq_idx ON posts (change_seq);
+CREATE INDEX IF NOT EXISTS post_tombstones_change_seq_idx ON post_tombstones (change_seq);
+
+CREATE TRIGGER IF NOT EXISTS posts_insert_change AFTER INSERT ON posts
+BEGIN
+    UPDATE change_sequence SET value = value + 1;
+    UPDATE posts SET change_seq = (SELECT value FROM change_sequence) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_update_change
+AFTER UPDATE OF id, post_url, post_date, number_of_comments, number_of_votes, post_category, user_name ON posts
+BEGIN
+    UPDATE change_sequence SET value = value + 1;
+    UPDATE posts SET change_seq = (SELECT value FROM change_sequence) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_rename_change AFTER UPDATE OF id ON posts WHEN OLD.id <> NEW.id
+BEGIN
+    UPDATE change_sequence SET value = value + 1;
+    INSERT OR REPLACE INTO post_tombstones VALUES (OLD.id, (SELECT value FROM change_sequence));
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_delete_change AFTER DELETE ON posts
+BEGIN
+    UPDATE change_sequence SET value = value + 1;
+    INSERT OR REPLACE INTO post_tombstones VALUES (OLD.id, (SELECT value FROM change_sequence));
+END;
+'''
+
+POST_COLUMNS = '''p.post_url, u.username, u.user_karma, u.user_cake_day, u.post_karma, u.comment_karma,
+    p.post_date, p.number_of_comments, p.number_of_votes, p.post_category'''
+
+POST_TABLE_LENGTH = '''SELECT COUNT(*)
+FROM posts p;
+'''
+
+SELECT_POSTS_FILTERED = f'''SELECT {POST_COLUMNS}
+FROM posts p
+INNER JOIN users u
+ON u.username = p.user_name
+{{}}
+ORDER BY p.id ASC
+{{}};
+'''
+
+SELECT_POSTS_PROJECTED = '''SELECT {}
+FROM posts p
+{}{}
+ORDER BY p.id ASC
+{};
+'''
+
+USERS_JOIN = '''INNER JOIN users u
+ON u.username = p.user_name
+'''
+
+PROJECTED_COLUMNS = {
+    'id': 'p.id', 'post_url': 'p.post_url', 'username': 'p.user_name', 'user_karma': 'u.user_karma',
+    'user_cake_day': 'u.user_cake_day', 'post_karma': 'u.post_karma', 'comment_karma': 'u.comment_karma',
+    'post_date': 'p.post_date', 'number_of_comments': 'p.number_of_comments',
+    'number_of_votes': 'p.number_of_votes', 'post_category': 'p.post_category'
+}
+
+SELECT_ALL_POSTS = f'''SELECT {POST_COLUMNS}
+FROM posts p
+INNER JOIN users u
+ON u.username = p.user_name;
+'''
+
+SELECT_POST_BY_ID = f'''SELECT {POST_COLUMNS}
+FROM posts p
+INNER JOIN users u
+ON u.username = p.user_name
+WHERE p.id = :post_id;
+'''
+
+SELECT_POSTS_AFTER = f'''SELECT {POST_COLUMNS}
+FROM posts p
+INNER JOIN users u
+ON u.username = p.user_name
+WHERE p.id > :after
+ORDER BY p.id ASC
+LIMIT :limit;
+'''
+
+# changes after :since, post columns are null for tombstones
+SELECT_CHANGES = f'''SELECT c.change_seq, c.id, {POST_COLUMNS}
+FROM (
+    SELECT change_seq, id FROM posts WHERE change_seq > :since
+    UNION ALL
+    SELECT change_seq, post_id FROM post_tombstones WHERE change_seq > :since
+    ORDER BY change_seq
+    LIMIT :limit
+) c
+LEFT JOIN posts p
+ON p.id = c.id AND p.change_seq = c.change_seq
+LEFT JOIN users u
+ON u.username = p.user_name
+ORDER BY c.change_seq;
+'''
+
+# upsert syntax needs SQLite 3.24, insert of missing rows and update work everywhere.
+# users are never replaced, REPLACE deletes the row and would cascade to user posts
+INSERT_USER = '''INSERT OR IGNORE INTO users
+VALUES (:username, :user_karma, :user_cake_day, :post_karma, :comment_karma);
+'''
+
+UPDATE_USER = '''UPDATE users
+SET user_karma = :user_karma, user_cake_day = :user_cake_day, post_karma = :post_karma,
+    comment_karma = :comment_karma
+WHERE username = :username;
+'''
+
+INSERT_POST = '''INSERT INTO posts (id, post_url, post_date, post_day, number_of_comments, number_of_votes,
+    post_category, user_name)
+VALUES (:id, :post_url, :post_date, :post_day, :number_of_comments, :number_of_votes, :post_category, :username);
+'''
+
+REPLACE_POST = '''INSERT OR REPLACE INTO posts (id, post_url, post_date, post_day, number_of_comments,
+    number_of_votes, post_category, user_name)
+VALUES (:id, :post_url, :post_date, :post_day, :number_of_comments, :number_of_votes, :post_category, :username);
+'''
+
+UPDATE_POST_BY_ID = '''UPDATE posts
+SET id = :id,
+    post_url = :post_url,
+    post_date = :post_date,
+    post_day = :post_day,
+    number_of_comments = :number_of_comments,
+    number_of_votes = :number_of_votes,
+    post_category = :post_category,
+    user_name = :username
+WHERE id = :update_id;
+'''
+
+FIND_POST_BY_ID = '''SELECT 1
+FROM posts p
+WHERE p.id = :post_id;
+'''
+
+DELETE_POST_BY_ID = '''DELETE FROM posts
+WHERE id = :post_id;
+'''
+
+# every grouping reads only its covering index
+COUNT_BY_CATEGORY = '''SELECT post_category, COUNT(*)
+FROM posts
+GROUP BY post_category;
+'''
+
+COUNT_BY_DAY = '''SELECT post_day, COUNT(*)
+FROM posts
+GROUP BY post_day;
+'''
+
+VOTE_BUCKET_CASE = 'CASE ' + ' '.join(f'WHEN number_of_votes < {bound} THEN {index}'
+                                      for index, bound in enumerate(VOTE_BUCKETS)) + f' ELSE {len(VOTE_BUCKETS)} END'
+
+COUNT_BY_VOTE_BUCKET = f'''SELECT {VOTE_BUCKET_CASE} AS bucket, COUNT(*)
+FROM posts
+GROUP BY bucket;
+'''
+
+# users stay after their posts are deleted, they are skipped
+SELECT_TOP_USERS = '''SELECT u.username, u.user_karma
+FROM users u
+WHERE EXISTS (SELECT 1 FROM posts p WHERE p.user_name = u.username)
+ORDER BY u.user_karma DESC, u.username ASC
+LIMIT :limit;
+'''
+
+
+def _post_params(post: Post) -> Dict[str, Any]:
+    post_date = as_datetime(post.post_date)
+    return {'username': post.username, 'user_karma': post.user_karma, 'user_cake_day': post.user_cake_day,
+            'post_karma': post.post_karma, 'comment_karma': post.comment_karma, 'id': post.id,
+            'post_url': post.post_url, 'post_date': post_date.isoformat(), 'post_day': post_day(post_date),
+            'number_of_comments': post.number_of_comments, 'number_of_votes': post.number_of_votes,
+            'post_category': post.post_category}
+
+
+def _row_to_post(row: Tuple) -> Post:
+    post_url, username, user_karma, user_cake_day, post_karma, comment_karma, post_date, number_of_comments, \
+        number_of_votes, post_category = row
+    return Post(post_url, username, user_karma, user_cake_day, post_karma, comment_karma,
+                datetime.fromisoformat(post_date), number_of_comments, number_of_votes, post_category)
+
+
+def _filter_clauses(filters: FrozenSet[str], paginated: bool) -> Tuple[str, str]:
+    """
+    :return: WHERE and LIMIT clauses of filtered select
+    """
+    statements = []
+    limit = ''
+    if CATEGORY_NAME in filters:
+        statements.append('p.post_category = :category')
+    if DATE_NAME in filters:
+        statements.append('p.post_day = :date')
+    if MIN_VOTES_NAME in filters:
+        statements.append('p.number_of_votes >= :min_votes')
+    if MAX_VOTES_NAME in filters:
+        statements.append('p.number_of_votes <= :max_votes')
+    if LAST_POST_NAME in filters:
+        statements.insert(0, 'p.id > :last_post')
+    if paginated:
+        limit = f'LIMIT {POSTS_PER_PAGE}'
+    where = 'WHERE ' + ' AND '.join(statements) if statements else ''
+    return where, limit
+
+
+@functools.lru_cache(maxsize=None)
+def _filtered_select_clause(filters: FrozenSet[str], paginated: bool) -> str:
+    return SELECT_POSTS_FILTERED.format(*_filter_clauses(filters, paginated))
+
+
+@functools.lru_cache(maxsize=None)
+def _projected_select_clause(fields: Projection, filters: FrozenSet[str], paginated: bool) -> str:
+    """
+    Filtered select of given fields only, users are joined only for user fields
+    """
+    columns = ', '.join(PROJECTED_COLUMNS[field] for field in fields)
+    join = USERS_JOIN if needs_user(fields) else ''
+    where, limit = _filter_clauses(filters, paginated)
+    return SELECT_POSTS_PROJECTED.format(columns, join, where, limit)
+
+
+@functools.lru_cache(maxsize=None)
+def _batch_select_clause(filters: FrozenSet[str]) -> str:
+    """
+    Filtered select of the next :limit posts after :last_post
+    """
+    where, _ = _filter_clauses(filters | {LAST_POST_NAME}, False)
+    return SELECT_POSTS_FILTERED.format(where, 'LIMIT :limit')
+
+
+def _filter_key(query: Dict[str, str]) -> Tuple[FrozenSet[str], bool]:
+    return frozenset(name for name in FILTER_NAMES if name in query), query.get(PAGINATION_NAME, '') == 'true'
+
+
+def _generate_filtered_select_clause(query: Dict[str, str]) -> str:
+    return _filtered_select_clause(*_filter_key(query))
+
+
+def _generate_filter_params(query: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        'min_votes': int(query.get(MIN_VOTES_NAME, '0')), 'max_votes': int(query.get(MAX_VOTES_NAME, '0')),
+        'category': query.get(CATEGORY_NAME, ''), 'date': query.get(DATE_NAME, ''),
+        'last_post': query.get(LAST_POST_NAME, '')
+    }
+
+
+class SQLiteDB(DB):
+    """
+    Single file database. Every thread gets its own connection, sqlite3 caches prepared statements per connection
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """
+        :param path: database file, 'path' of 'sqlite' config section by default
+        """
+        path = path or get_config().get('sqlite', {}).get('path', DATABASE_PATH)
+        self.path: str = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.create()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # autocommit mode, transactions are opened explicitly around writes
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.executescript(PRAGMAS)
+            self._local.conn = conn
+        return conn
+
+    def _write(self, statements: List[Tuple[str, Any]]) -> int:
+        """
+        Runs statements in one transaction
+        :return: rows changed by the last statement
+        """
+        conn = self.conn
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, params in statements:
+                if isinstance(params, list):
+                    cursor.executemany(sql, params)
+                else:
+                    cursor.execute(sql, params)
+            changed = cursor.rowcount
+            cursor.execute('COMMIT')
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        return changed
+
+    def count(self) -> int:
+        return self.conn.execute(POST_TABLE_LENGTH).fetchone()[0]
+
+    def drop(self) -> None:
+        self.conn.executescript(DROP_TABLES)
+
+    def create(self) -> None:
+        conn = self.conn
+        conn.executescript(CREATE_TABLES)
+        if 'change_seq' not in {row[1] for row in conn.execute('PRAGMA table_info(posts)')}:
+            conn.executescript(ADD_CHANGE_SEQ)
+        conn.executescript(CREATE_CHANGE_FEED)
+
+    def explain_filtered(self, query: Dict[str, str]) -> List[str]:
+        """
+        Returns details of query plan SQLite chooses for get_filtered(query)
+        """
+        rows = self.conn.execute('EXPLAIN QUERY PLAN ' + _generate_filtered_select_clause(query),
+                                 _generate_filter_params(query)).fetchall()
+        return [row[-1] for row in rows]
+
+    def get_all(self) -> List[Post]:
+        return [_row_to_post(row) for row in self.conn.execute(SELECT_ALL_POSTS)]
+
+    def get_filtered(self, query: Dict[str, str]) -> List[Post]:
+        rows = self.conn.execute(_generate_filtered_select_clause(query), _generate_filter_params(query))
+        return [_row_to_post(row) for row in rows]
+
+    def explain_projected(self, query: Dict[str, str], fields: Sequence[str]) -> List[str]:
+        """
+        Returns details of query plan SQLite chooses for get_projected(query, fields)
+        """
+        rows = self.conn.execute('EXPLAIN QUERY PLAN ' + _projected_select_clause(tuple(fields), *_filter_key(query)),
+                                 _generate_filter_params(query)).fetchall()
+        return [row[-1] for row in rows]
+
+    def get_projected(self, query: Dict[str, str], fields: Sequence[str]) -> List[Dict[str, Any]]:
+        fields = tuple(fields)
+        rows = self.conn.execute(_projected_select_clause(fields, *_filter_key(query)), _generate_filter_params(query))
+        posts = [dict(zip(fields, row)) for row in rows]
+        if 'post_date' in fields:
+            for post in posts:
+                post['post_date'] = datetime.fromisoformat(post['post_date'])
+        return posts
+
+    def get_by_id(self, post_id: str) -> Post:
+        row = self.conn.execute(SELECT_POST_BY_ID, {'post_id': post_id}).fetchone()
+        if row:
+            return _row_to_post(row)
+        raise PostNotFoundException
+
+    def iter_posts(self, after: str = '', batch_size: int = 1000) -> Iterator[Post]:
+        while True:
+            posts = [_row_to_post(row) for row in self.conn.execute(SELECT_POSTS_AFTER,
+                                                                    {'after': after, 'limit': batch_size})]
+            yield from posts
+            if len(posts) < batch_size:
+                return
+            after = posts[-1].id
+
+    def iter_filtered(self, query: Dict[str, str], batch_size: int = 1000) -> Iterator[Post]:
+        sql = _batch_select_clause(_filter_key(query)[0])
+        params = {**_generate_filter_params(query), 'limit': batch_size}
+        while True:
+            posts = [_row_to_post(row) for row in self.conn.execute(sql, params)]
+            yield from posts
+            if len(posts) < batch_size:
+                return
+            params['last_post'] = posts[-1].id
+
+    def changes(self, since: int, limit: int = CHANGES_LIMIT) -> List[Change]:
+        rows = self.conn.execute(SELECT_CHANGES, {'since': since, 'limit': limit})
+        return [Change(row[0], row[1], None if row[2] is None else _row_to_post(row[2:])) for row in rows]
+
+    def stats(self, top_users: int = TOP_USERS) -> PostStats:
+        conn = self.conn
+        # one read transaction, so all groupings see the same snapshot
+        conn.execute('BEGIN')
+        try:
+            categories = dict(conn.execute(COUNT_BY_CATEGORY).fetchall())
+            return PostStats(total=sum(categories.values()), categories=categories,
+                             votes=dict(conn.execute(COUNT_BY_VOTE_BUCKET).fetchall()),
+                             days=dict(conn.execute(COUNT_BY_DAY).fetchall()),
+                             top_users=conn.execute(SELECT_TOP_USERS, {'limit': top_users}).fetchall())
+        finally:
+            conn.execute('COMMIT')
+
+    def add(self, post: Post) -> bool:
+        params = _post_params(post)
+        try:
+            self._write([(INSERT_USER, params), (UPDATE_USER, params), (INSERT_POST, params)])
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def add_many(self, posts: List[Post]) -> int:
+        params = [_post_params(post) for post in posts]
+        self._write([(INSERT_USER, params), (UPDATE_USER, params), (REPLACE_POST, params)])
+        return len(posts)
+
+    def update(self, post_id: str, new_post: Post) -> bool:
+        if self.conn.execute(FIND_POST_BY_ID, {'post_id': post_id}).fetchone() is None:
+            return False
+        params = {**_post_params(new_post), 'update_id': post_id}
+        return self._write([(INSERT_USER, params), (UPDATE_USER, params), (UPDATE_POST_BY_ID, params)]) > 0
+
+    def delete(self, post_id: str) -> bool:
+        return self._write([(DELETE_POST_BY_ID, {'post_id': post_id})]) > 0
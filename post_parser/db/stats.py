@@ -0,0 +1,94 @@
+"""
+Aggregate statistics of stored posts: counts per category, per vote range and per UTC day and users with the most
+karma. FileDB keeps them up to date on every write, database backends compute them with grouped queries
+"""
+import bisect
+import heapq
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+from ..post import Post, as_datetime
+
+# upper bounds of vote ranges, the last range has no upper bound
+VOTE_BUCKETS = (10, 100, 1000, 10000, 100000)
+VOTE_BUCKET_LABELS = tuple(f'<{bound}' for bound in VOTE_BUCKETS) + (f'>={VOTE_BUCKETS[-1]}',)
+TOP_USERS = 10
+
+
+def vote_bucket(number_of_votes: int) -> int:
+    """
+    Index of vote range in VOTE_BUCKET_LABELS
+    """
+    return bisect.bisect_right(VOTE_BUCKETS, number_of_votes)
+
+
+def post_day(post_date: datetime) -> str:
+    """
+    UTC day of post date, naive dates are taken as UTC
+    """
+    if post_date.tzinfo is not None:
+        post_date = post_date.astimezone(timezone.utc)
+    return post_date.date().isoformat()
+
+
+@dataclass
+class PostStats:
+    total: int = 0
+    categories: Dict[str, int] = field(default_factory=dict)
+    # number of posts by index of vote range
+    votes: Dict[int, int] = field(default_factory=dict)
+    days: Dict[str, int] = field(default_factory=dict)
+    # username and karma ordered by karma, then by username
+    top_users: List[Tuple[str, int]] = field(default_factory=list)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'total': self.total,
+            'categories': dict(sorted(self.categories.items())),
+            'votes': {label: self.votes.get(index, 0) for index, label in enumerate(VOTE_BUCKET_LABELS)},
+            'days': dict(sorted(self.days.items())),
+            'top_users': [{'username': username, 'user_karma': karma} for username, karma in self.top_users],
+        }
+
+
+def _decrement(counter: Counter, key: Any) -> None:
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+
+class StatsAccumulator:
+    """
+    Statistics updated post by post. User karma is the highest karma among stored posts of the user
+    """
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.categories: Counter = Counter()
+        self.votes: Counter = Counter()
+        self.days: Counter = Counter()
+        self.karma: Dict[str, Counter] = {}
+
+    def add(self, post: Post) -> None:
+        self.total += 1
+        self.categories[post.post_category] += 1
+        self.votes[vote_bucket(post.number_of_votes)] += 1
+        self.days[post_day(as_datetime(post.post_date))] += 1
+        self.karma.setdefault(post.username, Counter())[post.user_karma] += 1
+
+    def remove(self, post: Post) -> None:
+        self.total -= 1
+        _decrement(self.categories, post.post_category)
+        _decrement(self.votes, vote_bucket(post.number_of_votes))
+        _decrement(self.days, post_day(as_datetime(post.post_date)))
+        user_karma = self.karma[post.username]
+        _decrement(user_karma, post.user_karma)
+        if not user_karma:
+            del self.karma[post.username]
+
+    def stats(self, top_users: int = TOP_USERS) -> PostStats:
+        users = heapq.nsmallest(top_users, ((-max(karma), username) for username, karma in self.karma.items()))
+        return PostStats(self.total, dict(self.categories), dict(self.votes), dict(self.days),
+                         [(username, -karma) for karma, username in users])
@@ -0,0 +1,2 @@
+class ServerUnavailableError(Exception):
+    pass
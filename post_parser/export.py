@@ -0,0 +1,146 @@
+"""
+Encoders of bulk export formats. Posts are encoded batch by batch while they are read, so memory in use does not
+grow with number of exported posts. parquet is offered when pyarrow package is installed
+"""
+import csv
+import functools
+import io
+import itertools
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from .db.constants import POST_FIELDS
+from .db.projection import json_default, project
+from .post import Post, as_datetime
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+PARQUET = 'parquet'
+
+CONTENT_TYPES = {
+    NDJSON: 'application/x-ndjson',
+    CSV: 'text/csv; charset=utf-8',
+    PARQUET: 'application/vnd.apache.parquet',
+}
+
+# posts encoded at once, parquet file gets one row group per batch
+EXPORT_BATCH = 10000
+
+# json.dumps builds a new encoder on every call with default
+_JSON_ENCODER = json.JSONEncoder(default=json_default)
+
+
+@functools.lru_cache(maxsize=None)
+def available_formats() -> Tuple[str, ...]:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return NDJSON, CSV
+    return NDJSON, CSV, PARQUET
+
+
+def _batches(posts: Iterable[Post], batch_size: int) -> Iterator[List[Post]]:
+    iterator = iter(posts)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _text(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _export_ndjson(posts: Iterable[Post], batch_size: int) -> Iterator[bytes]:
+    encode = _JSON_ENCODER.encode
+    for batch in _batches(posts, batch_size):
+        yield ''.join(encode(project(post, POST_FIELDS)) + '\n' for post in batch).encode('utf-8')
+
+
+def _export_csv(posts: Iterable[Post], batch_size: int) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(POST_FIELDS)
+    for batch in _batches(posts, batch_size):
+        writer.writerows([_text(getattr(post, field)) for field in POST_FIELDS] for post in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Output file keeping written bytes until they are taken
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_schema() -> Any:
+    import pyarrow
+
+    string, integer = pyarrow.string(), pyarrow.int64()
+    types = {'id': string, 'post_url': string, 'username': string, 'user_karma': integer, 'user_cake_day': string,
+             'post_karma': integer, 'comment_karma': integer, 'post_date': pyarrow.timestamp('us', tz='UTC'),
+             'number_of_comments': integer, 'number_of_votes': integer, 'post_category': string}
+    return pyarrow.schema([(field, types[field]) for field in POST_FIELDS])
+
+
+def _export_parquet(posts: Iterable[Post], batch_size: int) -> Iterator[bytes]:
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for batch in _batches(posts, batch_size):
+            columns: Dict[str, List[Any]] = {field: [getattr(post, field) for post in batch] for field in POST_FIELDS}
+            # posts written through the server keep post date as a string
+            columns['post_date'] = [as_datetime(post_date) for post_date in columns['post_date']]
+            writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+_EXPORTERS: Dict[str, Callable[[Iterable[Post], int], Iterator[bytes]]] = {
+    NDJSON: _export_ndjson,
+    CSV: _export_csv,
+    PARQUET: _export_parquet,
+}
+
+
+def export(posts: Iterable[Post], export_format: str, batch_size: int = EXPORT_BATCH) -> Iterator[bytes]:
+    """
+    Encodes posts in export_format, posts are read from iterable only as chunks are taken
+    :raises ValueError: on format that is unknown or needs a package that is not installed
+    """
+    if export_format not in available_formats():
+        raise ValueError(f'Export format {export_format} is not available')
+    return _EXPORTERS[export_format](posts, batch_size)
@@ -0,0 +1,75 @@
+"""
+Group commit of posts added through the server. The first writer of a batch waits window seconds for concurrent
+writers to join, then writes the whole batch with one DB.add_batch call. Writers arriving while a batch is being
+written gather into the next one, so under load batches grow instead of commits queueing up
+"""
+import threading
+from typing import List, Optional
+
+from .db import DB
+from .metrics import GROUP_COMMIT_POSTS
+from .post import Post
+
+# seconds the first writer of a batch waits for others
+GROUP_COMMIT_WINDOW = 0.002
+MAX_BATCH = 500
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.posts: List[Post] = []
+        self.results: List[bool] = []
+        self.error: Optional[BaseException] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class GroupCommit:
+    def __init__(self, db: DB, window: float = GROUP_COMMIT_WINDOW, max_batch: int = MAX_BATCH) -> None:
+        self.db = db
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Optional[_Batch] = None
+        self._lock = threading.Lock()
+        # one batch is written at a time
+        self._write_lock = threading.Lock()
+
+    def add(self, post: Post) -> bool:
+        """
+        Adds post together with posts added by concurrent callers
+        :return: True if post was added, False if a post with its id exists
+        :raises: error of the batch write, every caller of the batch gets it
+        """
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if batch is None:
+                batch = self._pending = _Batch()
+            index = len(batch.posts)
+            batch.posts.append(post)
+            if len(batch.posts) >= self.max_batch:
+                self._pending = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            self._write(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+    def _write(self, batch: _Batch) -> None:
+        with self._write_lock:
+            # batch keeps gathering posts while the previous one is written
+            with self._lock:
+                if self._pending is batch:
+                    self._pending = None
+            try:
+                batch.results = self.db.add_batch(batch.posts)
+            except Exception as error:
+                batch.error = error
+            finally:
+                batch.done.set()
+        GROUP_COMMIT_POSTS.observe(len(batch.posts))
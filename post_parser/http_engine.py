@@ -0,0 +1,404 @@
+import asyncio
+import logging
+import multiprocessing
+import sys
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from timeit import default_timer
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+
+from .checkpoint import Checkpoint, ResultCallback, SERVER_UNAVAILABLE
+from .exceptions import ServerUnavailableError
+from .metrics import PAGE_LOAD_SECONDS, POSTS_TOTAL, SCRAPER, SOUP_PARSE_SECONDS, UPLOAD_SECONDS, USER_FETCH_SECONDS
+from .post import Post, User, count_votes
+from .post_schema import PostSchema
+from .sharding import ShardProgress, ShardResult
+from .throttling import HostRateLimiter, RETRY_STATUSES, backoff_delay, parse_retry_after
+
+_LOGGER = logging.getLogger(__name__)
+
+REDDIT_TOP_JSON = '/top/.json'
+REDDIT_TOP_PARAMS = {'t': 'month', 'limit': '100'}
+LISTING_FIELDS = ('permalink', 'author', 'score', 'upvote_ratio', 'created_utc', 'num_comments',
+                  'subreddit_name_prefixed')
+USER_ABOUT_JSON = '/user/{}/about.json'
+DELETED_AUTHOR = '[deleted]'
+USER_AGENT = 'python:reddit_top_scraper:1.0'
+REQUEST_TIMEOUT = 30
+RETRY_AFTER_HEADER = 'Retry-After'
+# answer of POST /posts to a post with a stored id
+DUPLICATE_STATUS = 404
+
+
+@dataclass
+class PipelineConfig:
+    """
+    Concurrency of feed -> post -> user -> upload stages and limits shared by all of them
+    """
+    feed_prefetch: int = 100
+    post_concurrency: int = 4
+    user_concurrency: int = 32
+    upload_concurrency: int = 16
+    max_in_flight: int = 200
+    rate_limit: float = 10.0
+    burst: int = 20
+    max_retries: int = 5
+
+    def split(self, parts: int) -> 'PipelineConfig':
+        """
+        Config of one of parts processes scraping together, so their requests stay within rate_limit and burst
+        """
+        return replace(self, rate_limit=self.rate_limit / parts, burst=max(1, self.burst // parts))
+
+
+def parse_user_about(about: Dict[str, Any]) -> User:
+    """
+    Builds a user from reddit's /user/<name>/about.json
+    :param about: Decoded about.json response
+    :return: User equal to the one parsed from user page
+    """
+    data = about['data']
+    cake_day = datetime.fromtimestamp(data['created_utc'], tz=timezone.utc)
+    total_karma = data.get('total_karma', data['link_karma'] + data['comment_karma'])
+    return User(username=f'u/{data["name"]}', user_karma=total_karma,
+                user_cake_day=f'{cake_day:%B} {cake_day.day}, {cake_day.year}', post_karma=data['link_karma'],
+                comment_karma=data['comment_karma'])
+
+
+def parse_listing_post(child: Dict[str, Any], reddit_url: str, user: User) -> Post:
+    """
+    Builds a post from a child of reddit's listing json
+    :param child: Listing child of t3 kind
+    :param reddit_url: Reddit base url the permalink is relative to
+    :param user: Post author
+    :return: Post equal to the one parsed from post page
+    """
+    data = child['data']
+    number_of_votes = count_votes(data['score'], round(data['upvote_ratio'] * 100))
+    post_date = datetime.fromtimestamp(data['created_utc'], tz=timezone.utc)
+    return Post.from_post_page(user, reddit_url + data['permalink'], post_date, data['num_comments'],
+                               number_of_votes, data['subreddit_name_prefixed'])
+
+
+class Fetcher:
+    """
+    Wraps a pooled aiohttp session with in-flight limit, per-host rate limit and retries on 429/5xx
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, config: PipelineConfig) -> None:
+        self.session = session
+        self.config = config
+        self.in_flight = asyncio.Semaphore(config.max_in_flight)
+        self.limiter = HostRateLimiter(config.rate_limit, config.burst)
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> Any:
+        attempt = 0
+        while True:
+            await self.limiter.acquire(url)
+            async with self.in_flight:
+                async with self.session.request(method, url, **kwargs) as response:
+                    if response.status not in RETRY_STATUSES or attempt >= self.config.max_retries:
+                        response.raise_for_status()
+                        if response.content_type == 'application/json':
+                            return await response.json()
+                        return await response.read()
+                    retry_after = parse_retry_after(response.headers.get(RETRY_AFTER_HEADER))
+            delay = backoff_delay(attempt, retry_after)
+            if retry_after is not None:
+                self.limiter.pause(url, delay)
+            _LOGGER.warning(f'{method} {url} answered {response.status}, retrying in {delay:.2f} seconds')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get_json(self, url: str, params: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        return await self.request('GET', url, params=params)
+
+    async def post(self, url: str, data: str) -> int:
+        """
+        Sends data once without rate limit, POST is not idempotent so it is not retried on 5xx
+        :return: response status
+        """
+        async with self.in_flight:
+            async with self.session.post(url, data=data) as response:
+                await response.read()
+                return response.status
+
+
+PageCallback = Callable[[Optional[str], int], None]
+
+
+def trim_child(child: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Keeps only listing fields a post is built from
+    """
+    return {'data': {name: child['data'][name] for name in LISTING_FIELDS if name in child['data']}}
+
+
+async def listing(fetcher: Fetcher, reddit_url: str, offset: int = 0, after: Optional[str] = None,
+                  on_page: Optional[PageCallback] = None) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Yields month top posts page by page following listing `after` cursor
+    :param after: Cursor of the first page to fetch
+    :param on_page: Called with cursor of every page and number of posts still to skip before it is fetched
+    """
+    while True:
+        params = dict(REDDIT_TOP_PARAMS)
+        if after:
+            params['after'] = after
+        if on_page:
+            on_page(after, offset)
+        with PAGE_LOAD_SECONDS.time(page='listing'):
+            page = await fetcher.get_json(reddit_url + REDDIT_TOP_JSON, params)
+        for child in page['data']['children']:
+            if offset > 0:
+                offset -= 1
+                continue
+            yield child
+        after = page['data'].get('after')
+        if not after:
+            return
+
+
+def child_url(reddit_url: str, child: Dict[str, Any]) -> str:
+    return reddit_url + child['data']['permalink']
+
+
+async def checkpointed_listing(fetcher: Fetcher, reddit_url: str, offset: int,
+                               checkpoint: Checkpoint) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yields pending posts of checkpoint, then continues listing from the last harvested page
+    """
+    for _, child in checkpoint.state.pending:
+        yield child
+    after, skip = checkpoint.state.cursor or (None, offset)
+    async for child in listing(fetcher, reddit_url, skip, after, on_page=checkpoint.cursor):
+        if checkpoint.take(child_url(reddit_url, child), trim_child(child)):
+            yield child
+
+
+
+class HttpPipeline:
+    """
+    Runs feed -> post -> user -> upload stages connected with bounded queues.
+    Every stage has its own pool of worker tasks, the run stops as soon as `amount` posts are uploaded.
+    Feed defaults to month top listing, `on_result` is called with post url, Post or None and failure reason
+    for every fed post
+    """
+
+    def __init__(self, fetcher: Fetcher, reddit_url: str, server_url: str, amount: int, offset: int,
+                 config: PipelineConfig, feed: Optional[AsyncIterator[Dict[str, Any]]] = None,
+                 on_result: Optional[ResultCallback] = None) -> None:
+        self.fetcher = fetcher
+        self.feed = feed or listing(fetcher, reddit_url, offset)
+        self.on_result = on_result
+        self.reddit_url = reddit_url
+        self.server_url = server_url
+        self.amount = amount
+        self.offset = offset
+        self.config = config
+        self.post_schema = PostSchema()
+        self.users: Dict[str, asyncio.Future] = {}
+        self.post_queue: asyncio.Queue = asyncio.Queue(config.feed_prefetch)
+        self.user_queue: asyncio.Queue = asyncio.Queue(config.user_concurrency * 2)
+        self.upload_queue: asyncio.Queue = asyncio.Queue(config.upload_concurrency * 2)
+        self.results: List[Post] = []
+        self.uploading = 0
+        self.taken_posts = 0
+        self.done = asyncio.Event()
+
+    def _report(self, url: str, post: Optional[Post], reason: str = '') -> None:
+        if reason != SERVER_UNAVAILABLE:
+            POSTS_TOTAL.inc(result='parsed' if post else 'failed')
+        if self.on_result:
+            self.on_result(url, post, reason)
+
+    async def _feed(self) -> None:
+        async for child in self.feed:
+            self.taken_posts += 1
+            await self.post_queue.put(child)
+
+    async def _parse_post(self, child: Dict[str, Any]) -> None:
+        author = child['data']['author']
+        if author == DELETED_AUTHOR:
+            _LOGGER.error('User unavailable due to deleted profile')
+            self._report(child_url(self.reddit_url, child), None, 'deleted profile')
+            return
+        await self.user_queue.put(child)
+
+    async def _fetch_user(self, url: str) -> Dict[str, Any]:
+        with USER_FETCH_SECONDS.time():
+            return await self.fetcher.get_json(url)
+
+    def _user(self, author: str) -> Awaitable[Dict[str, Any]]:
+        # posts of the same author share one about.json request
+        if author not in self.users:
+            url = self.reddit_url + USER_ABOUT_JSON.format(author)
+            self.users[author] = asyncio.ensure_future(self._fetch_user(url))
+        return self.users[author]
+
+    async def _parse_user(self, child: Dict[str, Any]) -> None:
+        _LOGGER.info(f'Parsing user {child["data"]["author"]}')
+        try:
+            about = await self._user(child['data']['author'])
+            with SOUP_PARSE_SECONDS.time(page='json'):
+                user = parse_user_about(about)
+                post = parse_listing_post(child, self.reddit_url, user)
+        except (aiohttp.ClientResponseError, KeyError):
+            _LOGGER.error('User unavailable due to suspended or deleted profile')
+            self._report(child_url(self.reddit_url, child), None, 'suspended or deleted profile')
+            return
+        await self.upload_queue.put(post)
+
+    async def _upload(self, post: Post) -> None:
+        if len(self.results) + self.uploading >= self.amount:
+            return
+        self.uploading += 1
+        try:
+            with UPLOAD_SECONDS.time():
+                status = await self.fetcher.post(self.server_url, self.post_schema.dumps(post))
+        except aiohttp.ClientConnectionError:
+            raise ServerUnavailableError
+        finally:
+            self.uploading -= 1
+        if status == DUPLICATE_STATUS:
+            # like the selenium engine, a post the server stores already counts as uploaded
+            _LOGGER.info(f'Post {post.post_url} is already stored')
+        elif status >= 300:
+            _LOGGER.error(f'Server answered {status} to post {post.post_url}')
+            self._report(post.post_url, None, f'server answered {status}')
+            return
+        self.results.append(post)
+        self._report(post.post_url, post)
+        _LOGGER.info(f'{self.taken_posts} posts taken. {len(self.results)} posts passed.')
+        if len(self.results) >= self.amount:
+            self.done.set()
+
+    async def _worker(self, queue: asyncio.Queue, handler: Callable[[Any], Awaitable[None]]) -> None:
+        while True:
+            item = await queue.get()
+            try:
+                await handler(item)
+            except ServerUnavailableError:
+                _LOGGER.error('Currently server is unavailable')
+                self._report(item.post_url, None, SERVER_UNAVAILABLE)
+                self.done.set()
+            except Exception as e:
+                _LOGGER.exception('Something went wrong while parsing post')
+                url = item.post_url if isinstance(item, Post) else child_url(self.reddit_url, item)
+                self._report(url, None, repr(e))
+            finally:
+                queue.task_done()
+
+    async def _drain(self, feed: Awaitable[None]) -> None:
+        await feed
+        for queue in (self.post_queue, self.user_queue, self.upload_queue):
+            await queue.join()
+
+    async def run(self) -> List[Post]:
+        stages: List[Tuple[asyncio.Queue, Callable[[Any], Awaitable[None]], int]] = [
+            (self.post_queue, self._parse_post, self.config.post_concurrency),
+            (self.user_queue, self._parse_user, self.config.user_concurrency),
+            (self.upload_queue, self._upload, self.config.upload_concurrency)]
+        workers = [asyncio.ensure_future(self._worker(queue, handler))
+                   for queue, handler, concurrency in stages for _ in range(max(concurrency, 1))]
+        feed = asyncio.ensure_future(self._feed())
+        drain = asyncio.ensure_future(self._drain(feed))
+        done = asyncio.ensure_future(self.done.wait())
+        try:
+            await asyncio.wait([drain, done], return_when=asyncio.FIRST_COMPLETED)
+            if drain.done() and drain.exception():
+                _LOGGER.error(f'Feed stopped: {drain.exception()!r}')
+        finally:
+            for task in [feed, drain, done, *workers, *self.users.values()]:
+                task.cancel()
+            await asyncio.gather(feed, drain, done, *workers, *self.users.values(), return_exceptions=True)
+        return self.results[:self.amount]
+
+
+def _create_session(config: PipelineConfig) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(limit=config.max_in_flight)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers={'User-Agent': USER_AGENT})
+
+
+async def scrape_async(amount: int, offset: int, reddit_url: str, server_url: str, config: PipelineConfig,
+                       checkpoint: Optional[Checkpoint] = None) -> List[Post]:
+    async with _create_session(config) as session:
+        fetcher = Fetcher(session, config)
+        if checkpoint:
+            pipeline = HttpPipeline(fetcher, reddit_url, server_url, amount, offset, config,
+                                    feed=checkpointed_listing(fetcher, reddit_url, offset, checkpoint),
+                                    on_result=checkpoint.on_result)
+        else:
+            pipeline = HttpPipeline(fetcher, reddit_url, server_url, amount, offset, config)
+        return await pipeline.run()
+
+
+def iter_listing(reddit_url: str, offset: int, config: Optional[PipelineConfig] = None, after: Optional[str] = None,
+                 on_page: Optional[PageCallback] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Synchronous month top listing for coordinators that live outside of an event loop
+    """
+    config = config or PipelineConfig()
+    loop = asyncio.new_event_loop()
+
+    async def open_session() -> aiohttp.ClientSession:
+        return _create_session(config)
+
+    session = loop.run_until_complete(open_session())
+    children = listing(Fetcher(session, config), reddit_url, offset, after, on_page)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(children.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(children.aclose())
+        loop.run_until_complete(session.close())
+        loop.close()
+
+
+async def _queue_feed(queue: multiprocessing.Queue) -> AsyncIterator[Dict[str, Any]]:
+    loop = asyncio.get_event_loop()
+    while True:
+        child = await loop.run_in_executor(None, queue.get)
+        if child is None:
+            return
+        yield child
+
+
+async def _parse_shard_async(item_queue: multiprocessing.Queue, result_queue: multiprocessing.Queue,
+                             reddit_url: str, server_url: str, config: PipelineConfig) -> List[Post]:
+    async with _create_session(config) as session:
+        pipeline = HttpPipeline(Fetcher(session, config), reddit_url, server_url, sys.maxsize, 0, config,
+                                feed=_queue_feed(item_queue),
+                                on_result=lambda url, post, reason: result_queue.put(
+                                    ShardProgress(url, post.id if post else None, reason)))
+        return await pipeline.run()
+
+
+def parse_shard(shard: int, item_queue: multiprocessing.Queue, result_queue: multiprocessing.Queue,
+                reddit_url: str, server_url: str, config: PipelineConfig) -> None:
+    """
+    Worker process target: runs own pipeline over listing children of its shard until None arrives.
+    Reports progress of every child and the parsed posts at the end
+    """
+    logging.basicConfig(level=logging.INFO)
+    start = default_timer()
+    posts = asyncio.run(_parse_shard_async(item_queue, result_queue, reddit_url, server_url, config))
+    _LOGGER.info(f'Shard {shard} parsed {len(posts)} posts')
+    result_queue.put(ShardResult(shard, posts, default_timer() - start, SCRAPER.snapshot()))
+
+
+def scrape(amount: int, offset: int, reddit_url: str, server_url: str, config: Optional[PipelineConfig] = None,
+           checkpoint: Optional[Checkpoint] = None) -> List[Post]:
+    """
+    Scrapes month top through reddit json endpoints without a browser
+    """
+    start = default_timer()
+    posts = asyncio.run(scrape_async(amount, offset, reddit_url, server_url, config or PipelineConfig(), checkpoint))
+    _LOGGER.info(f'HTTP engine parsed {len(posts)} posts in {default_timer() - start} seconds')
+    return posts
@@ -0,0 +1,65 @@
+import logging
+import queue
+import random
+from dataclasses import dataclass
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+ACCESS_LOGGER_NAME = 'post_parser.access'
+LOG_FORMAT = '%(asctime)s %(message)s'
+
+
+@dataclass
+class LogConfig:
+    path: str = 'server.log'
+    max_bytes: int = 10 * 2 ** 20
+    backup_count: int = 5
+    success_sample_rate: float = 1.0
+    level: int = logging.INFO
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are, so message formatting happens on the listener thread
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class SuccessSampler(logging.Filter):
+    """
+    Keeps `rate` fraction of access records with 2xx status and every other record
+    """
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        status = getattr(record, 'status', 0)
+        if 200 <= status < 300 and self.rate < 1:
+            return random.random() < self.rate
+        return True
+
+
+def setup_server_logging(config: LogConfig) -> QueueListener:
+    """
+    Routes all records through an in-memory queue to a size rotated file written by a background thread
+    :return: Started listener, stop it on shutdown to flush the queue
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    file_handler = RotatingFileHandler(config.path, maxBytes=config.max_bytes, backupCount=config.backup_count,
+                                       encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.setLevel(config.level)
+    root.addHandler(_LazyQueueHandler(log_queue))
+
+    access_logger = logging.getLogger(ACCESS_LOGGER_NAME)
+    access_logger.filters.clear()
+    access_logger.addFilter(SuccessSampler(config.success_sample_rate))
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,70 @@
+import io
+import itertools
+import logging
+from timeit import default_timer
+
+from dotenv import load_dotenv
+
+from .db import DB, PostgresDB, create_db
+from .db.file_db import read_posts
+from .migration import BATCH_SIZE, QUEUE_BATCHES, TAIL_INTERVAL, MigrationState, load_state
+from .migration import migrate as run_migration
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _connect(database_name: str) -> DB:
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    return create_db(database_name)
+
+
+def import_file(path: str, database_name: str = 'postgres') -> int:
+    """
+    Loads file in FileDB text format into database, existing posts are updated. PostgreSQL loads it with COPY
+    :return: number of imported posts
+    """
+    db = _connect(database_name)
+    start = default_timer()
+    if isinstance(db, PostgresDB):
+        rows = db.bulk_import(read_posts(path))
+    else:
+        posts = read_posts(path)
+        rows = 0
+        batch = list(itertools.islice(posts, BATCH_SIZE))
+        while batch:
+            rows += db.add_many(batch)
+            batch = list(itertools.islice(posts, BATCH_SIZE))
+    duration = default_timer() - start
+    _LOGGER.info(f'Imported {rows} posts from {path} in {duration:.1f}s ({rows / max(duration, 1e-9):.0f} rows/s)')
+    return rows
+
+
+def export_file(path: str, database_name: str = 'postgres') -> None:
+    """
+    Writes all posts of database to file in FileDB text format. PostgreSQL writes it with COPY
+    """
+    db = _connect(database_name)
+    start = default_timer()
+    with io.open(path, 'w', encoding='utf-8') as file:
+        if isinstance(db, PostgresDB):
+            db.bulk_export(file)
+        else:
+            for post in db.iter_posts():
+                file.write(str(post))
+    _LOGGER.info(f'Exported posts to {path} in {default_timer() - start:.1f}s')
+
+
+def migrate(source: str, target: str, state_path: str, resume: bool = False, batch_size: int = BATCH_SIZE,
+            queue_batches: int = QUEUE_BATCHES, tail: bool = False, interval: float = TAIL_INTERVAL) -> int:
+    """
+    Copies posts between databases, see migration.migrate
+    :return: number of posts written by initial copy
+    """
+    if source == target:
+        raise ValueError('Source and target databases must differ')
+    state = load_state(state_path, source, target) if resume else MigrationState(source, target)
+    if state.last_id:
+        _LOGGER.info(f'Resuming after {state.transferred} posts, last id {state.last_id}')
+    return run_migration(_connect(source), _connect(target), state, state_path, batch_size, queue_batches, tail,
+                         interval)
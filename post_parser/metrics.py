@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from timeit import default_timer
+from typing import Any, Dict, Iterator, List, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+INF_BUCKET = 'le="+Inf"'
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    @abstractmethod
+    def snapshot(self) -> Dict[LabelValues, Any]:
+        ...
+
+    @abstractmethod
+    def merge(self, snapshot: Dict[LabelValues, Any]) -> None:
+        ...
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}')
+        return lines
+
+    def snapshot(self) -> Dict[LabelValues, Any]:
+        with self.lock:
+            return dict(self.values)
+
+    def merge(self, snapshot: Dict[LabelValues, Any]) -> None:
+        with self.lock:
+            for key, value in snapshot.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # per labels: count of observations in every bucket (last one is +Inf), sum and total count
+        self.values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total, count = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[index] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.observe(default_timer() - start, **labels)
+
+    def count(self, **labels: Any) -> int:
+        values = self.values.get(self._key(labels))
+        return values[2] if values else 0
+
+    def quantile(self, q: float, key: LabelValues) -> float:
+        """
+        Upper bound of the bucket the q-quantile falls into
+        """
+        counts, _, count = self.values[key]
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, f'le="{_format_number(bound)}"')
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, INF_BUCKET)} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+    def summary(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, (_, total, count) in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} count={count} '
+                             f'avg={total / count:.4f} p50<={self.quantile(0.5, key)} '
+                             f'p95<={self.quantile(0.95, key)} p99<={self.quantile(0.99, key)}')
+        return lines
+
+    def snapshot(self) -> Dict[LabelValues, Any]:
+        with self.lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+
+    def merge(self, snapshot: Dict[LabelValues, Any]) -> None:
+        with self.lock:
+            for key, (counts, total, count) in snapshot.items():
+                own_counts, own_total, own_count = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+                self.values[key] = ([a + b for a, b in zip(own_counts, counts)], own_total + total,
+                                    own_count + count)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        counter = Counter(name, documentation, labelnames)
+        self.metrics[name] = counter
+        return counter
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        gauge = Gauge(name, documentation, labelnames)
+        self.metrics[name] = gauge
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self.metrics[name] = histogram
+        return histogram
+
+    def render(self) -> str:
+        """
+        Renders all metrics in Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            if isinstance(metric, Histogram):
+                lines.extend(metric.summary())
+            else:
+                lines.extend(line for line in metric.render() if not line.startswith('#'))
+        return '\n'.join(lines)
+
+    def snapshot(self) -> Dict[str, Dict[LabelValues, Any]]:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def merge(self, snapshot: Dict[str, Dict[LabelValues, Any]]) -> None:
+        """
+        Adds up metrics collected by another process
+        """
+        for name, values in snapshot.items():
+            if name in self.metrics:
+                self.metrics[name].merge(values)
+
+
+SCRAPER = Registry()
+PAGE_LOAD_SECONDS = SCRAPER.histogram('scraper_page_load_seconds', 'Time to load a page', ('page',))
+HOVER_WAIT_SECONDS = SCRAPER.histogram('scraper_hover_wait_seconds', 'Time spent hovering tooltips', ('page',))
+SOUP_PARSE_SECONDS = SCRAPER.histogram('scraper_soup_parse_seconds', 'Time to parse page html or json', ('page',))
+USER_FETCH_SECONDS = SCRAPER.histogram('scraper_user_fetch_seconds', 'Time to fetch and parse a user')
+UPLOAD_SECONDS = SCRAPER.histogram('scraper_upload_seconds', 'Time to upload a post to server')
+POSTS_TOTAL = SCRAPER.counter('scraper_posts_total', 'Posts taken by scraper', ('result',))
+
+SERVER = Registry()
+REQUEST_SECONDS = SERVER.histogram('server_request_seconds', 'Time to handle a request', ('method', 'route'))
+REQUESTS_TOTAL = SERVER.counter('server_requests_total', 'Handled requests', ('method', 'route', 'status'))
+DB_CALL_SECONDS = SERVER.histogram('server_db_call_seconds', 'Database call latency', ('backend', 'method'))
+SERIALIZATION_SECONDS = SERVER.histogram('server_serialization_seconds', 'Time to (de)serialize posts',
+                                         ('route',))
+RESPONSE_BYTES = SERVER.histogram('server_response_bytes', 'Response body size', ('route',), SIZE_BUCKETS)
+BYTES_WRITTEN_TOTAL = SERVER.counter('server_bytes_written_total', 'Response body bytes written', ('route',))
+COMPRESSION_SECONDS = SERVER.histogram('server_compression_seconds', 'Time to compress a response body',
+                                       ('encoding',))
+RESPONSE_CACHE_TOTAL = SERVER.counter('server_response_cache_total', 'Response cache lookups', ('result',))
+STREAM_SUBSCRIBERS_TOTAL = SERVER.counter('server_stream_subscribers_total', 'Connections subscribed to post stream')
+STREAM_EVENTS_TOTAL = SERVER.counter('server_stream_events_total', 'Events published to post stream')
+STREAM_DROPPED_TOTAL = SERVER.counter('server_stream_dropped_total', 'Post stream subscribers disconnected',
+                                      ('reason',))
+GROUP_COMMIT_POSTS = SERVER.histogram('server_group_commit_posts', 'Posts written by one group commit', (),
+                                      BATCH_BUCKETS)
+REQUESTS_IN_FLIGHT = SERVER.gauge('server_requests_in_flight', 'Requests being handled', ('kind',))
+ADMISSION_QUEUE_DEPTH = SERVER.gauge('server_admission_queue_depth', 'Connections waiting for a handler thread')
+ADMISSION_REJECTED_TOTAL = SERVER.counter('server_admission_rejected_total', 'Requests answered with 503 by '
+                                          'admission control', ('kind',))
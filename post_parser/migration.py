@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .db import DB
+from .post import Post
+
+_LOGGER = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+QUEUE_BATCHES = 4
+TAIL_INTERVAL = 5.0
+QUEUE_POLL_INTERVAL = 0.1
+
+PostFilter = Callable[[Post], bool]
+BatchCallback = Callable[[List[Post]], None]
+
+
+@dataclass
+class MigrationState:
+    source: str
+    target: str
+    last_id: str = ''
+    transferred: int = 0
+
+
+def load_state(path: str, source: str, target: str) -> MigrationState:
+    """
+    Reads state of interrupted migration, state of another source or target pair is ignored
+    """
+    try:
+        with io.open(path, 'r', encoding='utf-8') as file:
+            state = MigrationState(**json.load(file))
+    except FileNotFoundError:
+        return MigrationState(source, target)
+    if state.source != source or state.target != target:
+        _LOGGER.warning(f'State in {path} is of {state.source} -> {state.target} migration, starting over')
+        return MigrationState(source, target)
+    return state
+
+
+def save_state(path: str, state: MigrationState) -> None:
+    # written next to the old one and renamed, so a crash never leaves a broken state file
+    temp_path = path + '.tmp'
+    with io.open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(asdict(state), file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def _put(batches: queue.Queue, item: Optional[List[Post]], stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=QUEUE_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def transfer(source: DB, target: DB, after: str = '', batch_size: int = BATCH_SIZE,
+             queue_batches: int = QUEUE_BATCHES, accept: Optional[PostFilter] = None,
+             on_batch: Optional[BatchCallback] = None) -> int:
+    """
+    Copies posts ordered by id from source to target. Source is read in a separate thread while target writes
+    previous batch, at most queue_batches batches wait between them
+    :param after: only posts with id greater than after are copied
+    :param accept: posts it returns False for are skipped
+    :param on_batch: called with every batch after it was written
+    :return: number of written posts
+    """
+    batches: queue.Queue = queue.Queue(maxsize=queue_batches)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def read() -> None:
+        try:
+            batch: List[Post] = []
+            for post in source.iter_posts(after, batch_size):
+                if accept is not None and not accept(post):
+                    continue
+                batch.append(post)
+                if len(batch) == batch_size:
+                    if not _put(batches, batch, stop):
+                        return
+                    batch = []
+            if batch:
+                _put(batches, batch, stop)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            _put(batches, None, stop)
+
+    reader = threading.Thread(target=read, name='migration-reader', daemon=True)
+    reader.start()
+    transferred = 0
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            transferred += target.add_many(batch)
+            if on_batch is not None:
+                on_batch(batch)
+    finally:
+        stop.set()
+        reader.join()
+    if errors:
+        raise errors[0]
+    return transferred
+
+
+class ChangeTracker:
+    """
+    Remembers content of posts already written to target, so tail passes write only new or changed posts
+    and delete posts that disappeared from source
+    """
+
+    def __init__(self) -> None:
+        self.fingerprints: Dict[str, int] = {}
+        self.seen: Set[str] = set()
+
+    def record(self, post: Post) -> bool:
+        """
+        Marks post as seen in current pass
+        :return: True if post is new or changed
+        """
+        self.seen.add(post.id)
+        fingerprint = hash(str(post))
+        if self.fingerprints.get(post.id) == fingerprint:
+            return False
+        self.fingerprints[post.id] = fingerprint
+        return True
+
+    def finish_pass(self) -> List[str]:
+        """
+        Ends pass and forgets posts that were not seen in it
+        :return: ids of posts deleted from source
+        """
+        deleted = [post_id for post_id in self.fingerprints if post_id not in self.seen]
+        for post_id in deleted:
+            del self.fingerprints[post_id]
+        self.seen = set()
+        return deleted
+
+
+def sync(source: DB, target: DB, tracker: ChangeTracker, batch_size: int = BATCH_SIZE,
+         queue_batches: int = QUEUE_BATCHES) -> Tuple[int, int]:
+    """
+    One tail pass: writes posts changed since previous pass and deletes posts gone from source
+    :return: numbers of written and deleted posts
+    """
+    written = transfer(source, target, '', batch_size, queue_batches, accept=tracker.record)
+    deleted = tracker.finish_pass()
+    for post_id in deleted:
+        target.delete(post_id)
+    return written, len(deleted)
+
+
+def migrate(source: DB, target: DB, state: MigrationState, state_path: str, batch_size: int = BATCH_SIZE,
+            queue_batches: int = QUEUE_BATCHES, tail: bool = False, interval: float = TAIL_INTERVAL) -> int:
+    """
+    Copies all posts from source to target saving progress to state_path after every batch. With tail it keeps
+    copying changes of source until interrupted
+    :return: number of posts written by initial copy
+    """
+    tracker = ChangeTracker()
+
+    def on_batch(batch: List[Post]) -> None:
+        state.last_id = batch[-1].id
+        state.transferred += len(batch)
+        save_state(state_path, state)
+        _LOGGER.info(f'Transferred {state.transferred} posts')
+
+    start = time.monotonic()
+    transferred = transfer(source, target, state.last_id, batch_size, queue_batches,
+                           accept=tracker.record if tail else None, on_batch=on_batch)
+    duration = time.monotonic() - start
+    _LOGGER.info(f'{state.source} -> {state.target}: {transferred} posts in {duration:.1f}s '
+                 f'({transferred / max(duration, 1e-9):.0f} posts/s)')
+    if not tail:
+        return transferred
+
+    # posts copied before resume were not fingerprinted, first pass rewrites them once
+    tracker.finish_pass()
+    while True:
+        time.sleep(interval)
+        written, deleted = sync(source, target, tracker, batch_size, queue_batches)
+        if written or deleted:
+            _LOGGER.info(f'Synced {written} changed and {deleted} deleted posts')
@@ -1,9 +1,13 @@
 import logging
+import multiprocessing
+import os
+import queue
 import re
 from dataclasses import dataclass
+from itertools import islice
 from multiprocessing.pool import ThreadPool
 from timeit import default_timer
-from typing import List, Tuple, Optional
+from typing import Iterator, List, Tuple, Optional
 
 import requests
 from bs4 import BeautifulSoup
@@ -11,12 +15,19 @@ from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.chrome.options import Options
 
+from .checkpoint import Checkpoint, ResultCallback, SERVER_UNAVAILABLE
+from .exceptions import ServerUnavailableError
+from .http_engine import PipelineConfig, child_url, iter_listing, parse_shard as parse_http_shard, \
+    scrape as scrape_http, trim_child
+from .metrics import POSTS_TOTAL, SCRAPER, UPLOAD_SECONDS
 from .post import Post, parse_post_page
 from .post_schema import PostSchema
+from .sharding import ShardProgress, ShardResult, run_sharded
 
 _LOGGER = logging.getLogger(__name__)
 
 SERVER_POST_URL = 'http://localhost:8087/posts'
+CHECKPOINT_PATH = './parser-checkpoint.jsonl'
 
 REDDIT_URL = 'https://www.reddit.com'
 REDDIT_TOP = '/top/?t=month'
@@ -26,6 +37,39 @@ POST_REGEX = re.compile('Post')
 POST_URL_ATTR = {'data-click-id': 'body'}
 AVG_POST_HEIGHT = 600
 
+ENGINE_SELENIUM = 'selenium'
+ENGINE_HTTP = 'http'
+ENGINES = (ENGINE_SELENIUM, ENGINE_HTTP)
+
+DRIVER_PROFILE_FULL = 'full'
+DRIVER_PROFILE_LEAN = 'lean'
+DRIVER_PROFILES = (DRIVER_PROFILE_FULL, DRIVER_PROFILE_LEAN)
+DRIVER_IMPLICIT_WAIT = 5
+
+BLOCKED_CONTENT = 2
+LEAN_CHROME_PREFS = {
+    'profile.managed_default_content_settings.images': BLOCKED_CONTENT,
+    'profile.managed_default_content_settings.media_stream': BLOCKED_CONTENT,
+    'profile.managed_default_content_settings.plugins': BLOCKED_CONTENT,
+    'profile.managed_default_content_settings.popups': BLOCKED_CONTENT,
+    'profile.managed_default_content_settings.geolocation': BLOCKED_CONTENT,
+    'profile.default_content_setting_values.notifications': BLOCKED_CONTENT,
+    'profile.block_third_party_cookies': True,
+}
+LEAN_BLOCKED_URLS = [
+    # images, media and fonts
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.mp4', '*.webm', '*.m3u8', '*.mp3', '*.ts',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    # reddit media hosts
+    '*i.redd.it*', '*v.redd.it*', '*preview.redd.it*', '*external-preview.redd.it*', '*styles.redditmedia.com*',
+    '*emoji.redditmedia.com*', '*thumbs.redditmedia.com*',
+    # third-party ads and trackers
+    '*doubleclick.net*', '*googlesyndication.com*', '*googletagservices.com*', '*googletagmanager.com*',
+    '*google-analytics.com*', '*amazon-adsystem.com*', '*aaxads.com*', '*adnxs.com*', '*scorecardresearch.com*',
+    '*facebook.net*', '*moatads.com*',
+]
+
 
 @dataclass
 class ParsingResult:
@@ -44,12 +88,11 @@ def posts(driver: webdriver.Chrome, offset: int) -> BeautifulSoup:
         counter += 1
 
 
-def create_drivers(post_driver_number: int = 1) -> Tuple[webdriver.Chrome, List[webdriver.Chrome]]:
+def _create_chrome_options(driver_profile: str, profile_name: str, profile_dir: Optional[str] = None) -> Options:
     """
-    Returns a post scroller driver and list of post parse drivers
+    :param profile_dir: directory lean drivers keep warm profiles in, without it every driver gets a temporary
+    profile of chromedriver removed when it quits
     """
-    if post_driver_number < 1:
-        post_driver_number = 1
     chrome_options = Options()
     chrome_options.add_argument('--disable-notifications')
     chrome_options.add_argument('--headless')
@@ -58,60 +101,186 @@ def create_drivers(post_driver_number: int = 1) -> Tuple[webdriver.Chrome, List[
     chrome_options.add_argument('--disable-gpu')
     chrome_options.add_argument('log-level=3')
     chrome_options.add_argument('--disable-dev-shm-usage')
-    return webdriver.Chrome(options=chrome_options), [webdriver.Chrome(options=chrome_options) for _ in
-                                                      range(post_driver_number)]
+    if driver_profile == DRIVER_PROFILE_LEAN:
+        chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+        chrome_options.add_argument('--autoplay-policy=user-gesture-required')
+        chrome_options.add_argument('--mute-audio')
+        chrome_options.add_argument('--disable-extensions')
+        if profile_dir is not None:
+            profile_path = os.path.abspath(os.path.join(profile_dir, profile_name))
+            chrome_options.add_argument(f'--user-data-dir={profile_path}')
+        chrome_options.add_experimental_option('prefs', LEAN_CHROME_PREFS)
+        chrome_options.set_capability('pageLoadStrategy', 'eager')
+    return chrome_options
+
+
+def _create_driver(driver_profile: str, profile_name: str, profile_dir: Optional[str] = None) -> webdriver.Chrome:
+    driver = webdriver.Chrome(options=_create_chrome_options(driver_profile, profile_name, profile_dir))
+    if driver_profile == DRIVER_PROFILE_LEAN:
+        # eager page load returns before reddit renders, so element lookups have to wait for it
+        driver.implicitly_wait(DRIVER_IMPLICIT_WAIT)
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': LEAN_BLOCKED_URLS})
+    return driver
+
+
+def create_drivers(post_driver_number: int = 1, driver_profile: str = DRIVER_PROFILE_FULL,
+                   profile_dir: Optional[str] = None) -> Tuple[webdriver.Chrome, List[webdriver.Chrome]]:
+    """
+    Returns a post scroller driver and list of post parse drivers.
+    Lean drivers block images, media, fonts and third-party domains
+    :param profile_dir: lean drivers keep a warm profile per driver in it, runs at the same time need their own
+    """
+    if post_driver_number < 1:
+        post_driver_number = 1
+    if driver_profile not in DRIVER_PROFILES:
+        raise ValueError(f'Unknown driver profile {driver_profile}')
+    return _create_driver(driver_profile, 'top', profile_dir), [
+        _create_driver(driver_profile, f'post-{number}', profile_dir) for number in range(post_driver_number)]
 
 
-def parse_post(driver: webdriver.Chrome, url: str) -> Optional[Post]:
+def parse_post(driver: webdriver.Chrome, url: str, on_result: Optional[ResultCallback] = None) -> Optional[Post]:
+    """
+    Parses post page and uploads it to server
+    :param on_result: Called with url, Post or None and failure reason
+    :raises ServerUnavailableError: if post can't be uploaded
+    """
+    post = None
+    reason = ''
     try:
         post = parse_post_page(driver, url)
         post_schema = PostSchema()
-        requests.post(SERVER_POST_URL, data=post_schema.dumps(post))
-        return post
-    except ConnectionError:
+        with UPLOAD_SECONDS.time():
+            requests.post(SERVER_POST_URL, data=post_schema.dumps(post))
+    except requests.exceptions.ConnectionError:
         _LOGGER.error('Currently server is unavailable')
-        exit()
+        if on_result:
+            on_result(url, None, SERVER_UNAVAILABLE)
+        raise ServerUnavailableError
     except NoSuchElementException:
         _LOGGER.error('User unavailable due to 18+ policy or deleted profile')
-    except Exception:
+        post, reason = None, '18+ policy or deleted profile'
+    except Exception as e:
         _LOGGER.exception('Something went wrong while parsing post')
-    return None
+        post, reason = None, repr(e)
+    POSTS_TOTAL.inc(result='parsed' if post else 'failed')
+    if on_result:
+        on_result(url, post, reason)
+    return post
+
 
+def _post_urls(driver: webdriver.Chrome, offset: int) -> Iterator[Tuple[str, None]]:
+    for non_parsed_post in posts(driver, offset):
+        yield REDDIT_URL + non_parsed_post.find('a', attrs=POST_URL_ATTR).get('href'), None
 
-def run(amount: int = 100, offset: int = 0, workers: int = 5) -> ParsingResult:
+
+def _parse_shard(shard: int, url_queue: multiprocessing.Queue, result_queue: multiprocessing.Queue, workers: int,
+                 driver_profile: str, profile_dir: Optional[str]) -> None:
+    """
+    Worker process target: parses post urls of its shard with own drivers until None arrives
+    """
     logging.basicConfig(level=logging.INFO)
     start = default_timer()
-    chrome, post_drivers = create_drivers(workers)
-    chrome.get(REDDIT_URL + REDDIT_TOP)
-    taken_posts = 0
-    not_parsed_urls: List[str] = []
-    complete_results = []
-    for non_parsed_post in posts(chrome, offset):
-        if len(not_parsed_urls) < workers:
-            taken_posts += 1
-            post_url = non_parsed_post.find('a', attrs=POST_URL_ATTR).get('href')
-            not_parsed_urls.append(post_url)
-            continue
-
-        tasks = [(driver, REDDIT_URL + url) for driver, url in zip(post_drivers, not_parsed_urls)]
+    workers = max(workers, 1)
+    drivers: queue.Queue = queue.Queue()
+    for number in range(workers):
+        drivers.put(_create_driver(driver_profile, f'shard-{shard}-post-{number}', profile_dir))
 
-        with ThreadPool(workers) as pool:
-            results = [pool.apply_async(parse_post, t) for t in tasks]
-            pool.close()
-            pool.join()
+    def report(url: str, post: Optional[Post], reason: str) -> None:
+        result_queue.put(ShardProgress(url, post.id if post else None, reason))
+
+    def parse(url: str) -> Optional[Post]:
+        driver = drivers.get()
+        try:
+            return parse_post(driver, url, report)
+        except ServerUnavailableError:
+            return None
+        finally:
+            drivers.put(driver)
+
+    with ThreadPool(workers) as pool:
+        pending = [pool.apply_async(parse, (url,)) for url in iter(url_queue.get, None)]
+        results = [result.get() for result in pending]
+
+    while not drivers.empty():
+        drivers.get().quit()
+    result_queue.put(ShardResult(shard, [post for post in results if post is not None], default_timer() - start,
+                                 SCRAPER.snapshot()))
+
+
+def _run_sharded(amount: int, offset: int, workers: int, driver_profile: str, profile_dir: Optional[str], engine: str,
+                 pipeline_config: Optional[PipelineConfig], processes: int, checkpoint: Checkpoint) -> List[Post]:
+    def on_progress(progress: ShardProgress) -> None:
+        progress.record(checkpoint)
+
+    if engine == ENGINE_HTTP:
+        # every shard and the listing of this process limit their own requests, together they keep the limit
+        config = (pipeline_config or PipelineConfig()).split(processes + 1)
+        after, skip = checkpoint.state.cursor or (None, offset)
+        children = iter_listing(REDDIT_URL, skip, config, after, on_page=checkpoint.cursor)
+        feed = checkpoint.feed((child_url(REDDIT_URL, child), trim_child(child)) for child in children)
+        return run_sharded(feed, parse_http_shard, (REDDIT_URL, SERVER_POST_URL, config), amount, processes,
+                           window=processes * config.user_concurrency, on_progress=on_progress)
+
+    chrome = _create_driver(driver_profile, 'top', profile_dir)
+    try:
+        chrome.get(REDDIT_URL + REDDIT_TOP)
+        feed = ((url, url) for url, _ in checkpoint.feed(_post_urls(chrome, offset + len(checkpoint.state.harvested))))
+        return run_sharded(feed, _parse_shard, (workers, driver_profile, profile_dir), amount, processes,
+                           window=processes * workers, on_progress=on_progress)
+    finally:
+        chrome.quit()
 
-        new_results = [r.get() for r in results]
-        complete_results.extend([r for r in new_results if r is not None])
-        not_parsed_urls.clear()
 
-        if len(complete_results) >= amount:
-            break
-        _LOGGER.info(f'{taken_posts} posts taken. {len(complete_results)} posts passed.')
+def _run_selenium(amount: int, offset: int, workers: int, driver_profile: str, profile_dir: Optional[str],
+                  checkpoint: Checkpoint) -> List[Post]:
+    chrome, post_drivers = create_drivers(workers, driver_profile, profile_dir)
+    chrome.get(REDDIT_URL + REDDIT_TOP)
+    # pending urls of a resumed run come first, so the page is scrolled only when they are over
+    urls = (url for url, _ in checkpoint.feed(_post_urls(chrome, offset + len(checkpoint.state.harvested))))
+    complete_results: List[Post] = []
+    try:
+        with ThreadPool(workers) as pool:
+            while len(complete_results) < amount:
+                not_parsed_urls = list(islice(urls, len(post_drivers)))
+                if not not_parsed_urls:
+                    break
+                tasks = [(driver, url, checkpoint.on_result) for driver, url in zip(post_drivers, not_parsed_urls)]
+                new_results = pool.starmap(parse_post, tasks)
+                complete_results.extend([r for r in new_results if r is not None])
+                _LOGGER.info(f'{len(checkpoint.state.harvested)} posts taken. {len(complete_results)} posts passed.')
+    except ServerUnavailableError:
+        _LOGGER.error('Parsing stopped, run with --resume when server is back')
+    finally:
+        chrome.quit()
+        for post_driver in post_drivers:
+            post_driver.quit()
+    return complete_results
 
-    chrome.close()
-    for post_driver in post_drivers:
-        post_driver.close()
+
+def run(amount: int = 100, offset: int = 0, workers: int = 5,
+        driver_profile: str = DRIVER_PROFILE_FULL, engine: str = ENGINE_SELENIUM,
+        pipeline_config: Optional[PipelineConfig] = None, processes: int = 1,
+        checkpoint_path: str = CHECKPOINT_PATH, resume: bool = False,
+        driver_profile_dir: Optional[str] = None) -> ParsingResult:
+    logging.basicConfig(level=logging.INFO)
+    start = default_timer()
+    checkpoint = Checkpoint(checkpoint_path, resume)
+    amount -= len(checkpoint.state.completed)
+    try:
+        if amount <= 0:
+            complete_results: List[Post] = []
+        elif processes > 1:
+            complete_results = _run_sharded(amount, offset, workers, driver_profile, driver_profile_dir, engine,
+                                            pipeline_config, processes, checkpoint)
+        elif engine == ENGINE_HTTP:
+            complete_results = scrape_http(amount, offset, REDDIT_URL, SERVER_POST_URL, pipeline_config, checkpoint)
+        else:
+            complete_results = _run_selenium(amount, offset, workers, driver_profile, driver_profile_dir, checkpoint)
+    finally:
+        checkpoint.close()
 
     duration = default_timer() - start
     _LOGGER.info(f'Total elapsed time {duration} seconds')
-    return ParsingResult(complete_results[:amount], duration)
+    _LOGGER.info('Stage timings:\n' + SCRAPER.summary())
+    return ParsingResult(complete_results[:max(amount, 0)], duration)
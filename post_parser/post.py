@@ -7,13 +7,14 @@ import time
 from dataclasses import dataclass, field
 from datetime import datetime
 from timeit import default_timer
-from typing import Tuple
+from typing import TYPE_CHECKING, Tuple, Union
 from urllib.parse import urlsplit
 
-from bs4 import BeautifulSoup
-from dateutil import parser
-from selenium import webdriver
-from selenium.webdriver.common.action_chains import ActionChains
+from .metrics import HOVER_WAIT_SECONDS, PAGE_LOAD_SECONDS, SOUP_PARSE_SECONDS, USER_FETCH_SECONDS
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+    from selenium import webdriver
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -32,27 +33,33 @@ USER_URL_REGEX = re.compile('/user/.*')
 
 
 def parse_post_page(driver: webdriver.Chrome, url: str) -> Post:
+    from bs4 import BeautifulSoup
+
     _LOGGER.info(f'Started parsing post {url}')
     parsing_start = default_timer()
-    driver.get(url)
+    with PAGE_LOAD_SECONDS.time(page='post'):
+        driver.get(url)
 
-    set_mouse_over(driver, POST_DATE_SELECTOR)
-    time.sleep(0.5)
+    with HOVER_WAIT_SECONDS.time(page='post'):
+        set_mouse_over(driver, POST_DATE_SELECTOR)
+        time.sleep(0.5)
 
-    post_soup = BeautifulSoup(driver.page_source, 'html.parser')
+    with SOUP_PARSE_SECONDS.time(page='post'):
+        post_soup = BeautifulSoup(driver.page_source, 'html.parser')
 
-    post_date = _parse_post_date(post_soup)
-    post_category = _parse_post_category(post_soup)
-    number_of_comments = _parse_number_of_comments(post_soup)
-    vote_percentage = _parse_upvote_percentage(post_soup)
-    post_rating = _parse_post_rating(post_soup)
-    user_url = _parse_user_url(post_soup)
+        post_date = _parse_post_date(post_soup)
+        post_category = _parse_post_category(post_soup)
+        number_of_comments = _parse_number_of_comments(post_soup)
+        vote_percentage = _parse_upvote_percentage(post_soup)
+        post_rating = _parse_post_rating(post_soup)
+        user_url = _parse_user_url(post_soup)
 
-    number_of_votes = int(50 * post_rating / (vote_percentage - 50))
+    number_of_votes = count_votes(post_rating, vote_percentage)
 
     user_url = "{0.scheme}://{0.netloc}".format(urlsplit(url)) + user_url
 
-    user = parse_user_page(driver, user_url)
+    with USER_FETCH_SECONDS.time():
+        user = parse_user_page(driver, user_url)
 
     _LOGGER.info(f'Post parsing success {default_timer() - parsing_start} seconds')
 
@@ -60,30 +67,62 @@ def parse_post_page(driver: webdriver.Chrome, url: str) -> Post:
 
 
 def parse_user_page(driver: webdriver.Chrome, url: str) -> User:
+    from bs4 import BeautifulSoup
+
     _LOGGER.info(f'Parsing user {url}')
-    driver.get(url)
+    with PAGE_LOAD_SECONDS.time(page='user'):
+        driver.get(url)
 
-    set_mouse_over(driver, USER_KARMA_AND_CAKE_DAY_SELECTOR)
-    time.sleep(0.5)
+    with HOVER_WAIT_SECONDS.time(page='user'):
+        set_mouse_over(driver, USER_KARMA_AND_CAKE_DAY_SELECTOR)
+        time.sleep(0.5)
 
-    user_soup = BeautifulSoup(driver.page_source, 'html.parser')
+    with SOUP_PARSE_SECONDS.time(page='user'):
+        user_soup = BeautifulSoup(driver.page_source, 'html.parser')
 
-    post_karma, comment_karma = _parse_karma(user_soup)
-    user_karma = _parse_user_karma(user_soup)
-    username = _parse_username(user_soup)
-    user_cake_day = _parse_cake_day(user_soup)
+        post_karma, comment_karma = _parse_karma(user_soup)
+        user_karma = _parse_user_karma(user_soup)
+        username = _parse_username(user_soup)
+        user_cake_day = _parse_cake_day(user_soup)
 
     _LOGGER.info('User parsing success')
     return User(username, user_karma, user_cake_day, post_karma, comment_karma)
 
 
+def post_id(post_url: str) -> str:
+    return hashlib.md5(post_url.encode('ascii')).hexdigest()
+
+
+def count_votes(post_rating: int, vote_percentage: int) -> int:
+    """
+    Restores total number of votes from post rating (upvotes minus downvotes) and upvote percentage
+    """
+    return int(50 * post_rating / (vote_percentage - 50))
+
+
 def parse_number(number: str) -> int:
     if 'k' in number:
         return int(float(number.replace('k', '')) * 1000)
     return int(number)
 
 
+def as_datetime(post_date: Union[datetime, str]) -> datetime:
+    """
+    Posts loaded by PostSchema keep post_date as a string from request body
+    """
+    if isinstance(post_date, datetime):
+        return post_date
+    try:
+        return datetime.fromisoformat(post_date)
+    except ValueError:
+        from dateutil import parser
+
+        return parser.parse(post_date)
+
+
 def set_mouse_over(driver: webdriver.Chrome, css_selector: str) -> None:
+    from selenium.webdriver.common.action_chains import ActionChains
+
     ActionChains(driver).move_to_element(
         driver.find_element_by_css_selector(css_selector)).perform()
 
@@ -118,6 +157,8 @@ def _parse_cake_day(soup: BeautifulSoup) -> str:
 
 
 def _parse_post_date(soup: BeautifulSoup) -> datetime:
+    from dateutil import parser
+
     post_date = soup.find(class_=POST_DATE_CLASS).text
     post_date = re.sub('\\s\\(.*\\)', '', post_date)
     return parser.parse(post_date)
@@ -171,7 +212,7 @@ class Post:
 
     @property
     def id(self) -> str:
-        return hashlib.md5(self.post_url.encode('ascii')).hexdigest()
+        return post_id(self.post_url)
 
     @classmethod
     def from_post_page(cls, user: User, post_url: str, post_date: datetime, number_of_comments: int,
@@ -0,0 +1,99 @@
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, TypeVar
+from urllib.parse import parse_qsl, urlparse
+
+_LOGGER = logging.getLogger(__name__)
+
+PROFILE_DIR = './profiles'
+PROFILE_QUERY = '__profile'
+
+T = TypeVar('T')
+
+
+def _slug(name: str) -> str:
+    return re.sub('[^a-zA-Z0-9]+', '_', name).strip('_') or 'root'
+
+
+class RequestProfiler:
+    """
+    Profiles a sampled fraction of requests, or any request with ?__profile=1, with cProfile.
+    Stats are accumulated per route and dumped to <directory>/<method>_<route>.pstats after every profiled request
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, rate: float = 0.01) -> None:
+        self.directory = directory
+        self.rate = rate
+        self.stats: Dict[str, pstats.Stats] = {}
+        # only one cProfile may be active in the process at once since python 3.12
+        self.active = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def wants(self, path: str) -> bool:
+        if dict(parse_qsl(urlparse(path).query)).get(PROFILE_QUERY) == '1':
+            return True
+        return random.random() < self.rate
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        if not self.active.acquire(blocking=False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+            self._save(name, profiler)
+        finally:
+            self.active.release()
+
+    def _save(self, name: str, profiler: cProfile.Profile) -> None:
+        if name in self.stats:
+            self.stats[name].add(profiler)
+        else:
+            self.stats[name] = pstats.Stats(profiler)
+        path = os.path.join(self.directory, f'{_slug(name)}.pstats')
+        self.stats[name].dump_stats(path)
+        _LOGGER.info(f'Profile of {name} written to {path}')
+
+
+def profiled(handler: Callable[[Any], None]) -> Callable[[Any], None]:
+    """
+    Wraps do_<METHOD> of a request handler that has `profiler`, costs one attribute check when it is None
+    """
+
+    @functools.wraps(handler)
+    def wrapper(self: Any) -> None:
+        profiler = self.profiler
+        if profiler is None or not profiler.wants(self.path):
+            handler(self)
+            return
+        with profiler.profile(f'{self.command} {self.route}'):
+            handler(self)
+
+    return wrapper
+
+
+def profile_call(path: str, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs function under cProfile and writes stats to path
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+        _LOGGER.info(f'Profile written to {path}')
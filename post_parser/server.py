@@ -1,32 +1,111 @@
+import functools
+import io
 import json
 import logging
-import os
+import socket
+import threading
+from collections import deque
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from typing import List, Any, Type, Callable
+from timeit import default_timer
+from typing import TYPE_CHECKING, Deque, Dict, Iterator, List, Any, Set, Type, Callable, Optional, Tuple
 from urllib.parse import parse_qsl, urlparse
 
 from dotenv import load_dotenv
 
-from .db import DB, PostNotFoundException, MongoDB, PostgresDB, FileDB
-from .post_schema import PostSchema
+from .admission import POLL, QUEUE, AdmissionConfig, AdmissionControl, request_kind
+from .broadcast import Broadcaster, encode_event
+from .compression import CompressionConfig, ResponseCache, create_compressor, negotiate
+from .db import DB, PostNotFoundException, create_db
+from .db.changes import CHANGES_LIMIT, ChangeNotifier
+from .db.constants import FIELDS_NAME
+from .db.projection import dumps_projected, json_default, parse_fields
+from .db.stats import TOP_USERS
+from .export import CONTENT_TYPES, EXPORT_BATCH, PARQUET, available_formats, export
+from .group_commit import GROUP_COMMIT_WINDOW, GroupCommit
+from .logs import ACCESS_LOGGER_NAME, LogConfig, setup_server_logging
+from .metrics import SERVER, REQUEST_SECONDS, REQUESTS_TOTAL, DB_CALL_SECONDS, SERIALIZATION_SECONDS, \
+    RESPONSE_BYTES, BYTES_WRITTEN_TOTAL, COMPRESSION_SECONDS, RESPONSE_CACHE_TOTAL, ADMISSION_QUEUE_DEPTH, \
+    ADMISSION_REJECTED_TOTAL
+from .profiling import RequestProfiler, profiled
+
+if TYPE_CHECKING:
+    from .post_schema import PostSchema
 
 _LOGGER = logging.getLogger(__name__)
+_ACCESS_LOGGER = logging.getLogger(ACCESS_LOGGER_NAME)
 
 IP_ADDRESS = '127.0.0.1'
 PORT = 8087
 
 CONTENT_LENGTH_HEADER = 'Content-Length'
 CONTENT_TYPE_HEADER = 'Content-Type'
+CONTENT_DISPOSITION_HEADER = 'Content-Disposition'
+CONTENT_ENCODING_HEADER = 'Content-Encoding'
+ACCEPT_ENCODING_HEADER = 'Accept-Encoding'
+VARY_HEADER = 'Vary'
 CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_EVENT_STREAM = 'text/event-stream; charset=utf-8'
+CONTENT_TYPE_PROMETHEUS = 'text/plain; version=0.0.4; charset=utf-8'
+CACHE_CONTROL_HEADER = 'Cache-Control'
+RETRY_AFTER_HEADER = 'Retry-After'
+NO_CACHE = 'no-cache'
 CORS_HEADER = 'Access-Control-Allow-Origin'
 ALLOW_ALL = '*'
 
 RESPONSE_OK = 200
 RESPONSE_CREATED = 201
+RESPONSE_BAD_REQUEST = 400
 RESPONSE_NOT_FOUND = 404
+RESPONSE_SERVICE_UNAVAILABLE = 503
+
+POSTS_ROUTE = '/posts'
+POST_ROUTE = '/posts/{id}'
+STATS_ROUTE = '/posts/stats'
+EXPORT_ROUTE = '/posts/export'
+CHANGES_ROUTE = '/posts/changes'
+STREAM_ROUTE = '/posts/stream'
+METRICS_ROUTE = '/metrics'
+UNKNOWN_ROUTE = 'unknown'
+
+TOP_USERS_NAME = 'top'
+MAX_TOP_USERS = 1000
+FORMAT_NAME = 'format'
+SINCE_NAME = 'since'
+LIMIT_NAME = 'limit'
+WAIT_NAME = 'wait'
+# longest long poll of the change feed in seconds
+MAX_CHANGES_WAIT = 60.0
+# body of a rejected request up to this size is read, closing a connection with unread data resets it
+MAX_DISCARDED_BODY = 2 ** 16
+
+POST_EVENT = 'post'
+
+
+@functools.lru_cache(maxsize=None)
+def _post_schema(many: bool = False) -> 'PostSchema':
+    """
+    marshmallow takes longer to import than the rest of the server, so schemas are created by the first request
+    """
+    from .post_schema import PostSchema
+
+    return PostSchema(many=many)
+
 
-POST_SCHEMA = PostSchema()
-POSTS_SCHEMA = PostSchema(many=True)
+def _dumps_posts(posts: List[Any]) -> str:
+    return _post_schema(many=True).dumps(posts)
+
+
+def _serialize_posts(posts: List[Any], chunk_size: int, dumps: Callable[[List[Any]], str] = _dumps_posts
+                     ) -> Iterator[bytes]:
+    """
+    Serializes posts to one JSON array, chunk_size posts at a time
+    :param dumps: serializer of a list, dumps_projected for projected posts
+    """
+    yield b'['
+    for start in range(0, len(posts), chunk_size):
+        chunk = dumps(posts[start:start + chunk_size])[1:-1]
+        yield (', ' + chunk if start else chunk).encode('ascii')
+    yield b']'
 
 
 def _split_url_path(url_path: str) -> List[str]:
@@ -47,150 +126,628 @@ def _split_url_path(url_path: str) -> List[str]:
     return separated
 
 
+def _route(url_path: str) -> str:
+    """
+    Maps request path to route template used as metrics label
+    """
+    path_components = _split_url_path(urlparse(url_path).path)
+    if path_components == ['metrics']:
+        return METRICS_ROUTE
+    if len(path_components) == 1 and 'posts' in path_components[0]:
+        return POSTS_ROUTE
+    if path_components == ['posts', 'stats']:
+        return STATS_ROUTE
+    if path_components == ['posts', 'export']:
+        return EXPORT_ROUTE
+    if path_components == ['posts', 'changes']:
+        return CHANGES_ROUTE
+    if path_components == ['posts', 'stream']:
+        return STREAM_ROUTE
+    if len(path_components) == 2 and path_components[0] == 'posts':
+        return POST_ROUTE
+    return UNKNOWN_ROUTE
+
+
+class PostHTTPServer(ThreadingHTTPServer):
+    """
+    Handles connections with at most max_connections threads of admission config, a thread takes the next queued
+    connection when it is done. Leaves connections handed over to the post stream open after their handler returns
+    """
+
+    def __init__(self, server_address: Tuple[str, int], handler: Callable[..., Any],
+                 admission: Optional[AdmissionConfig] = None, bind_and_activate: bool = True) -> None:
+        self.admission = AdmissionControl(admission or AdmissionConfig())
+        # backlog of the listening socket is bounded like the queue of accepted connections
+        self.request_queue_size = self.admission.config.queue_size
+        self._queue: Deque[Tuple[socket.socket, Any]] = deque()
+        self._workers = 0
+        self._workers_lock = threading.Lock()
+        self._detached: Set[socket.socket] = set()
+        self._detached_lock = threading.Lock()
+        super(PostHTTPServer, self).__init__(server_address, handler, bind_and_activate)
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        config = self.admission.config
+        with self._workers_lock:
+            start = self._workers < config.max_connections
+            queued = not start and len(self._queue) < config.queue_size
+            if start:
+                self._workers += 1
+            elif queued:
+                self._queue.append((request, client_address))
+                ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+        if start:
+            threading.Thread(target=self._work, args=(request, client_address), daemon=self.daemon_threads).start()
+        elif not queued:
+            self._reject(request)
+
+    def _work(self, request: Any, client_address: Any) -> None:
+        while True:
+            self.process_request_thread(request, client_address)
+            with self._workers_lock:
+                if not self._queue:
+                    self._workers -= 1
+                    return
+                request, client_address = self._queue.popleft()
+                ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+
+    def _reject(self, request: socket.socket) -> None:
+        """
+        Answers connection with 503 from the accepting thread, without reading more than has arrived
+        """
+        ADMISSION_REJECTED_TOTAL.inc(kind=QUEUE)
+        try:
+            request.setblocking(False)
+            try:
+                while request.recv(MAX_DISCARDED_BODY):
+                    pass
+            except BlockingIOError:
+                pass
+            request.send(self.admission.rejected_response())
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super(PostHTTPServer, self).server_close()
+        with self._workers_lock:
+            while self._queue:
+                self.shutdown_request(self._queue.popleft()[0])
+
+    def detach(self, request: socket.socket) -> None:
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def shutdown_request(self, request: Any) -> None:
+        with self._detached_lock:
+            if request in self._detached:
+                self._detached.remove(request)
+                return
+        super(PostHTTPServer, self).shutdown_request(request)
+
+
 class RequestHandler(BaseHTTPRequestHandler):
-    def __init__(self, db: DB, *args: Any, **kwargs: Any):
+    def __init__(self, db: DB, *args: Any, profiler: Optional[RequestProfiler] = None,
+                 compression: Optional[CompressionConfig] = None, cache: Optional[ResponseCache] = None,
+                 notifier: Optional[ChangeNotifier] = None, broadcaster: Optional[Broadcaster] = None,
+                 group_commit: Optional[GroupCommit] = None, **kwargs: Any):
         self.db = db
+        self.backend = type(db).__name__
+        self.profiler = profiler
+        self.compression = compression or CompressionConfig()
+        self.cache = cache
+        self.notifier = notifier
+        self.broadcaster = broadcaster
+        self.group_commit = group_commit
+        self.status = 0
+        self.bytes_written = 0
+        # budget the request was admitted to
+        self.admitted: Optional[str] = None
         super(RequestHandler, self).__init__(*args, **kwargs)
 
+    @property
+    def route(self) -> str:
+        return _route(self.path)
+
+    def handle_one_request(self) -> None:
+        start = default_timer()
+        self.command = ''
+        self.status = 0
+        self.bytes_written = 0
+        try:
+            super(RequestHandler, self).handle_one_request()
+        finally:
+            if self.admitted is not None and isinstance(self.server, PostHTTPServer):
+                self.server.admission.release(self.admitted)
+                self.admitted = None
+        if self.command:
+            duration = default_timer() - start
+            route = self.route
+            REQUEST_SECONDS.observe(duration, method=self.command, route=route)
+            REQUESTS_TOTAL.inc(method=self.command, route=route, status=self.status)
+            _ACCESS_LOGGER.info('method=%s path=%s status=%d duration_ms=%.2f bytes=%d client=%s', self.command,
+                                self.path, self.status, duration * 1000, self.bytes_written,
+                                self.client_address[0], extra={'status': self.status})
+
+    def parse_request(self) -> bool:
+        """
+        Admits parsed request to the budget of its method, metrics are always served
+        """
+        if not super(RequestHandler, self).parse_request():
+            return False
+        if not isinstance(self.server, PostHTTPServer) or self.route == METRICS_ROUTE:
+            return True
+        kind = request_kind(self.command)
+        if not self.server.admission.try_acquire(kind):
+            self._send_unavailable()
+            return False
+        self.admitted = kind
+        return True
+
+    def _send_unavailable(self) -> None:
+        content_len = int(self.headers.get(CONTENT_LENGTH_HEADER, 0) or 0)
+        if 0 < content_len <= MAX_DISCARDED_BODY:
+            self.rfile.read(content_len)
+        self.send_response(RESPONSE_SERVICE_UNAVAILABLE)
+        if isinstance(self.server, PostHTTPServer):
+            self.send_header(RETRY_AFTER_HEADER, str(self.server.admission.config.retry_after))
+        self.send_header(CONTENT_LENGTH_HEADER, '0')
+        self.end_headers()
+        self.close_connection = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # stderr access log is replaced by the structured one written in handle_one_request
+        pass
+
+    def log_error(self, format: str, *args: Any) -> None:
+        _LOGGER.error(format, *args)
+
+    def send_response(self, code: int, message: Optional[str] = None) -> None:
+        self.status = code
+        super(RequestHandler, self).send_response(code, message)
+
+    def _call_db(self, method: str, *args: Any) -> Any:
+        with DB_CALL_SECONDS.time(backend=self.backend, method=method):
+            return getattr(self.db, method)(*args)
+
+    def _write_chunk(self, route: str, data: bytes) -> None:
+        self.wfile.write(data)
+        self.bytes_written += len(data)
+        BYTES_WRITTEN_TOTAL.inc(len(data), route=route)
+
+    def _write_body(self, route: str, body: bytes) -> None:
+        self._write_chunk(route, body)
+        RESPONSE_BYTES.observe(len(body), route=route)
+
+    def _add(self, post: Any) -> bool:
+        """
+        Adds post through group commit when it is enabled
+        """
+        if self.group_commit is None:
+            return self._call_db('add', post)
+        with DB_CALL_SECONDS.time(backend=self.backend, method='add'):
+            return self.group_commit.add(post)
+
+    def _after_write(self) -> None:
+        """
+        Drops cached responses and wakes long-polling readers of the change feed
+        """
+        if self.cache is not None:
+            self.cache.invalidate()
+        if self.notifier is not None:
+            self.notifier.notify()
+
+    def _send_json_headers(self, encoding: Optional[str], length: Optional[int]) -> None:
+        self.send_response(RESPONSE_OK)
+        self.send_header(CONTENT_TYPE_HEADER, CONTENT_TYPE_JSON)
+        self.send_header(CORS_HEADER, ALLOW_ALL)
+        self.send_header(VARY_HEADER, ACCEPT_ENCODING_HEADER)
+        if encoding is not None:
+            self.send_header(CONTENT_ENCODING_HEADER, encoding)
+        if length is not None:
+            self.send_header(CONTENT_LENGTH_HEADER, str(length))
+        self.end_headers()
+
+    def _send_cached(self, route: str, key: Tuple[str, Optional[str]]) -> bool:
+        """
+        Sends body cached under key
+        :return: True if it was cached
+        """
+        if self.cache is None:
+            return False
+        cached = self.cache.get(key)
+        RESPONSE_CACHE_TOTAL.inc(result='miss' if cached is None else 'hit')
+        if cached is None:
+            return False
+        self._send_json_headers(cached.encoding, len(cached.body))
+        self._write_body(route, cached.body)
+        return True
+
+    def _cache_generation(self) -> int:
+        return self.cache.generation if self.cache is not None else 0
+
+    def _send_json(self, route: str, body: bytes, encoding: Optional[str], key: Optional[Tuple[str, Optional[str]]],
+                   generation: int) -> None:
+        """
+        Compresses body unless it is too small, sends it and caches it until the next write
+        :param key: None for responses that are not cached
+        """
+        if len(body) < self.compression.min_size:
+            encoding = None
+        if encoding is not None:
+            with COMPRESSION_SECONDS.time(encoding=encoding):
+                compressor = create_compressor(encoding)
+                body = compressor.compress(body) + compressor.flush()
+        self._send_json_headers(encoding, len(body))
+        self._write_body(route, body)
+        if self.cache is not None and key is not None:
+            self.cache.put(key, body, encoding, generation)
+
+    def _send_posts(self, query_dict: Dict[str, str]) -> None:
+        """
+        Sends post list encoded as client accepts. Lists longer than stream_posts are serialized and compressed
+        chunk by chunk while they are written. With fields only given fields are read and sent
+        """
+        try:
+            fields = parse_fields(query_dict.get(FIELDS_NAME))
+        except ValueError:
+            self.send_response(RESPONSE_BAD_REQUEST)
+            self.end_headers()
+            return
+
+        encoding = negotiate(self.headers.get(ACCEPT_ENCODING_HEADER))
+        key = (self.path, encoding)
+        if self._send_cached(POSTS_ROUTE, key):
+            return
+        generation = self._cache_generation()
+
+        dumps: Callable[[List[Any]], str] = _dumps_posts
+        if fields is not None:
+            posts = self._call_db('get_projected', query_dict if query_dict.get('pagination', '') else {}, fields)
+            dumps = dumps_projected
+        elif query_dict.get('pagination', ''):
+            posts = self._call_db('get_filtered', query_dict)
+        else:
+            posts = self._call_db('get_all')
+
+        if len(posts) > self.compression.stream_posts:
+            body = self._stream_posts(posts, encoding, dumps)
+            if self.cache is not None and body is not None:
+                self.cache.put(key, body, encoding, generation)
+            return
+        with SERIALIZATION_SECONDS.time(route=POSTS_ROUTE):
+            body = dumps(posts).encode('ascii')
+        self._send_json(POSTS_ROUTE, body, encoding, key, generation)
+
+    def _stream_posts(self, posts: List[Any], encoding: Optional[str], dumps: Callable[[List[Any]], str]
+                      ) -> Optional[bytes]:
+        """
+        :return: whole written body if it fits into cache
+        """
+        # length is unknown until the end, body ends when connection closes
+        self._send_json_headers(encoding, None)
+        cache_limit = self.cache.max_bytes if self.cache is not None else 0
+        return self._write_stream(POSTS_ROUTE, _serialize_posts(posts, self.compression.stream_posts, dumps),
+                                  encoding, cache_limit)
+
+    def _write_stream(self, route: str, chunks: Iterator[bytes], encoding: Optional[str],
+                      cache_limit: int = 0) -> Optional[bytes]:
+        """
+        Compresses and writes chunks as they are produced
+        :return: whole written body if it is not longer than cache_limit
+        """
+        compressor = create_compressor(encoding)
+        written: List[bytes] = []
+        size = 0
+        serialization = compression = 0.0
+        while True:
+            start = default_timer()
+            chunk = next(chunks, None)
+            serialization += default_timer() - start
+            start = default_timer()
+            data = compressor.flush() if chunk is None else compressor.compress(chunk)
+            compression += default_timer() - start
+            if data:
+                self._write_chunk(route, data)
+                size += len(data)
+                if size <= cache_limit:
+                    written.append(data)
+            if chunk is None:
+                break
+        SERIALIZATION_SECONDS.observe(serialization, route=route)
+        if encoding is not None:
+            COMPRESSION_SECONDS.observe(compression, encoding=encoding)
+        RESPONSE_BYTES.observe(size, route=route)
+        return b''.join(written) if size <= cache_limit else None
+
+    def _send_export(self, query_dict: Dict[str, str]) -> None:
+        """
+        Streams posts matching filters in requested format, posts are read and encoded batch by batch.
+        Exports are not cached, they are meant to be pulled once
+        """
+        export_format = query_dict.get(FORMAT_NAME, available_formats()[0])
+        if export_format not in available_formats():
+            self.send_response(RESPONSE_BAD_REQUEST)
+            self.end_headers()
+            return
+        # parquet pages are compressed already
+        encoding = None if export_format == PARQUET else negotiate(self.headers.get(ACCEPT_ENCODING_HEADER))
+        posts = self.db.iter_filtered(query_dict)
+        self.send_response(RESPONSE_OK)
+        self.send_header(CONTENT_TYPE_HEADER, CONTENT_TYPES[export_format])
+        self.send_header(CONTENT_DISPOSITION_HEADER, f'attachment; filename="posts.{export_format}"')
+        self.send_header(CORS_HEADER, ALLOW_ALL)
+        self.send_header(VARY_HEADER, ACCEPT_ENCODING_HEADER)
+        if encoding is not None:
+            self.send_header(CONTENT_ENCODING_HEADER, encoding)
+        self.end_headers()
+        self._write_stream(EXPORT_ROUTE, export(posts, export_format, EXPORT_BATCH), encoding)
+
+    def _send_stats(self, query_dict: Dict[str, str]) -> None:
+        try:
+            top_users = int(query_dict.get(TOP_USERS_NAME, TOP_USERS))
+        except ValueError:
+            top_users = -1
+        if not 0 <= top_users <= MAX_TOP_USERS:
+            self.send_response(RESPONSE_BAD_REQUEST)
+            self.end_headers()
+            return
+
+        encoding = negotiate(self.headers.get(ACCEPT_ENCODING_HEADER))
+        key = (self.path, encoding)
+        if self._send_cached(STATS_ROUTE, key):
+            return
+        generation = self._cache_generation()
+        stats = self._call_db('stats', top_users)
+        with SERIALIZATION_SECONDS.time(route=STATS_ROUTE):
+            body = json.dumps(stats.as_dict()).encode('utf-8')
+        self._send_json(STATS_ROUTE, body, encoding, key, generation)
+
+    def _send_changes(self, query_dict: Dict[str, str]) -> None:
+        """
+        Sends changes after since cursor. With wait an empty page is held until a write through the server or
+        until wait seconds pass, writes made around the server are seen when the wait ends
+        """
+        try:
+            since = int(query_dict.get(SINCE_NAME, '0'))
+            limit = int(query_dict.get(LIMIT_NAME, CHANGES_LIMIT))
+            wait = float(query_dict.get(WAIT_NAME, '0'))
+        except ValueError:
+            since = -1
+        if since < 0 or not 0 < limit <= CHANGES_LIMIT or not 0 <= wait <= MAX_CHANGES_WAIT:
+            self.send_response(RESPONSE_BAD_REQUEST)
+            self.end_headers()
+            return
+
+        version = self.notifier.version if self.notifier is not None else 0
+        changes = self._call_db('changes', since, limit)
+        if not changes and wait > 0:
+            if self.notifier is not None:
+                if not self._admit_long_poll():
+                    self._send_unavailable()
+                    return
+                self.notifier.wait(version, wait)
+            changes = self._call_db('changes', since, limit)
+        with SERIALIZATION_SECONDS.time(route=CHANGES_ROUTE):
+            body = json.dumps({'changes': [change.as_dict() for change in changes],
+                               'cursor': changes[-1].seq if changes else since}, default=json_default)
+        # cursors are per client, responses are not cached
+        self._send_json(CHANGES_ROUTE, body.encode('utf-8'), negotiate(self.headers.get(ACCEPT_ENCODING_HEADER)),
+                        None, 0)
+
+    def _admit_long_poll(self) -> bool:
+        """
+        Moves request from the read budget to the budget of long polls before it waits
+        :return: False if long polls are used up
+        """
+        if not isinstance(self.server, PostHTTPServer) or self.admitted is None:
+            return True
+        if not self.server.admission.try_acquire(POLL):
+            return False
+        self.server.admission.release(self.admitted)
+        self.admitted = POLL
+        return True
+
+    def _send_stream(self) -> None:
+        """
+        Subscribes connection to posts added through the server, sent as server-sent events. Connection is handed
+        over to the broadcaster, so the handler thread returns right after the headers
+        """
+        if self.broadcaster is None or not isinstance(self.server, PostHTTPServer):
+            self.send_response(RESPONSE_NOT_FOUND)
+            self.end_headers()
+            return
+        if self.broadcaster.full:
+            self._send_unavailable()
+            return
+        # headers are queued by the broadcaster ahead of events, none published after this request is missed
+        wfile = self.wfile
+        self.wfile = io.BytesIO()
+        self.send_response(RESPONSE_OK)
+        self.send_header(CONTENT_TYPE_HEADER, CONTENT_TYPE_EVENT_STREAM)
+        self.send_header(CACHE_CONTROL_HEADER, NO_CACHE)
+        self.send_header(CORS_HEADER, ALLOW_ALL)
+        self.end_headers()
+        headers = self.wfile.getvalue()
+        self.wfile = wfile
+        self.close_connection = True
+        self.server.detach(self.request)
+        self.broadcaster.subscribe(self.request, headers)
+
+    def _publish(self, post: Any) -> None:
+        if self.broadcaster is None or not self.broadcaster.subscribers:
+            return
+        with SERIALIZATION_SECONDS.time(route=STREAM_ROUTE):
+            data = _post_schema().dumps(post)
+        self.broadcaster.publish(encode_event(POST_EVENT, data))
+
+    def _send_metrics(self) -> None:
+        body = SERVER.render().encode('utf-8')
+        self.send_response(RESPONSE_OK)
+        self.send_header(CONTENT_TYPE_HEADER, CONTENT_TYPE_PROMETHEUS)
+        self.send_header(CONTENT_LENGTH_HEADER, str(len(body)))
+        self.end_headers()
+        self._write_body(METRICS_ROUTE, body)
+
+    @profiled
     def do_GET(self) -> None:
         parsed_url = urlparse(self.path)
         path_components = _split_url_path(parsed_url.path)
         query_dict = dict(parse_qsl(parsed_url.query))
 
+        if path_components == ['metrics']:
+            self._send_metrics()
+            return
+
         if len(path_components) > 2 or len(path_components) == 0 or 'posts' not in path_components[0]:
-            _LOGGER.info(f'GET {self.path} {RESPONSE_NOT_FOUND}')
             self.send_response(RESPONSE_NOT_FOUND)
             self.end_headers()
             return
 
         if len(path_components) == 1:
-            _LOGGER.info(f'GET {self.path} {RESPONSE_OK}')
-            self.send_response(RESPONSE_OK)
-            self.send_header(CONTENT_TYPE_HEADER, CONTENT_TYPE_JSON)
-            self.send_header(CORS_HEADER, ALLOW_ALL)
-            self.end_headers()
-            if query_dict.get('pagination', ''):
-                posts = self.db.get_filtered(query_dict)
-            else:
-                posts = self.db.get_all()
-            self.wfile.write(POSTS_SCHEMA.dumps(posts).encode('ascii'))
+            self._send_posts(query_dict)
+            return
+
+        if path_components == ['posts', 'stats']:
+            self._send_stats(query_dict)
+            return
+
+        if path_components == ['posts', 'export']:
+            self._send_export(query_dict)
+            return
+
+        if path_components == ['posts', 'changes']:
+            self._send_changes(query_dict)
+            return
+
+        if path_components == ['posts', 'stream']:
+            self._send_stream()
             return
 
         try:
-            post = self.db.get_by_id(path_components[1])
-            _LOGGER.info(f'GET {self.path} {RESPONSE_OK}')
+            post = self._call_db('get_by_id', path_components[1])
             self.send_response(RESPONSE_OK)
             self.send_header(CONTENT_TYPE_HEADER, CONTENT_TYPE_JSON)
             self.end_headers()
-            self.wfile.write(POST_SCHEMA.dumps(post).encode('utf-8'))
+            with SERIALIZATION_SECONDS.time(route=POST_ROUTE):
+                body = _post_schema().dumps(post).encode('utf-8')
+            self._write_body(POST_ROUTE, body)
         except PostNotFoundException:
-            _LOGGER.info(f'GET {self.path} {RESPONSE_NOT_FOUND}')
             self.send_response(RESPONSE_NOT_FOUND)
             self.end_headers()
 
+    @profiled
     def do_POST(self) -> None:
         path_components = _split_url_path(self.path)
 
         if len(path_components) != 1 or path_components[0] != 'posts':
-            _LOGGER.info(f'POST {self.path} {RESPONSE_NOT_FOUND}')
             self.send_response(RESPONSE_NOT_FOUND)
             self.end_headers()
             return
 
         content_len = int(self.headers.get(CONTENT_LENGTH_HEADER, 0))
         body = self.rfile.read(content_len).decode(encoding='utf-8')
-        post = POST_SCHEMA.loads(body)
+        with SERIALIZATION_SECONDS.time(route=POSTS_ROUTE):
+            post = _post_schema().loads(body)
 
-        success = self.db.add(post)
+        success = self._add(post)
         if success:
-            _LOGGER.info(f'POST {self.path} {RESPONSE_CREATED}')
+            self._after_write()
+            self._publish(post)
             self.send_response(RESPONSE_CREATED)
             self.send_header(CONTENT_TYPE_HEADER, CONTENT_TYPE_JSON)
             self.end_headers()
-            self.wfile.write(json.dumps({post.id: self.db.count()}).encode('utf-8'))
+            self._write_body(POSTS_ROUTE, json.dumps({post.id: self._call_db('count')}).encode('utf-8'))
         else:
-            _LOGGER.info(f'POST {self.path} {RESPONSE_NOT_FOUND}')
             self.send_response(RESPONSE_NOT_FOUND)
             self.end_headers()
 
+    @profiled
     def do_DELETE(self) -> None:
         path_components = _split_url_path(self.path)
 
         if len(path_components) != 2 or path_components[0] != 'posts':
-            _LOGGER.info(f'DELETE {self.path} {RESPONSE_NOT_FOUND}')
             self.send_response(RESPONSE_NOT_FOUND)
             self.end_headers()
             return
 
-        success = self.db.delete(path_components[1])
+        success = self._call_db('delete', path_components[1])
         if success:
-            _LOGGER.info(f'DELETE {self.path} {RESPONSE_OK}')
+            self._after_write()
             self.send_response(RESPONSE_OK)
             self.end_headers()
         else:
-            _LOGGER.info(f'DELETE {self.path} {RESPONSE_NOT_FOUND}')
             self.send_response(RESPONSE_NOT_FOUND)
             self.end_headers()
 
+    @profiled
     def do_PUT(self) -> None:
         path_components = _split_url_path(self.path)
 
         if len(path_components) != 2 or path_components[0] != 'posts':
-            _LOGGER.info(f'PUT {self.path} {RESPONSE_NOT_FOUND}')
             self.send_response(RESPONSE_NOT_FOUND)
             self.end_headers()
             return
 
         content_len = int(self.headers.get(CONTENT_LENGTH_HEADER, 0))
         body = self.rfile.read(content_len).decode(encoding='utf-8')
-        new_post = POST_SCHEMA.loads(body)
+        with SERIALIZATION_SECONDS.time(route=POST_ROUTE):
+            new_post = _post_schema().loads(body)
 
-        success = self.db.update(path_components[1], new_post)
+        success = self._call_db('update', path_components[1], new_post)
         if success:
-            _LOGGER.info(f'PUT {self.path} {RESPONSE_OK}')
+            self._after_write()
             self.send_response(RESPONSE_OK)
             self.end_headers()
         else:
-            _LOGGER.info(f'PUT {self.path} {RESPONSE_NOT_FOUND}')
             self.send_response(RESPONSE_NOT_FOUND)
             self.end_headers()
 
 
-def request_handler_wrapper(request_handler: Type[RequestHandler], db: DB) -> Callable[[Any, Any], RequestHandler]:
+def request_handler_wrapper(request_handler: Type[RequestHandler], db: DB,
+                            profiler: Optional[RequestProfiler] = None,
+                            compression: Optional[CompressionConfig] = None,
+                            cache: Optional[ResponseCache] = None,
+                            notifier: Optional[ChangeNotifier] = None,
+                            broadcaster: Optional[Broadcaster] = None,
+                            group_commit: Optional[GroupCommit] = None) -> Callable[[Any, Any], RequestHandler]:
     def wrapper(*args: Any, **kwargs: Any) -> RequestHandler:
-        return request_handler(db, *args, **kwargs)
+        return request_handler(db, *args, profiler=profiler, compression=compression, cache=cache,
+                               notifier=notifier, broadcaster=broadcaster, group_commit=group_commit, **kwargs)
 
     return wrapper
 
 
-def run(database_name: str, server_class: Type[ThreadingHTTPServer] = ThreadingHTTPServer,
-        handler_class: Type[RequestHandler] = RequestHandler) -> None:
+def run(database_name: str, server_class: Type[ThreadingHTTPServer] = PostHTTPServer,
+        handler_class: Type[RequestHandler] = RequestHandler, profiler: Optional[RequestProfiler] = None,
+        log_config: Optional[LogConfig] = None, compression: Optional[CompressionConfig] = None,
+        group_commit_window: Optional[float] = GROUP_COMMIT_WINDOW, admission: Optional[AdmissionConfig] = None
+        ) -> None:
+    """
+    :param group_commit_window: seconds a post added through the server waits for concurrent ones to be written
+        together, None disables group commit
+    :param admission: request budgets of PostHTTPServer
+    """
     load_dotenv()
-    logging.basicConfig(filename='server.log', filemode='w', level=logging.INFO, format='%(asctime)s %(message)s')
-    db: DB
-    if database_name == 'mongo':
-        conn_string = os.getenv('MONGO_CONNECTION', 'mongodb://localhost:27017')
-        db = MongoDB(conn_string)
-
-        _LOGGER.info('MongoDB connected')
-    elif database_name == 'postgres':
-        name = os.getenv('POSTGRES_NAME', 'postgres')
-        user = os.getenv('POSTGRES_USERNAME', 'postgres')
-        password = os.getenv('POSTGRES_PASSWORD', 'root')
-        host = os.getenv('POSTGRES_HOST', 'localhost')
-        port = int(os.getenv('POSTGRES_PORT', '5432'))
-        db = PostgresDB(name=name, user=user, password=password, host=host, port=port)
-
-        _LOGGER.info('PostgreSQL connected')
-    else:
-        db = FileDB()
-
-        _LOGGER.info('File created')
+    log_listener = setup_server_logging(log_config or LogConfig())
+    db = create_db(database_name)
+    compression = compression or CompressionConfig()
+    cache = ResponseCache(compression.cache_bytes, compression.cache_ttl) if compression.cache_bytes > 0 else None
 
     server_address = (IP_ADDRESS, PORT)
-    handler = request_handler_wrapper(handler_class, db)
-    httpd = server_class(server_address, handler)
+    broadcaster = Broadcaster()
+    group_commit = GroupCommit(db, group_commit_window) if group_commit_window is not None else None
+    handler = request_handler_wrapper(handler_class, db, profiler, compression, cache, ChangeNotifier(), broadcaster,
+                                      group_commit)
+    if issubclass(server_class, PostHTTPServer):
+        httpd: ThreadingHTTPServer = server_class(server_address, handler, admission)
+    else:
+        httpd = server_class(server_address, handler)
 
     _LOGGER.info('Start listening http on port {}'.format(PORT))
 
-    httpd.serve_forever()
+    try:
+        httpd.serve_forever()
+    finally:
+        broadcaster.close()
+        log_listener.stop()
@@ -0,0 +1,130 @@
+import logging
+import multiprocessing
+import queue
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .checkpoint import Checkpoint, SERVER_UNAVAILABLE
+from .metrics import SCRAPER
+from .post import Post, post_id
+
+_LOGGER = logging.getLogger(__name__)
+
+RESULT_POLL_TIMEOUT = 1.0
+
+
+@dataclass(frozen=True)
+class ShardProgress:
+    url: str
+    post_id: Optional[str]
+    reason: str = ''
+
+    @property
+    def parsed(self) -> bool:
+        return self.post_id is not None
+
+    def record(self, checkpoint: Checkpoint) -> None:
+        if self.post_id:
+            checkpoint.complete(self.url, self.post_id)
+        elif self.reason != SERVER_UNAVAILABLE:
+            checkpoint.fail(self.url, self.reason)
+
+
+@dataclass(frozen=True)
+class ShardResult:
+    shard: int
+    posts: List[Post]
+    duration: float
+    metrics: Dict[str, Any] = field(default_factory=dict)
+
+
+def shard_of(post_url: str, processes: int) -> int:
+    """
+    Deterministic shard of a post: the same url always goes to the same process
+    """
+    return int(post_id(post_url), 16) % processes
+
+
+def run_sharded(feed: Iterable[Tuple[str, Any]], target: Callable[..., None], target_args: Tuple[Any, ...],
+                amount: int, processes: int, window: int,
+                on_progress: Optional[Callable[[ShardProgress], None]] = None) -> List[Post]:
+    """
+    Distributes fed posts over worker processes and waits until `amount` of them are parsed.
+    Worker target is called as target(shard, item_queue, result_queue, *target_args), it has to put ShardProgress
+    for every item it takes and a ShardResult once None arrives. Shard metrics are merged into scraper registry
+    :param feed: Iterable of (post url, payload for worker)
+    :param window: Maximum posts handed out to workers and not yet reported
+    :param on_progress: Called in parent process for every reported post
+    :return: Parsed posts of all shards in feed order
+    """
+    context = multiprocessing.get_context('spawn')
+    item_queues = [context.Queue() for _ in range(processes)]
+    result_queue = context.Queue()
+    workers: List[multiprocessing.context.SpawnProcess] = [
+        context.Process(target=target, args=(shard, item_queues[shard], result_queue, *target_args))
+        for shard in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    seen: Dict[str, int] = {}
+    items = iter(feed)
+    outstanding = 0
+    parsed = 0
+    exhausted = False
+    results: List[ShardResult] = []
+    try:
+        while parsed < amount:
+            while not exhausted and outstanding < min(window, amount - parsed):
+                try:
+                    url, payload = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if url in seen:
+                    continue
+                seen[url] = len(seen)
+                item_queues[shard_of(url, processes)].put(payload)
+                outstanding += 1
+            if not outstanding:
+                break
+            message = _get_message(result_queue, workers)
+            if isinstance(message, ShardProgress):
+                if on_progress:
+                    on_progress(message)
+                if message.reason == SERVER_UNAVAILABLE:
+                    break
+                outstanding -= 1
+                parsed += message.parsed
+                _LOGGER.info(f'{len(seen)} posts taken. {parsed} posts passed.')
+            else:
+                # a worker never finishes before None arrives unless it broke down
+                if isinstance(message, ShardResult):
+                    results.append(message)
+                break
+    finally:
+        for item_queue in item_queues:
+            item_queue.put(None)
+        while len(results) < processes:
+            message = _get_message(result_queue, workers)
+            if isinstance(message, ShardResult):
+                results.append(message)
+            elif isinstance(message, ShardProgress) and on_progress:
+                on_progress(message)
+            elif message is None:
+                break
+        for worker in workers:
+            worker.join()
+    for result in results:
+        SCRAPER.merge(result.metrics)
+    posts = [post for result in results for post in result.posts]
+    return sorted(posts, key=lambda post: seen.get(post.post_url, len(seen)))
+
+
+def _get_message(result_queue: multiprocessing.Queue, workers: List[multiprocessing.context.SpawnProcess]) -> Any:
+    while True:
+        try:
+            return result_queue.get(timeout=RESULT_POLL_TIMEOUT)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                _LOGGER.error('All worker processes exited')
+                return None
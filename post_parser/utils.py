@@ -1,16 +1,22 @@
 from __future__ import annotations
 
+import functools
 import io
 import logging
 
-import yaml
 from frozendict import frozendict
 
 _LOGGER = logging.getLogger(__name__)
 CONFIG_FILE_NAME = './config.yml'
 
 
+@functools.lru_cache(maxsize=None)
 def get_config() -> frozendict:
+    """
+    Reads config file on first call, later calls return the same config
+    """
+    import yaml
+
     try:
         with io.open(CONFIG_FILE_NAME, 'r', encoding='utf-8') as file:
             return frozendict(yaml.full_load(file))
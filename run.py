@@ -1,8 +1,21 @@
+import os
+
 from post_parser import run_parser, create_parser_arg_parser
+from post_parser.http_engine import PipelineConfig
+from post_parser.profiling import profile_call
 
 
 if __name__ == '__main__':
     arg_parser = create_parser_arg_parser()
     args = arg_parser.parse_args()
 
-    run_parser(args.posts, args.offset, args.workers)
+    pipeline_config = PipelineConfig(feed_prefetch=args.feed_prefetch, post_concurrency=args.post_concurrency,
+                                     user_concurrency=args.user_concurrency,
+                                     upload_concurrency=args.upload_concurrency, max_in_flight=args.max_in_flight,
+                                     rate_limit=args.rate_limit, burst=args.burst, max_retries=args.max_retries)
+    run_args = (args.posts, args.offset, args.workers, args.driver_profile, args.engine, pipeline_config,
+                args.processes, args.checkpoint, args.resume, args.driver_profile_dir)
+    if args.profile:
+        profile_call(os.path.join(args.profile_dir, 'parser_run.pstats'), run_parser, *run_args)
+    else:
+        run_parser(*run_args)
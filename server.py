@@ -1,7 +1,20 @@
 from post_parser import run_server, create_server_arg_parser
+from post_parser.admission import AdmissionConfig
+from post_parser.compression import CompressionConfig
+from post_parser.logs import LogConfig
+from post_parser.profiling import RequestProfiler
 
 
 if __name__ == '__main__':
     arg_parser = create_server_arg_parser()
     args = arg_parser.parse_args()
-    run_server(args.database)
+    profiler = RequestProfiler(args.profile_dir, args.profile_rate) if args.profile else None
+    log_config = LogConfig(path=args.log_file, max_bytes=args.log_max_bytes, backup_count=args.log_backups,
+                           success_sample_rate=args.log_sample_rate)
+    compression = CompressionConfig(min_size=args.compress_min_bytes, cache_bytes=args.response_cache_mb * 2 ** 20,
+                                    cache_ttl=args.response_cache_ttl)
+    group_commit_window = None if args.no_group_commit else args.group_commit_ms / 1000
+    admission = AdmissionConfig(max_reads=args.max_reads, max_writes=args.max_writes, max_polls=args.max_polls,
+                                queue_size=args.accept_queue, retry_after=args.retry_after)
+    run_server(args.database, profiler=profiler, log_config=log_config, compression=compression,
+               group_commit_window=group_commit_window, admission=admission)
@@ -0,0 +1,250 @@
+import io
+import threading
+import time
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+import pytest
+
+from post_parser.db import file_db, DB, FileDB, PostNotFoundException
+from post_parser.db.change_log import COMPACT_MIN_LINES, ChangeLog
+from post_parser.db.post_file import PostFile, PostFileError, write_post_file
+from post_parser.group_commit import GroupCommit
+from post_parser.manage import import_file, export_file
+from post_parser.post import Post
+
+
+def _posts(amount: int) -> List[Post]:
+    return [Post(post_url=f'https://www.reddit.com/r/pics/comments/{number}/title/', username=f'u/user_{number % 3}',
+                 user_karma=number, user_cake_day='22 марта 2017', post_karma=1, comment_karma=1,
+                 post_date=datetime(2021, 3, 22, 20, tzinfo=timezone(timedelta(hours=3))) + timedelta(hours=number),
+                 number_of_comments=number, number_of_votes=number * 10,
+                 post_category='r/pics' if number % 2 else 'r/funny')
+            for number in range(amount)]
+
+
+@pytest.fixture
+def db(monkeypatch: Any, tmp_path: Any) -> FileDB:
+    monkeypatch.setattr(file_db, 'OUTPUT_PATH', str(tmp_path))
+    monkeypatch.setattr(file_db, 'FILE_NAME', 'reddit.txt')
+    return FileDB()
+
+
+def test_post_file_round_trip(tmp_path: Any) -> None:
+    naive = Post('https://www.reddit.com/r/a/comments/1/', 'u/a', 1, 'cake', 2, 3, datetime(2021, 3, 22, 10, 5, 7, 11),
+                 4, 5, 'r/a')
+    other_zone = Post('https://www.reddit.com/r/a/comments/2/', 'u/b', 1, 'cake', 2, 3,
+                      datetime(2021, 3, 22, 10, tzinfo=timezone(timedelta(hours=2))), 4, 5, 'r/a')
+    posts = _posts(5) + [naive]
+    path = str(tmp_path / 'posts')
+    assert write_post_file(path, posts + [other_zone]) == 7
+    post_file = PostFile(path)
+    assert len(post_file) == 7
+    decoded = {post.id: post for post in post_file}
+    for post in posts:
+        assert str(decoded[post.id]) == str(post)
+    assert decoded[other_zone.id].post_date == datetime(2021, 3, 22, 8, tzinfo=timezone.utc)
+    assert [post_file.id_at(index) for index in range(7)] == sorted(decoded)
+    assert post_file.find(naive.id) is not None and post_file.find('0' * 32) is None
+
+
+def test_post_file_rejects_other_files(tmp_path: Any) -> None:
+    path = tmp_path / 'reddit.txt'
+    path.write_text('not a posts file at all\n')
+    with pytest.raises(PostFileError):
+        PostFile(str(path))
+
+
+def test_text_file_converted_once(monkeypatch: Any, tmp_path: Any) -> None:
+    with io.open(tmp_path / 'reddit.txt', 'w', encoding='utf-8') as file:
+        file.writelines(str(post) for post in _posts(5))
+    monkeypatch.setattr(file_db, 'OUTPUT_PATH', str(tmp_path))
+    monkeypatch.setattr(file_db, 'FILE_NAME', 'reddit.txt')
+    db = FileDB()
+    assert db.count() == 5
+    db.delete(_posts(5)[0].id)
+    assert FileDB().count() == 4
+
+    export_file(str(tmp_path / 'export.txt'), 'file')
+    assert len((tmp_path / 'export.txt').read_text(encoding='utf-8').splitlines()) == 4
+    db.drop()
+    assert import_file(str(tmp_path / 'reddit.txt'), 'file') == 5
+    assert FileDB().count() == 5
+
+
+def test_crud(db: FileDB) -> None:
+    post, other = _posts(2)
+    assert db.add(post)
+    assert not db.add(post)
+    assert db.get_by_id(post.id) == post
+    assert not db.update('missing', other)
+    assert db.update(post.id, other)
+    with pytest.raises(PostNotFoundException):
+        db.get_by_id(post.id)
+    assert db.get_by_id(other.id).number_of_votes == other.number_of_votes
+    assert db.delete(other.id)
+    assert not db.delete(other.id)
+    assert db.count() == 0
+
+
+def test_filters(db: FileDB) -> None:
+    posts = _posts(100)
+    db.add_many(posts)
+    pics = db.get_filtered({'category': 'r/pics', 'minVotes': '100', 'maxVotes': '300'})
+    assert sorted(post.number_of_votes for post in pics) == [110, 130, 150, 170, 190, 210, 230, 250, 270, 290]
+    # date is the UTC day like in the other backends and stats, posts are written at 17:00 UTC and later
+    assert {post.id for post in db.get_filtered({'date': '2021-03-22'})} == {post.id for post in posts[:7]}
+    assert db.stats().days['2021-03-22'] == 7
+
+    first_page = db.get_filtered({'pagination': 'true'})
+    second_page = db.get_filtered({'pagination': 'true', 'lastPost': first_page[-1].id})
+    assert [post.id for post in first_page + second_page] == sorted(post.id for post in posts)[:60]
+    assert [post.id for post in db.iter_posts(after=first_page[-1].id)] == sorted(post.id for post in posts)[30:]
+    # pages are keyed by lastPost like in the other backends, not aligned to pages of the whole list
+    ids = sorted(post.id for post in posts)
+    assert [post.id for post in db.get_filtered({'pagination': 'true', 'lastPost': ids[9]})] == ids[10:40]
+    db.delete(ids[9])
+    assert [post.id for post in db.get_filtered({'pagination': 'true', 'lastPost': ids[9]})] == ids[10:40]
+
+
+def test_projected(db: FileDB) -> None:
+    posts = _posts(100)
+    db.add_many(posts)
+    fields = ('id', 'post_url', 'user_cake_day', 'post_date', 'number_of_votes')
+    for query in ({}, {'category': 'r/pics', 'pagination': 'true'}, {'minVotes': '500'}):
+        assert db.get_projected(query, fields) == \
+            [{field: getattr(post, field) for field in fields} for post in db.get_filtered(query)]
+    assert db.posts.fields_at(0, ()) == {}
+
+
+def test_iter_filtered(db: FileDB) -> None:
+    posts = _posts(100)
+    db.add_many(posts)
+    query = {'category': 'r/pics', 'minVotes': '100', 'pagination': 'true'}
+    assert [post.id for post in db.iter_filtered(query)] == \
+        [post.id for post in db.get_filtered({'category': 'r/pics', 'minVotes': '100'})]
+    last_post = sorted(post.id for post in posts)[49]
+    assert [post.id for post in db.iter_filtered({'lastPost': last_post})] == sorted(post.id for post in posts)[50:]
+
+
+def test_changes(monkeypatch: Any, tmp_path: Any) -> None:
+    posts = _posts(4)
+    write_post_file(str(tmp_path / 'reddit.posts'), posts[:2])
+    monkeypatch.setattr(file_db, 'OUTPUT_PATH', str(tmp_path))
+    monkeypatch.setattr(file_db, 'FILE_NAME', 'reddit.txt')
+    db = FileDB()
+    # posts written before the change log are its first changes
+    assert [change.post_id for change in db.changes(0)] == sorted(post.id for post in posts[:2])
+    db.add_many(posts[2:])
+    db.update(posts[0].id, replace(posts[0], number_of_votes=7))
+    db.delete(posts[1].id)
+    changes = db.changes(2)
+    assert [(change.post_id, change.deleted) for change in changes] == \
+        [(posts[2].id, False), (posts[3].id, False), (posts[0].id, False), (posts[1].id, True)]
+    assert changes[2].post is not None and changes[2].post.number_of_votes == 7
+    assert [change.seq for change in changes] == list(range(3, 7))
+    assert db.changes(4, limit=1)[0].seq == 5
+    db.change_log.close()
+    # sequence goes on after reopening
+    reopened = FileDB()
+    assert [change.seq for change in reopened.changes(0)] == [change.seq for change in db.changes(0)]
+    reopened.add(posts[1])
+    assert reopened.changes(6)[0].seq == 7
+
+
+def test_change_log_read_lazily(monkeypatch: Any, tmp_path: Any) -> None:
+    posts = _posts(4)
+    write_post_file(str(tmp_path / 'reddit.posts'), posts[:2])
+    monkeypatch.setattr(file_db, 'OUTPUT_PATH', str(tmp_path))
+    monkeypatch.setattr(file_db, 'FILE_NAME', 'reddit.txt')
+    db = FileDB()
+    # opening does not number stored posts, they follow posts written before the first read of the feed
+    assert (tmp_path / 'reddit.changes').read_text().count('\n') == 1
+    db.add(posts[2])
+    assert [(change.seq, change.post_id) for change in db.changes(0)] == \
+        [(1, posts[2].id)] + [(seq, post.id) for seq, post in zip((2, 3), sorted(posts[:2], key=lambda p: p.id))]
+    db.change_log.close()
+
+    reopened = FileDB()
+    reopened.add(posts[3])
+    # sequence goes on from the last line, the log is read by the feed only
+    assert reopened.change_log.last_seq == 4
+    assert [change.seq for change in reopened.changes(0)] == [1, 2, 3, 4]
+
+
+def test_change_log_since_skips_superseded(tmp_path: Any) -> None:
+    log = ChangeLog(str(tmp_path / 'reddit.changes'), lambda: [])
+    assert log.since(0, 10) == []
+    ids = [f'{number:032x}' for number in range(10)]
+    for _ in range(150):
+        log.append((post_id, False) for post_id in ids)
+    log.append([(ids[0], True)])
+    latest = [(seq, post_id, False) for seq, post_id in zip(range(1492, 1501), ids[1:])] + [(1501, ids[0], True)]
+    assert log.since(0, 100) == latest
+    assert log.since(1495, 2) == latest[4:6]
+    assert log.since(1501, 100) == []
+    # index drops superseded changes instead of growing with every write
+    assert len(log._seqs) < COMPACT_MIN_LINES
+    log.close()
+
+
+def test_changes_consistent_with_writes(monkeypatch: Any, db: FileDB) -> None:
+    written = threading.Event()
+
+    def slow_write_post_file(path: str, posts: Any) -> int:
+        written.set()
+        time.sleep(0.2)
+        return write_post_file(path, posts)
+
+    monkeypatch.setattr(file_db, 'write_post_file', slow_write_post_file)
+    post = _posts(1)[0]
+    writer = threading.Thread(target=db.add, args=(post,))
+    writer.start()
+    written.wait()
+    # change is read once the posts file with the post is in place, never as a tombstone
+    assert [(change.post_id, change.deleted) for change in db.changes(0)] == [(post.id, False)]
+    writer.join()
+
+
+def test_stats_maintained_by_writes(db: FileDB) -> None:
+    posts = _posts(40)
+    db.add_many(posts[:30])
+    assert db.stats().as_dict() == DB.stats(db).as_dict()
+    db.add(posts[30])
+    db.add_many(posts[31:] + [replace(posts[0], number_of_votes=100000)])
+    db.update(posts[1].id, replace(posts[1], post_category='r/new', user_karma=1000))
+    db.delete(posts[2].id)
+    stats = db.stats(top_users=2).as_dict()
+    # stats kept up to date by writes match stats aggregated from scratch
+    assert stats == DB.stats(db, top_users=2).as_dict()
+    assert stats['categories']['r/new'] == 1 and stats['votes']['>=100000'] == 1
+    assert stats['top_users'][0] == {'username': 'u/user_1', 'user_karma': 1000}
+    db.drop()
+    assert db.stats().as_dict()['total'] == 0
+
+
+def test_group_commit(monkeypatch: Any, db: FileDB) -> None:
+    posts = _posts(41)
+    batches: List[int] = []
+    add_batch = db.add_batch
+
+    def counted_add_batch(batch: List[Post]) -> List[bool]:
+        batches.append(len(batch))
+        return add_batch(batch)
+
+    monkeypatch.setattr(db, 'add_batch', counted_add_batch)
+    group_commit = GroupCommit(db, window=0.05)
+    db.add(posts[0])
+    results: Dict[int, bool] = {}
+    threads = [threading.Thread(target=lambda number: results.__setitem__(number, group_commit.add(posts[number])),
+                                args=(number,)) for number in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every caller gets the result of its own post
+    assert results == {number: number != 0 for number in range(40)}
+    assert sum(batches) == 40 and len(batches) < 40
+    assert db.count() == 40 and len(db.changes(0)) == 40
+    assert add_batch([posts[0], posts[40], posts[40]]) == [False, True, False]
@@ -1,7 +1,30 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Any
+
+import pytest
 from selenium.webdriver import Chrome
 
-from post_parser.parser import create_drivers
-from post_parser.post import parse_number
+from post_parser.parser import create_drivers, _create_chrome_options, DRIVER_PROFILE_LEAN, DRIVER_PROFILE_FULL
+from post_parser.broadcast import Broadcaster, encode_event
+from post_parser.checkpoint import Checkpoint
+from post_parser.compression import ResponseCache, compress, negotiate
+from post_parser.db.projection import dumps_projected, parse_fields, project
+from post_parser.export import export
+from post_parser.logs import SuccessSampler
+from post_parser.metrics import Registry
+from post_parser.post import Post, parse_number
+from post_parser.post_schema import PostSchema
+from post_parser.profiling import RequestProfiler, profiled
+from post_parser.server import _serialize_posts
+from post_parser.sharding import shard_of
 
 
 def test_parse_number_1() -> None:
@@ -23,3 +46,243 @@ def test_create_drivers() -> None:
     for post_driver in post_drivers:
         assert isinstance(post_driver, Chrome)
         post_driver.close()
+
+
+def test_create_drivers_unknown_profile() -> None:
+    with pytest.raises(ValueError):
+        create_drivers(driver_profile='tiny')
+
+
+def test_lean_chrome_options(tmp_path: Any) -> None:
+    lean_options = _create_chrome_options(DRIVER_PROFILE_LEAN, 'post-0')
+    full_options = _create_chrome_options(DRIVER_PROFILE_FULL, 'post-0', str(tmp_path))
+    assert lean_options.to_capabilities()['pageLoadStrategy'] == 'eager'
+    assert 'prefs' in lean_options.experimental_options
+    assert 'pageLoadStrategy' not in full_options.to_capabilities()
+    # chromedriver gives every driver a temporary profile unless warm profiles are kept in a directory
+    assert not any(argument.startswith('--user-data-dir=') for argument in lean_options.arguments)
+    assert not any(argument.startswith('--user-data-dir=') for argument in full_options.arguments)
+    warm_options = _create_chrome_options(DRIVER_PROFILE_LEAN, 'post-0', str(tmp_path))
+    assert f'--user-data-dir={tmp_path / "post-0"}' in warm_options.arguments
+
+
+def test_shard_of() -> None:
+    urls = [f'https://www.reddit.com/r/pics/comments/{number}/' for number in range(100)]
+    shards = [shard_of(url, 4) for url in urls]
+    assert shards == [shard_of(url, 4) for url in urls]
+    assert set(shards) == {0, 1, 2, 3}
+
+
+def test_checkpoint_resume(tmp_path: Any) -> None:
+    path = str(tmp_path / 'checkpoint.jsonl')
+    checkpoint = Checkpoint(path)
+    urls = list(checkpoint.feed((f'url{number}', None) for number in range(4)))
+    checkpoint.complete('url0', 'id0')
+    checkpoint.fail('url1', '18+ policy or deleted profile')
+    checkpoint.close()
+    with open(path, 'a') as file:
+        file.write('{"event": "compl')
+
+    checkpoint = Checkpoint(path, resume=True)
+    assert [url for url, _ in urls] == ['url0', 'url1', 'url2', 'url3']
+    assert checkpoint.state.pending == [('url2', None), ('url3', None)]
+    assert [url for url, _ in checkpoint.feed([('url3', None), ('url4', None)])] == ['url2', 'url3', 'url4']
+    checkpoint.close()
+    checkpoint = Checkpoint(path, resume=True)
+    checkpoint.close()
+    assert list(checkpoint.state.harvested) == ['url0', 'url1', 'url2', 'url3', 'url4']
+
+
+def test_metrics_render_and_merge() -> None:
+    registry = Registry()
+    histogram = registry.histogram('page_load_seconds', 'Page load', ('page',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, page='post')
+    histogram.observe(0.5, page='post')
+    other = Registry()
+    other.histogram('page_load_seconds', 'Page load', ('page',), buckets=(0.1, 1.0)).observe(5, page='post')
+    registry.merge(other.snapshot())
+    rendered = registry.render()
+    assert 'page_load_seconds_bucket{page="post",le="0.1"} 1' in rendered
+    assert 'page_load_seconds_bucket{page="post",le="1"} 2' in rendered
+    assert 'page_load_seconds_bucket{page="post",le="+Inf"} 3' in rendered
+    assert 'page_load_seconds_count{page="post"} 3' in rendered
+
+
+def test_request_profiler(tmp_path: Any) -> None:
+    class Handler:
+        command = 'GET'
+        route = '/posts'
+
+        def __init__(self, path: str, profiler: RequestProfiler) -> None:
+            self.path = path
+            self.profiler = profiler
+
+        @profiled
+        def do_GET(self) -> None:
+            sorted(range(1000), reverse=True)
+
+    profiler = RequestProfiler(str(tmp_path), rate=0)
+    Handler('/posts', profiler).do_GET()
+    assert not list(tmp_path.iterdir())
+    Handler('/posts?__profile=1', profiler).do_GET()
+    assert [path.name for path in tmp_path.iterdir()] == ['GET_posts.pstats']
+
+
+def test_success_sampler() -> None:
+    sampler = SuccessSampler(rate=0)
+
+    def record(status: int) -> logging.LogRecord:
+        log_record = logging.LogRecord('access', logging.INFO, __file__, 0, 'status=%d', (status,), None)
+        log_record.status = status
+        return log_record
+
+    assert not sampler.filter(record(200))
+    assert sampler.filter(record(404))
+    assert sampler.filter(logging.LogRecord('server', logging.INFO, __file__, 0, 'started', (), None))
+
+
+def test_negotiate_encoding() -> None:
+    encodings = ('zstd', 'br', 'gzip')
+    assert negotiate(None, encodings) is None
+    assert negotiate('gzip, deflate', encodings) == 'gzip'
+    assert negotiate('gzip, br', encodings) == 'br'
+    assert negotiate('gzip;q=1.0, br;q=0.5', encodings) == 'gzip'
+    assert negotiate('*', encodings) == 'zstd'
+    assert negotiate('*, zstd;q=0', encodings) == 'br'
+    assert negotiate('deflate, identity', encodings) is None
+    assert negotiate('br, gzip', ('gzip',)) == 'gzip'
+
+
+def test_compress_round_trip() -> None:
+    body = b'{"post_category": "r/pics"}, ' * 1000
+    compressed = compress(body, 'gzip')
+    assert gzip.decompress(compressed) == body
+    assert len(compressed) < len(body) // 10
+    assert compress(body, None) == body
+
+
+def test_response_cache() -> None:
+    cache = ResponseCache(max_bytes=10, ttl=60)
+    generation = cache.generation
+    cache.put('a', b'12345', 'gzip', generation)
+    cache.put('b', b'12345', None, generation)
+    cached = cache.get('a')
+    assert cached is not None and cached.body == b'12345'
+    # least recently used entry goes first
+    cache.put('c', b'123', None, generation)
+    assert cache.get('b') is None and cache.get('a') is not None
+    cache.invalidate()
+    assert cache.get('a') is None
+    # body read before a write is not cached after it
+    cache.put('a', b'12345', 'gzip', generation)
+    assert cache.get('a') is None
+    assert ResponseCache(ttl=0).get('a') is None
+
+
+def test_serialize_posts_in_chunks() -> None:
+    posts = [Post(f'https://www.reddit.com/r/a/comments/{number}/', 'u/a', 1, 'cake', 2, 3,
+                  datetime(2021, 3, 22, 10), 4, number, 'r/a') for number in range(7)]
+    schema = PostSchema(many=True)
+    for chunk_size in (1, 3, 10):
+        assert b''.join(_serialize_posts(posts, chunk_size)) == schema.dumps(posts).encode('ascii')
+    assert b''.join(_serialize_posts([], 3)) == b'[]'
+
+
+def test_parse_fields() -> None:
+    assert parse_fields('') is None
+    assert parse_fields('post_date, id,id') == ('id', 'post_date')
+    with pytest.raises(ValueError):
+        parse_fields('id,password')
+
+
+def test_dumps_projected() -> None:
+    post = Post('https://www.reddit.com/r/a/comments/1/', 'u/a', 1, 'cake', 2, 3, datetime(2021, 3, 22, 10), 4, 5,
+                'r/a')
+    fields = ('id', 'post_date', 'number_of_votes')
+    whole = PostSchema().dump(post)
+    assert json.loads(dumps_projected([project(post, fields)])) == [{field: whole[field] for field in fields}]
+    for chunk_size in (1, 3):
+        assert b''.join(_serialize_posts([project(post, fields)] * 4, chunk_size, dumps_projected)) == \
+            dumps_projected([project(post, fields)] * 4).encode('ascii')
+
+
+def test_export_formats() -> None:
+    posts = [Post(f'https://www.reddit.com/r/a/comments/{number}/', 'u/a', 1, 'cake, "day"', 2, 3,
+                  datetime(2021, 3, 22, 10), 4, number, 'r/a') for number in range(5)]
+    whole = PostSchema(many=True).dump(posts)
+    chunks = list(export(posts, 'ndjson', batch_size=2))
+    assert len(chunks) == 3
+    assert [json.loads(line) for line in b''.join(chunks).decode('utf-8').splitlines()] == whole
+    rows = list(csv.DictReader(io.StringIO(b''.join(export(posts, 'csv', batch_size=2)).decode('utf-8'))))
+    assert [row['user_cake_day'] for row in rows] == ['cake, "day"'] * 5
+    assert [row['id'] for row in rows] == [post.id for post in posts]
+    assert b''.join(export([], 'csv')).decode('utf-8').startswith('id,post_url,')
+    with pytest.raises(ValueError):
+        export(posts, 'xml')
+
+
+def test_export_parquet_row_groups() -> None:
+    parquet = pytest.importorskip('pyarrow.parquet')
+    posts = [Post(f'https://www.reddit.com/r/a/comments/{number}/', 'u/a', 1, 'cake', 2, 3,
+                  datetime(2021, 3, 22, 10), 4, number, 'r/a') for number in range(5)]
+    data = io.BytesIO(b''.join(export(posts, 'parquet', batch_size=2)))
+    assert parquet.ParquetFile(data).num_row_groups == 3
+    assert parquet.read_table(data).column('number_of_votes').to_pylist() == list(range(5))
+
+
+def _receive(sock: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def test_broadcaster_fan_out() -> None:
+    broadcaster = Broadcaster(heartbeat=60)
+    threads = threading.active_count()
+    pairs = [socket.socketpair() for _ in range(200)]
+    for server_side, client_side in pairs:
+        client_side.settimeout(5)
+        broadcaster.subscribe(server_side)
+    # one selector thread serves all idle subscribers
+    assert threading.active_count() == threads + 1
+    event = encode_event('post', '{"id": "1"}\n{"id": "2"}')
+    assert event == b'event: post\ndata: {"id": "1"}\ndata: {"id": "2"}\n\n'
+    broadcaster.publish(event)
+    assert all(_receive(client_side, len(event)) == event for _, client_side in pairs)
+
+    pairs[0][1].close()
+    for _ in range(50):
+        if broadcaster.subscribers == 199:
+            break
+        time.sleep(0.1)
+    assert broadcaster.subscribers == 199
+    broadcaster.close()
+    assert pairs[1][1].recv(1) == b''
+    for _, client_side in pairs[1:]:
+        client_side.close()
+
+
+def test_broadcaster_drops_slow_subscriber() -> None:
+    broadcaster = Broadcaster(max_buffer=64 * 1024, heartbeat=60)
+    slow_server, slow_client = socket.socketpair()
+    fast_server, fast_client = socket.socketpair()
+    broadcaster.subscribe(slow_server)
+    broadcaster.subscribe(fast_server)
+    event = encode_event('post', 'x' * 10000)
+    received = 0
+    fast_client.settimeout(5)
+    # publisher is never blocked by the subscriber that does not read
+    for _ in range(200):
+        broadcaster.publish(event)
+        received += len(_receive(fast_client, len(event)))
+    assert received == 200 * len(event)
+    assert broadcaster.subscribers == 1 and broadcaster.dropped == 1
+    slow_client.settimeout(5)
+    assert len(_receive(slow_client, 200 * len(event))) < 200 * len(event)
+    broadcaster.close()
+    slow_client.close()
+    fast_client.close()
@@ -0,0 +1,204 @@
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer
+from typing import Any, Generator, List
+from urllib.parse import parse_qsl, urlparse
+
+import pytest
+
+from post_parser.checkpoint import Checkpoint
+from post_parser.http_engine import PipelineConfig, child_url, iter_listing, parse_shard, parse_user_about, scrape
+from post_parser.sharding import run_sharded
+from post_parser.throttling import HostRateLimiter, backoff_delay, parse_retry_after
+from post_parser.post_schema import PostSchema
+
+JSON_PATH = os.path.abspath('tests/static_files/json')
+RECORDED_ROUTES = {
+    ('/top/.json', ''): 'top_page_1.json',
+    ('/top/.json', 't3_l1q9z8'): 'top_page_2.json',
+    ('/user/axnu/about.json', ''): 'user_axnu_about.json',
+}
+
+
+class RecordedRedditHandler(BaseHTTPRequestHandler):
+    uploaded: List[str] = []
+    # statuses of the next uploads, the rest are created
+    upload_statuses: List[int] = []
+    throttled_requests = 0
+
+    def do_GET(self) -> None:
+        if RecordedRedditHandler.throttled_requests > 0:
+            RecordedRedditHandler.throttled_requests -= 1
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        parsed_url = urlparse(self.path)
+        after = dict(parse_qsl(parsed_url.query)).get('after', '')
+        file_name = RECORDED_ROUTES.get((parsed_url.path, after))
+        if not file_name:
+            self.send_response(404)
+            self.end_headers()
+            return
+        with io.open(os.path.join(JSON_PATH, file_name), 'rb') as file:
+            body = file.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        content_len = int(self.headers.get('Content-Length', 0))
+        self.uploaded.append(self.rfile.read(content_len).decode('utf-8'))
+        self.send_response(self.upload_statuses.pop(0) if self.upload_statuses else 201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture(scope='module')
+def reddit_url() -> Generator:
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RecordedRedditHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_parse_user_about() -> None:
+    with io.open(os.path.join(JSON_PATH, 'user_axnu_about.json'), 'r', encoding='utf-8') as file:
+        user = parse_user_about(json.load(file))
+    assert user.username == 'u/axnu'
+    assert user.user_karma == 1730420
+    assert user.post_karma == 1505594
+    assert user.comment_karma == 215184
+    assert user.user_cake_day == 'March 22, 2017'
+
+
+def test_http_engine_scrape(reddit_url: str) -> None:
+    RecordedRedditHandler.uploaded.clear()
+    posts = scrape(amount=5, offset=0, reddit_url=reddit_url, server_url=reddit_url + '/posts')
+    assert sorted(post.post_url for post in posts) == [
+        reddit_url + '/r/aww/comments/kuz7p0/my_cat_learned_to_open_doors/',
+        reddit_url + '/r/pics/comments/l3s1a2/found_this_in_my_grandmas_attic/',
+    ]
+    post = next(post for post in posts if post.post_category == 'r/pics')
+    assert post.username == 'u/axnu'
+    assert post.post_category == 'r/pics'
+    assert post.number_of_comments == 2412
+    assert post.number_of_votes == 150500
+    assert post.post_date == datetime(2021, 1, 24, 8, 32, 43, tzinfo=timezone.utc)
+    assert sorted(PostSchema().loads(body).post_url for body in RecordedRedditHandler.uploaded) == \
+        sorted(post.post_url for post in posts)
+
+
+def test_http_engine_offset(reddit_url: str) -> None:
+    posts = scrape(amount=1, offset=2, reddit_url=reddit_url, server_url=reddit_url + '/posts')
+    assert [post.post_category for post in posts] == ['r/aww']
+
+
+def test_http_engine_amount(reddit_url: str) -> None:
+    config = PipelineConfig(post_concurrency=1, user_concurrency=1, upload_concurrency=1)
+    posts = scrape(amount=1, offset=0, reddit_url=reddit_url, server_url=reddit_url + '/posts', config=config)
+    assert len(posts) == 1
+
+
+def test_http_engine_retries_throttled_requests(reddit_url: str) -> None:
+    RecordedRedditHandler.throttled_requests = 2
+    config = PipelineConfig(rate_limit=100, burst=1, max_retries=3)
+    posts = scrape(amount=2, offset=0, reddit_url=reddit_url, server_url=reddit_url + '/posts', config=config)
+    assert RecordedRedditHandler.throttled_requests == 0
+    assert len(posts) == 2
+
+
+def test_http_engine_duplicate_upload(reddit_url: str) -> None:
+    # server answers 404 to posts it stores already
+    RecordedRedditHandler.upload_statuses[:] = [404, 404]
+    posts = scrape(amount=2, offset=0, reddit_url=reddit_url, server_url=reddit_url + '/posts')
+    assert not RecordedRedditHandler.upload_statuses
+    assert len(posts) == 2
+
+
+def test_http_engine_upload_not_retried(reddit_url: str) -> None:
+    RecordedRedditHandler.uploaded.clear()
+    RecordedRedditHandler.upload_statuses[:] = [503]
+    config = PipelineConfig(upload_concurrency=1, max_retries=3)
+    posts = scrape(amount=5, offset=0, reddit_url=reddit_url, server_url=reddit_url + '/posts', config=config)
+    assert len(RecordedRedditHandler.uploaded) == 2
+    assert len(posts) == 1
+
+
+def test_http_engine_sharded(reddit_url: str) -> None:
+    config = PipelineConfig()
+    feed = ((child_url(reddit_url, child), child) for child in iter_listing(reddit_url, 0, config))
+    posts = run_sharded(feed, parse_shard, (reddit_url, reddit_url + '/posts', config), amount=5, processes=2,
+                        window=4)
+    assert [post.post_category for post in posts] == ['r/pics', 'r/aww']
+
+
+def _acquire(config: PipelineConfig, requests: int) -> None:
+    async def acquire() -> None:
+        limiter = HostRateLimiter(config.rate_limit, config.burst)
+        for _ in range(requests):
+            await limiter.acquire('https://www.reddit.com/top/.json')
+
+    asyncio.run(acquire())
+
+
+def test_split_config_keeps_combined_rate() -> None:
+    config = PipelineConfig(rate_limit=20, burst=3)
+    shard_config = config.split(3)
+    assert shard_config.rate_limit * 3 == pytest.approx(config.rate_limit)
+    assert shard_config.burst == 1
+    # processes with own limiters of the split config send 15 requests, 3 of them in bursts
+    processes = [multiprocessing.Process(target=_acquire, args=(shard_config, 5)) for _ in range(3)]
+    start = default_timer()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert default_timer() - start >= (15 - config.burst) / config.rate_limit
+
+
+def test_http_engine_resume(reddit_url: str, tmp_path: Any) -> None:
+    path = str(tmp_path / 'checkpoint.jsonl')
+    config = PipelineConfig(post_concurrency=1, user_concurrency=1, upload_concurrency=1, feed_prefetch=1)
+    checkpoint = Checkpoint(path)
+    first_run = scrape(amount=1, offset=0, reddit_url=reddit_url, server_url=reddit_url + '/posts', config=config,
+                       checkpoint=checkpoint)
+    checkpoint.close()
+
+    checkpoint = Checkpoint(path, resume=True)
+    assert list(checkpoint.state.completed) == [first_run[0].post_url]
+    assert list(checkpoint.state.failed.values()) == ['deleted profile']
+    second_run = scrape(amount=5, offset=0, reddit_url=reddit_url, server_url=reddit_url + '/posts', config=config,
+                        checkpoint=checkpoint)
+    checkpoint.close()
+    assert {post.post_url for post in first_run + second_run} == {
+        reddit_url + '/r/aww/comments/kuz7p0/my_cat_learned_to_open_doors/',
+        reddit_url + '/r/pics/comments/l3s1a2/found_this_in_my_grandmas_attic/',
+    }
+    assert len(second_run) == 1
+
+
+def test_parse_retry_after() -> None:
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_backoff_delay() -> None:
+    assert all(0 <= backoff_delay(attempt) <= 0.5 * 2 ** attempt for attempt in range(5))
+    assert backoff_delay(0, retry_after=3) >= 3
@@ -0,0 +1,12 @@
+import pytest
+
+from benchmarks.import_time import import_times
+
+# scraper and database drivers, none of them is needed to import the package or to start server with FileDB
+HEAVY_PACKAGES = {'selenium', 'bs4', 'requests', 'aiohttp', 'pymongo', 'psycopg2', 'marshmallow', 'dateutil', 'yaml'}
+
+
+@pytest.mark.parametrize('module', ['post_parser', 'post_parser.db', 'post_parser.server'])
+def test_heavy_packages_imported_lazily(module: str) -> None:
+    loaded = {name.split('.')[0] for name in import_times(module)}
+    assert not loaded & HEAVY_PACKAGES
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+from dataclasses import replace
+from typing import Any, List
+
+import pytest
+
+from post_parser.db import file_db, FileDB
+from post_parser.migration import MigrationState, ChangeTracker, transfer, sync, migrate, load_state
+from post_parser.post import Post
+
+
+def _posts(amount: int) -> List[Post]:
+    return [Post(post_url=f'https://www.reddit.com/r/pics/comments/{number}/title/', username=f'u/user_{number % 3}',
+                 user_karma=number, user_cake_day='March 22, 2017', post_karma=1, comment_karma=1,
+                 post_date=datetime(2021, 3, 22, tzinfo=timezone.utc) + timedelta(hours=number),
+                 number_of_comments=number, number_of_votes=number * 10, post_category='r/pics')
+            for number in range(amount)]
+
+
+def _file_db(monkeypatch: Any, path: Any) -> FileDB:
+    monkeypatch.setattr(file_db, 'OUTPUT_PATH', str(path))
+    return FileDB()
+
+
+@pytest.fixture
+def source(monkeypatch: Any, tmp_path: Any) -> FileDB:
+    db = _file_db(monkeypatch, tmp_path / 'source')
+    db.add_many(_posts(10))
+    return db
+
+
+@pytest.fixture
+def target(monkeypatch: Any, tmp_path: Any) -> FileDB:
+    return _file_db(monkeypatch, tmp_path / 'target')
+
+
+def test_transfer(source: FileDB, target: FileDB, monkeypatch: Any, tmp_path: Any) -> None:
+    written: List[List[Post]] = []
+    assert transfer(source, target, batch_size=3, queue_batches=1, on_batch=written.append) == 10
+    assert [len(batch) for batch in written] == [3, 3, 3, 1]
+    assert sorted(str(post) for post in _file_db(monkeypatch, tmp_path / 'target').get_all()) == \
+           sorted(str(post) for post in source.get_all())
+
+
+def test_transfer_reader_error(source: FileDB, target: FileDB) -> None:
+    def accept(post: Post) -> bool:
+        raise RuntimeError('broken source')
+
+    with pytest.raises(RuntimeError):
+        transfer(source, target, batch_size=3, accept=accept)
+
+
+def test_migrate_resume(source: FileDB, target: FileDB, tmp_path: Any) -> None:
+    state_path = str(tmp_path / 'state.json')
+    ids = sorted(post.id for post in source.get_all())
+    state = MigrationState('file', 'postgres', last_id=ids[3], transferred=4)
+    assert migrate(source, target, state, state_path, batch_size=4) == 6
+    assert sorted(post.id for post in target.get_all()) == ids[4:]
+
+    saved = load_state(state_path, 'file', 'postgres')
+    assert saved.last_id == ids[-1] and saved.transferred == 10
+    assert load_state(state_path, 'file', 'mongo') == MigrationState('file', 'mongo')
+
+
+def test_sync(source: FileDB, target: FileDB) -> None:
+    tracker = ChangeTracker()
+    assert transfer(source, target, accept=tracker.record) == 10
+    assert tracker.finish_pass() == []
+    assert sync(source, target, tracker) == (0, 0)
+
+    changed, deleted = sorted(source.get_all(), key=lambda post: post.id)[:2]
+    source.add_many([replace(changed, number_of_votes=1)])
+    source.delete(deleted.id)
+    assert sync(source, target, tracker) == (1, 1)
+    assert target.count() == 9
+    assert target.get_by_id(changed.id).number_of_votes == 1
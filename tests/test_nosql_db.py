@@ -0,0 +1,133 @@
+import os
+import threading
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Generator, List, Set
+
+import pytest
+from dotenv import load_dotenv
+from pymongo.errors import ServerSelectionTimeoutError
+
+from post_parser.db.nosql_db import FILTER_INDEXES, MongoDB, _generate_filter
+from post_parser.post import Post
+
+TEST_CONNECTION = 'mongodb://localhost:27017/post_parser_test?serverSelectionTimeoutMS=2000'
+
+
+def _plan_values(plan: Any, key: str) -> Set[str]:
+    """
+    Values of key in all stages of explain output, stage nesting differs between server versions
+    """
+    values: Set[str] = set()
+    if isinstance(plan, dict):
+        if isinstance(plan.get(key), str):
+            values.add(plan[key])
+        for value in plan.values():
+            values |= _plan_values(value, key)
+    elif isinstance(plan, list):
+        for value in plan:
+            values |= _plan_values(value, key)
+    return values
+
+
+def _post(number: int) -> Post:
+    return Post(post_url=f'https://www.reddit.com/r/pics/comments/{number}/title/',
+                post_date=datetime(2021, 3, 20, 12, tzinfo=timezone.utc) + timedelta(hours=number),
+                number_of_comments=10, number_of_votes=number, post_category=f'r/category_{number % 20}',
+                username=f'u/user_{number % 7}', user_karma=number % 7, user_cake_day='March 22, 2017', post_karma=1,
+                comment_karma=1)
+
+
+@pytest.fixture(scope='module')
+def mongo_db() -> Generator[MongoDB, None, None]:
+    load_dotenv()
+    try:
+        db = MongoDB(os.getenv('MONGO_TEST_CONNECTION', TEST_CONNECTION))
+    except ServerSelectionTimeoutError:
+        pytest.skip('MongoDB is not available')
+    db.drop()
+    db.create()
+    db.add_many([_post(number) for number in range(400)])
+    yield db
+    db.drop()
+
+
+@pytest.mark.parametrize('query, fields', [
+    ({'category': 'r/category_3', 'lastPost': '8', 'pagination': 'true'}, ['post_category', 'id']),
+    ({'minVotes': '100', 'maxVotes': '105'}, ['number_of_votes']),
+    ({'date': '2021-03-22'}, ['post_date']),
+])
+def test_filter_is_index_prefix(query: Dict[str, str], fields: List[str]) -> None:
+    find = _generate_filter(query)
+    # fields of the filter lead one of the indexes create() builds, so the planner can pick it without a server
+    assert list(find) == fields
+    assert any([key for key, _ in index][:len(fields)] == fields for index in FILTER_INDEXES)
+    if 'date' in query:
+        assert find['post_date'] == {'$gte': datetime(2021, 3, 22, tzinfo=timezone.utc),
+                                     '$lt': datetime(2021, 3, 23, tzinfo=timezone.utc)}
+
+
+@pytest.mark.parametrize('query, index', [
+    ({'category': 'r/category_3', 'pagination': 'true'}, 'post_category_1_id_1'),
+    ({'minVotes': '100', 'maxVotes': '105', 'pagination': 'true'}, 'number_of_votes_1_id_1'),
+    ({'date': '2021-03-22', 'pagination': 'true'}, 'post_date_1_id_1'),
+])
+def test_filtered_find_uses_index(mongo_db: MongoDB, query: Dict[str, str], index: str) -> None:
+    winning_plan = mongo_db.explain_filtered(query)['queryPlanner']['winningPlan']
+    assert index in _plan_values(winning_plan, 'indexName')
+    assert 'COLLSCAN' not in _plan_values(winning_plan, 'stage')
+
+
+def test_category_pages_need_no_sort(mongo_db: MongoDB) -> None:
+    explain = mongo_db.explain_filtered({'category': 'r/category_3', 'lastPost': '8', 'pagination': 'true'})
+    # index on (post_category, id) returns the page in id order
+    assert 'SORT' not in _plan_values(explain['queryPlanner']['winningPlan'], 'stage')
+
+
+def test_day_filter(mongo_db: MongoDB) -> None:
+    posts = mongo_db.get_filtered({'date': '2021-03-22'})
+    expected = [_post(number) for number in range(400) if _post(number).post_date.date().isoformat() == '2021-03-22']
+    assert sorted(post.id for post in posts) == sorted(post.id for post in expected)
+    assert all(post.post_date.tzinfo is not None for post in posts)
+
+    # post date of another zone is stored and matched as its UTC day
+    other_zone = replace(_post(1000), post_date=datetime(2021, 3, 22, 23, 30, tzinfo=timezone(timedelta(hours=-2))))
+    mongo_db.add(other_zone)
+    assert other_zone.id not in {post.id for post in mongo_db.get_filtered({'date': '2021-03-22'})}
+    assert other_zone.id in {post.id for post in mongo_db.get_filtered({'date': '2021-03-23'})}
+    mongo_db.delete(other_zone.id)
+
+
+def test_create_converts_string_dates(mongo_db: MongoDB) -> None:
+    post = _post(1001)
+    mongo_db.add(post)
+    mongo_db.posts.update_one({'id': post.id}, {'$set': {'post_date': '2021-03-22T10:00:00+00:00'}})
+    mongo_db.create()
+    assert mongo_db.get_by_id(post.id).post_date == datetime(2021, 3, 22, 10, tzinfo=timezone.utc)
+    assert mongo_db.count() == 401
+    mongo_db.delete(post.id)
+
+
+def test_changes_visible_in_order(mongo_db: MongoDB) -> None:
+    last = mongo_db.changes(0, limit=100000)[-1].seq
+    posts = [_post(number) for number in range(2000, 2080)]
+    gaps: List[List[int]] = []
+
+    def add(batch: List[Post]) -> None:
+        for post in batch:
+            mongo_db.add(post)
+
+    writers = [threading.Thread(target=add, args=(posts[number::8],)) for number in range(8)]
+    for writer in writers:
+        writer.start()
+    # new posts only, so a reader never sees a number before all smaller ones
+    while any(writer.is_alive() for writer in writers):
+        seqs = [change.seq for change in mongo_db.changes(last)]
+        if seqs != list(range(last + 1, last + 1 + len(seqs))):
+            gaps.append(seqs)
+    for writer in writers:
+        writer.join()
+    assert not gaps
+    assert len(mongo_db.changes(last)) == len(posts)
+    for post in posts:
+        mongo_db.delete(post.id)
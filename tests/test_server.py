@@ -1,22 +1,41 @@
+import json
+import socket
+import threading
+import time
 from datetime import datetime
 from multiprocessing import Process
-from typing import Generator
+from typing import Any, Generator
 
 import pytest
 import requests
 
+from post_parser.admission import POLL, READ, AdmissionConfig
+from post_parser.db import FileDB
+from post_parser.db.changes import ChangeNotifier
+from post_parser.metrics import ADMISSION_QUEUE_DEPTH
 from post_parser.post import Post
 from post_parser.post_schema import PostSchema
-from post_parser.server import run, RESPONSE_NOT_FOUND, RESPONSE_OK, RESPONSE_CREATED
+from post_parser.server import run, PostHTTPServer, RequestHandler, request_handler_wrapper, RESPONSE_BAD_REQUEST, \
+    RESPONSE_NOT_FOUND, RESPONSE_OK, RESPONSE_CREATED, RESPONSE_SERVICE_UNAVAILABLE, PORT
 
 SERVER_URL = 'http://localhost:8087/posts'
+STATS_URL = 'http://localhost:8087/posts/stats'
+EXPORT_URL = 'http://localhost:8087/posts/export'
+CHANGES_URL = 'http://localhost:8087/posts/changes'
+METRICS_URL = 'http://localhost:8087/metrics'
 
 
 @pytest.fixture(scope='session', autouse=True)
 def setup_server() -> Generator:
-    process = Process(target=run)
+    process = Process(target=run, args=('file',))
     # process.daemon = True
     process.start()
+    for _ in range(50):
+        try:
+            requests.get(METRICS_URL)
+            break
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
     yield
     process.terminate()
 
@@ -94,3 +113,203 @@ def test_server_put(post_schema: PostSchema, test_post: Post, replace_post: Post
     response = requests.get(SERVER_URL + '/' + replace_post.id)
     assert post_schema.loads(response.text) == replace_post
     requests.delete(SERVER_URL + '/' + replace_post.id)
+
+
+def test_server_metrics(post_schema: PostSchema, test_post: Post) -> None:
+    requests.post(SERVER_URL, data=post_schema.dumps(test_post))
+    requests.get(SERVER_URL)
+    requests.delete(SERVER_URL + '/' + test_post.id)
+    response = requests.get(METRICS_URL)
+    assert response.status_code == RESPONSE_OK
+    assert response.headers['Content-Type'].startswith('text/plain')
+    assert 'server_db_call_seconds_count{backend="FileDB",method="add"}' in response.text
+    assert 'server_requests_total{method="GET",route="/posts",status="200"}' in response.text
+    assert 'server_bytes_written_total{route="/posts"}' in response.text
+
+
+def test_server_compressed_list(post_schema: PostSchema, test_post: Post) -> None:
+    posts = [Post(post_url=f'url{number}', post_date=datetime.now(), number_of_comments=10, number_of_votes=number,
+                  post_category='r/idk', username='gun73r', user_karma=2, user_cake_day='cake day', post_karma=1,
+                  comment_karma=1) for number in range(20)]
+    for post in posts:
+        requests.post(SERVER_URL, data=post_schema.dumps(post))
+    response = requests.get(SERVER_URL, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert int(response.headers['Content-Length']) < len(response.content)
+    assert sorted(post.post_url for post in post_schema.loads(response.text, many=True)) == \
+        sorted(post.post_url for post in posts)
+    assert requests.get(SERVER_URL, headers={'Accept-Encoding': 'gzip'}).content == response.content
+    assert 'Content-Encoding' not in requests.get(SERVER_URL, headers={'Accept-Encoding': 'identity'}).headers
+    metrics = requests.get(METRICS_URL).text
+    assert 'server_response_cache_total{result="hit"}' in metrics
+    for post in posts:
+        requests.delete(SERVER_URL + '/' + post.id)
+    assert requests.get(SERVER_URL, headers={'Accept-Encoding': 'gzip'}).json() == []
+
+
+def test_server_fields(post_schema: PostSchema, test_post: Post, replace_post: Post) -> None:
+    requests.post(SERVER_URL, data=post_schema.dumps(test_post))
+    requests.post(SERVER_URL, data=post_schema.dumps(replace_post))
+    response = requests.get(SERVER_URL + '?fields=id,number_of_votes,user_karma')
+    assert response.status_code == RESPONSE_OK
+    assert sorted(response.json(), key=lambda post: post['id']) == [
+        {'id': post.id, 'number_of_votes': post.number_of_votes, 'user_karma': post.user_karma}
+        for post in sorted((test_post, replace_post), key=lambda post: post.id)]
+    paginated = requests.get(SERVER_URL + '?pagination=true&category=r/idk2&fields=post_url').json()
+    assert paginated == [{'post_url': replace_post.post_url}]
+    assert requests.get(SERVER_URL + '?fields=id,secret').status_code == RESPONSE_BAD_REQUEST
+    requests.delete(SERVER_URL + '/' + test_post.id)
+    requests.delete(SERVER_URL + '/' + replace_post.id)
+
+
+def test_server_export(post_schema: PostSchema, test_post: Post, replace_post: Post) -> None:
+    requests.post(SERVER_URL, data=post_schema.dumps(test_post))
+    requests.post(SERVER_URL, data=post_schema.dumps(replace_post))
+    response = requests.get(EXPORT_URL + '?format=ndjson&category=r/idk2')
+    assert response.status_code == RESPONSE_OK
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    assert [json.loads(line)['post_url'] for line in response.text.splitlines()] == [replace_post.post_url]
+    lines = requests.get(EXPORT_URL + '?format=csv', headers={'Accept-Encoding': 'gzip'}).text.splitlines()
+    assert lines[0].startswith('id,post_url,') and len(lines) == 3
+    assert requests.get(EXPORT_URL + '?format=xml').status_code == RESPONSE_BAD_REQUEST
+    requests.delete(SERVER_URL + '/' + test_post.id)
+    requests.delete(SERVER_URL + '/' + replace_post.id)
+
+
+def test_server_changes(post_schema: PostSchema, test_post: Post, replace_post: Post) -> None:
+    cursor = requests.get(CHANGES_URL).json()['cursor']
+    while True:
+        page = requests.get(CHANGES_URL, params={'since': cursor}).json()
+        if not page['changes']:
+            break
+        cursor = page['cursor']
+    requests.post(SERVER_URL, data=post_schema.dumps(test_post))
+    requests.delete(SERVER_URL + '/' + test_post.id)
+    page = requests.get(CHANGES_URL, params={'since': cursor}).json()
+    assert [(change['id'], change['deleted'], change['post']) for change in page['changes']] == \
+        [(test_post.id, True, None)]
+
+    # long poll is answered by the next write
+    timer = threading.Timer(0.3, lambda: requests.post(SERVER_URL, data=post_schema.dumps(replace_post)))
+    timer.start()
+    start = time.monotonic()
+    page = requests.get(CHANGES_URL, params={'since': page['cursor'], 'wait': '10'}).json()
+    assert time.monotonic() - start < 5
+    timer.join()
+    assert [change['post']['post_url'] for change in page['changes']] == [replace_post.post_url]
+    requests.delete(SERVER_URL + '/' + replace_post.id)
+    assert requests.get(CHANGES_URL, params={'since': '-1'}).status_code == RESPONSE_BAD_REQUEST
+    assert requests.get(CHANGES_URL, params={'wait': '3600'}).status_code == RESPONSE_BAD_REQUEST
+
+
+def _read_until(sock: socket.socket, data: bytes, marker: bytes) -> bytes:
+    while marker not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def test_server_stream(post_schema: PostSchema, test_post: Post) -> None:
+    subscribers = [socket.create_connection(('localhost', PORT), timeout=10) for _ in range(3)]
+    for sock in subscribers:
+        sock.sendall(b'GET /posts/stream HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    headers = [_read_until(sock, b'', b'\r\n\r\n') for sock in subscribers]
+    assert all(b' 200 ' in header and b'text/event-stream' in header for header in headers)
+    # handler threads returned, subscribers are served by the broadcaster
+    assert requests.get(SERVER_URL).status_code == RESPONSE_OK
+
+    requests.post(SERVER_URL, data=post_schema.dumps(test_post))
+    for sock, header in zip(subscribers, headers):
+        data = _read_until(sock, header.split(b'\r\n\r\n', 1)[1], b'\n\n')
+        lines = data.decode('utf-8').split('\n')
+        assert lines[0] == 'event: post'
+        assert post_schema.loads(lines[1][len('data: '):]) == test_post
+        sock.close()
+    requests.delete(SERVER_URL + '/' + test_post.id)
+
+
+def test_server_stats(post_schema: PostSchema, test_post: Post, replace_post: Post) -> None:
+    requests.post(SERVER_URL, data=post_schema.dumps(test_post))
+    requests.post(SERVER_URL, data=post_schema.dumps(replace_post))
+    response = requests.get(STATS_URL + '?top=1')
+    assert response.status_code == RESPONSE_OK
+    stats = response.json()
+    assert stats['total'] == 2
+    assert stats['categories'] == {'r/idk': 1, 'r/idk2': 1}
+    assert stats['votes']['<10'] == 2
+    assert sum(stats['days'].values()) == 2
+    assert stats['top_users'] == [{'username': 'gun73r', 'user_karma': 2}]
+    requests.delete(SERVER_URL + '/' + test_post.id)
+    assert requests.get(STATS_URL).json()['categories'] == {'r/idk2': 1}
+    requests.delete(SERVER_URL + '/' + replace_post.id)
+    assert requests.get(STATS_URL + '?top=lots').status_code == RESPONSE_BAD_REQUEST
+
+
+def _wait_until(condition: Any) -> None:
+    for _ in range(100):
+        if condition():
+            return
+        time.sleep(0.05)
+    raise AssertionError('condition not met')
+
+
+def test_admission_control(tmp_path: Any, post_schema: PostSchema, test_post: Post) -> None:
+    handler = request_handler_wrapper(RequestHandler, FileDB(str(tmp_path), 'reddit.txt'), notifier=ChangeNotifier())
+    config = AdmissionConfig(max_reads=1, max_writes=1, max_polls=1, queue_size=1)
+    server = PostHTTPServer(('localhost', 0), handler, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = ('localhost', server.server_port)
+    url = f'http://localhost:{server.server_port}'
+    try:
+        # the only read is taken, writes have their own budget
+        assert server.admission.try_acquire(READ)
+        response = requests.get(url + '/posts')
+        assert response.status_code == RESPONSE_SERVICE_UNAVAILABLE and response.headers['Retry-After'] == '1'
+        assert requests.post(url + '/posts', data=post_schema.dumps(test_post)).status_code == RESPONSE_CREATED
+        server.admission.release(READ)
+        assert 'server_admission_rejected_total{kind="read"} 1' in requests.get(url + '/metrics').text
+
+        # idle connections take all handler threads, the next one waits in the queue, the one after is rejected
+        idle = [socket.create_connection(address) for _ in range(config.max_connections)]
+        queued = socket.create_connection(address, timeout=10)
+        queued.sendall(b'GET /posts HTTP/1.0\r\n\r\n')
+        _wait_until(lambda: ADMISSION_QUEUE_DEPTH.value() == 1)
+        assert requests.get(url + '/posts').status_code == RESPONSE_SERVICE_UNAVAILABLE
+        for sock in idle:
+            sock.close()
+        assert _read_until(queued, b'', b'\r\n').startswith(b'HTTP/1.0 200')
+        queued.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_long_polls_do_not_take_reads(tmp_path: Any, post_schema: PostSchema, test_post: Post) -> None:
+    handler = request_handler_wrapper(RequestHandler, FileDB(str(tmp_path), 'reddit.txt'), notifier=ChangeNotifier())
+    server = PostHTTPServer(('localhost', 0), handler, AdmissionConfig(max_reads=2, max_writes=1, max_polls=4))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://localhost:{server.server_port}'
+    try:
+        polls = [threading.Thread(target=requests.get, args=(url + '/posts/changes',), kwargs={
+            'params': {'wait': '10'}}) for _ in range(4)]
+        for count, poll in enumerate(polls, 1):
+            # a poll is admitted as a read until it starts to wait
+            poll.start()
+            _wait_until(lambda: server.admission.in_flight(POLL) == count)
+        assert server.admission.in_flight(READ) == 0
+        for _ in range(3):
+            assert requests.get(url + '/posts').status_code == RESPONSE_OK
+        # a long poll over its budget is rejected instead of taking a read
+        response = requests.get(url + '/posts/changes', params={'wait': '10'})
+        assert response.status_code == RESPONSE_SERVICE_UNAVAILABLE
+        assert requests.get(url + '/posts/changes').status_code == RESPONSE_OK
+        assert requests.post(url + '/posts', data=post_schema.dumps(test_post)).status_code == RESPONSE_CREATED
+        for poll in polls:
+            poll.join()
+        assert server.admission.in_flight(POLL) == 0
+    finally:
+        server.shutdown()
+        server.server_close()
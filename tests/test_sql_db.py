@@ -0,0 +1,242 @@
+import io
+import threading
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Generator, List, Set
+
+import psycopg2
+import pytest
+from dotenv import load_dotenv
+
+from post_parser.db import PostgresDB, PostNotFoundException, create_postgres_db
+from post_parser.db.file_db import parse_post_line
+from post_parser.db.sql_db import _prepared_statement, _filtered_statement, _filter_key, _projected_statement, \
+    _CopyReader
+from post_parser.db.stats import StatsAccumulator
+from post_parser.post import Post
+
+TEST_SCHEMA = 'post_parser_test'
+
+
+def _index_names(plan: Dict[str, Any]) -> Set[str]:
+    names = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        names |= _index_names(child)
+    return names
+
+
+@pytest.fixture(scope='module')
+def postgres_db() -> Generator[PostgresDB, None, None]:
+    load_dotenv()
+    try:
+        # tables of the configured database are left untouched, the test works in its own schema
+        db = create_postgres_db(TEST_SCHEMA)
+    except psycopg2.OperationalError:
+        pytest.skip('PostgreSQL is not available')
+    db.cursor.execute(f'DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE; CREATE SCHEMA {TEST_SCHEMA};')
+    db.create()
+    # on a few rows seq scan is always cheaper, so planner is asked to prefer indexes whenever it can use them
+    db.cursor.execute('SET enable_seqscan = off;')
+    yield db
+    db.cursor.execute(f'DROP SCHEMA {TEST_SCHEMA} CASCADE;')
+    db.conn.commit()
+    db.conn.close()
+
+
+@pytest.mark.parametrize('query, index', [
+    ({'category': 'r/pics', 'pagination': 'true'}, 'posts_category_id_idx'),
+    ({'minVotes': '100', 'maxVotes': '200', 'pagination': 'true'}, 'posts_votes_id_idx'),
+    ({'date': '2021-03-22', 'pagination': 'true'}, 'posts_day_id_idx'),
+])
+def test_filtered_select_uses_index(postgres_db: PostgresDB, query: Dict[str, str], index: str) -> None:
+    plan = postgres_db.explain_filtered(query)
+    assert index in _index_names(plan['Plan'])
+
+
+def test_migrate_is_idempotent(postgres_db: PostgresDB) -> None:
+    postgres_db.migrate()
+    postgres_db.cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = %s AND tablename = 'posts'",
+                               (TEST_SCHEMA,))
+    indexes = {row[0] for row in postgres_db.cursor.fetchall()}
+    assert {'posts_category_id_idx', 'posts_votes_id_idx', 'posts_day_id_idx', 'posts_user_name_idx'} <= indexes
+
+
+def test_prepared_statement() -> None:
+    statement = _prepared_statement('find', 'SELECT * FROM posts WHERE id = %(id)s OR id > %(last)s OR id = %(id)s;\n')
+    assert statement.prepare == 'PREPARE find AS SELECT * FROM posts WHERE id = $1 OR id > $2 OR id = $1;'
+    assert statement.execute == 'EXECUTE find (%(id)s, %(last)s);'
+
+
+def test_filtered_statement_cached_per_filter_keys() -> None:
+    first = _filtered_statement(*_filter_key({'category': 'r/pics', 'minVotes': '1', 'pagination': 'true'}))
+    second = _filtered_statement(*_filter_key({'minVotes': '5', 'category': 'r/funny', 'pagination': 'true'}))
+    unpaginated = _filtered_statement(*_filter_key({'category': 'r/pics', 'minVotes': '1'}))
+    assert first is second
+    assert first.name == 'filtered_category_minvotes_page'
+    assert unpaginated.name == 'filtered_category_minvotes'
+
+
+def _post(number: int, username: str = 'u/first') -> Post:
+    return Post(post_url=f'https://www.reddit.com/r/pics/comments/{number}/title/',
+                post_date=datetime(2021, 3, 22, 10, number, tzinfo=timezone.utc), number_of_comments=10,
+                number_of_votes=100 + number, post_category='r/pics', username=username, user_karma=2,
+                user_cake_day='March 22, 2017', post_karma=1, comment_karma=1)
+
+
+def test_copy_reader_escapes_and_streams() -> None:
+    post = replace(_post(1), post_category='r/tab\tand\\slash')
+    reader = _CopyReader([post, _post(2)])
+    first = reader.read(10)
+    assert len(first) == 10 and reader.rows == 1
+    rows = (first + reader.read()).splitlines()
+    assert reader.rows == 2 and reader.read() == ''
+    assert rows[0].split('\t')[5] == 'r/tab\\tand\\\\slash'
+    assert rows[1].split('\t')[:2] == [_post(2).id, _post(2).post_url]
+
+
+def test_bulk_import_and_export(postgres_db: PostgresDB) -> None:
+    postgres_db.drop()
+    postgres_db.create()
+    posts = [_post(number, username=f'u/user_{number % 3}') for number in range(10)]
+    updated = replace(_post(3, username='u/user_0'), number_of_votes=999)
+    assert postgres_db.bulk_import(posts + [updated]) == 11
+    assert postgres_db.count() == 10
+    assert postgres_db.get_by_id(updated.id).number_of_votes == 999
+    # indexes dropped for the initial load are back
+    assert 'posts_day_id_idx' in _index_names(postgres_db.explain_filtered({'date': '2021-03-22'})['Plan'])
+
+    output = io.StringIO()
+    postgres_db.bulk_export(output)
+    exported = [parse_post_line(line) for line in output.getvalue().splitlines()]
+    assert sorted(post.id for post in exported) == sorted(post.id for post in posts)
+    assert next(post for post in exported if post == updated).post_date == updated.post_date
+
+
+def test_add_update_delete(postgres_db: PostgresDB) -> None:
+    postgres_db.drop()
+    postgres_db.create()
+    post = Post(post_url='https://www.reddit.com/r/pics/comments/abc/title/', post_date=datetime.now(timezone.utc),
+                number_of_comments=10, number_of_votes=100, post_category='r/pics', username='u/first',
+                user_karma=2, user_cake_day='March 22, 2017', post_karma=1, comment_karma=1)
+    assert postgres_db.add(post)
+    assert not postgres_db.add(post)
+    assert postgres_db.get_filtered({'category': 'r/pics'})[0].id == post.id
+
+    post = replace(post, username='u/second', number_of_votes=200)
+    assert postgres_db.update(post.id, post)
+    assert not postgres_db.update('missing', post)
+    updated = postgres_db.get_by_id(post.id)
+    assert updated.username == 'u/second' and updated.number_of_votes == 200
+
+    assert postgres_db.delete(post.id)
+    assert not postgres_db.delete(post.id)
+    with pytest.raises(PostNotFoundException):
+        postgres_db.get_by_id(post.id)
+
+
+def test_stats(postgres_db: PostgresDB) -> None:
+    postgres_db.drop()
+    postgres_db.create()
+    assert postgres_db.stats().as_dict()['total'] == 0
+    posts = [replace(_post(number, username=f'u/user_{number % 4}'), user_karma=number % 4 * 10,
+                     number_of_votes=number ** 3, post_category=f'r/category_{number % 3}',
+                     post_date=datetime(2021, 3, 22, 23, tzinfo=timezone.utc) + timedelta(hours=number))
+             for number in range(50)]
+    postgres_db.bulk_import(posts)
+    postgres_db.delete(posts[0].id)
+    expected = StatsAccumulator()
+    for post in posts[1:]:
+        expected.add(post)
+    assert postgres_db.stats(top_users=3).as_dict() == expected.stats(top_users=3).as_dict()
+
+
+def test_projected(postgres_db: PostgresDB) -> None:
+    postgres_db.drop()
+    postgres_db.create()
+    posts = [replace(_post(number), post_date=datetime(2021, 3, 22, 23, tzinfo=timezone.utc) + timedelta(hours=number))
+             for number in range(40)]
+    postgres_db.bulk_import(posts)
+    query = {'minVotes': '0', 'pagination': 'true'}
+    for fields in (('id', 'post_date', 'number_of_votes'), ('username', 'user_karma', 'user_cake_day')):
+        assert postgres_db.get_projected(query, fields) == \
+            [{field: getattr(post, field) for field in fields} for post in postgres_db.get_filtered(query)]
+    assert 'users' not in _projected_statement(('id', 'username'), *_filter_key(query)).prepare
+    assert 'users' in _projected_statement(('id', 'user_karma'), *_filter_key(query)).prepare
+
+
+def test_iter_filtered(postgres_db: PostgresDB) -> None:
+    postgres_db.drop()
+    postgres_db.create()
+    postgres_db.bulk_import([replace(_post(number), number_of_votes=number) for number in range(40)])
+    query = {'minVotes': '10', 'maxVotes': '30', 'pagination': 'true'}
+    assert [post.id for post in postgres_db.iter_filtered(query, batch_size=4)] == \
+        [post.id for post in postgres_db.get_filtered({'minVotes': '10', 'maxVotes': '30'})]
+
+
+def test_changes(postgres_db: PostgresDB) -> None:
+    postgres_db.drop()
+    postgres_db.create()
+    posts = [_post(number) for number in range(4)]
+    postgres_db.add(posts[0])
+    postgres_db.bulk_import(posts[1:])
+    postgres_db.update(posts[1].id, replace(posts[1], number_of_votes=7))
+    assert postgres_db.delete(posts[2].id)
+    assert not postgres_db.delete(posts[2].id)
+    renamed = replace(posts[3], post_url='https://www.reddit.com/r/pics/comments/renamed/')
+    postgres_db.update(posts[3].id, renamed)
+    changes = postgres_db.changes(0)
+    # bulk import numbers posts in id order, tombstone and new post of an update get numbers of one statement
+    assert [(change.post_id, change.deleted) for change in changes[:3]] == \
+        [(posts[0].id, False), (posts[1].id, False), (posts[2].id, True)]
+    assert {(change.post_id, change.deleted) for change in changes[3:]} == {(posts[3].id, True), (renamed.id, False)}
+    assert changes[1].post is not None and changes[1].post.number_of_votes == 7
+    assert [change.seq for change in postgres_db.changes(changes[1].seq, limit=2)] == \
+        [change.seq for change in changes[2:4]]
+    assert postgres_db.changes(changes[-1].seq) == []
+
+
+def test_add_batch_and_count(postgres_db: PostgresDB) -> None:
+    postgres_db.drop()
+    postgres_db.create()
+    assert postgres_db.add(_post(0))
+    posts = [_post(number, username=f'u/user_{number % 2}') for number in range(5)]
+    assert postgres_db.add_batch(posts + [posts[1]]) == [False, True, True, True, True, False]
+    assert sorted(post.id for post in postgres_db.get_all()) == sorted(post.id for post in posts)
+    assert postgres_db.get_by_id(posts[3].id).username == 'u/user_1'
+    # count is maintained by writes, COUNT(*) sees the same
+    assert postgres_db.count() == 5
+    postgres_db.delete(posts[0].id)
+    assert postgres_db.count() == 4
+    postgres_db.cursor.execute('SELECT COUNT(*) FROM posts')
+    assert postgres_db.cursor.fetchone()[0] == 4
+
+
+def test_threads_share_connection(postgres_db: PostgresDB) -> None:
+    postgres_db.drop()
+    postgres_db.create()
+    posts = [_post(number) for number in range(20)]
+    postgres_db.add_many(posts)
+    errors: List[BaseException] = []
+
+    def read(number: int) -> None:
+        # every thread fetches results of its own statements from its own cursor
+        try:
+            for _ in range(50):
+                assert postgres_db.get_by_id(posts[number].id) == posts[number]
+                assert len(postgres_db.get_filtered({'category': 'r/pics', 'pagination': 'true'})) == 20
+                assert postgres_db.count() == 20
+        except BaseException as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=read, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def test_schema_set_by_connection(postgres_db: PostgresDB) -> None:
+    # tables are created in the schema before anything runs in the default one
+    postgres_db.cursor.execute('SELECT current_schema(), to_regclass(%s)', (f'{TEST_SCHEMA}.posts',))
+    assert postgres_db.cursor.fetchone() == (TEST_SCHEMA, 'posts')
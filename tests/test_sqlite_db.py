@@ -0,0 +1,171 @@
+import sqlite3
+import threading
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, List
+
+import pytest
+
+from post_parser.db import SQLiteDB, PostNotFoundException
+from post_parser.db.constants import POSTS_PER_PAGE
+from post_parser.db.stats import StatsAccumulator
+from post_parser.post import Post
+
+
+def _posts(amount: int) -> List[Post]:
+    return [Post(post_url=f'https://www.reddit.com/r/pics/comments/{number}/title/', username=f'u/user_{number % 3}',
+                 user_karma=number, user_cake_day='March 22, 2017', post_karma=1, comment_karma=1,
+                 post_date=datetime(2021, 3, 22, 23, tzinfo=timezone.utc) + timedelta(hours=number),
+                 number_of_comments=number, number_of_votes=number * 10,
+                 post_category='r/pics' if number % 2 else 'r/funny')
+            for number in range(amount)]
+
+
+@pytest.fixture
+def sqlite_db(tmp_path: Any) -> SQLiteDB:
+    return SQLiteDB(str(tmp_path / 'reddit.sqlite3'))
+
+
+def test_wal_mode(sqlite_db: SQLiteDB) -> None:
+    assert sqlite_db.conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_add_update_delete(sqlite_db: SQLiteDB) -> None:
+    post = _posts(1)[0]
+    assert sqlite_db.add(post)
+    assert not sqlite_db.add(post)
+    assert sqlite_db.get_by_id(post.id) == post
+    assert sqlite_db.get_by_id(post.id).post_date == post.post_date
+
+    updated = replace(post, username='u/other', number_of_votes=5)
+    assert sqlite_db.update(post.id, updated)
+    assert not sqlite_db.update('missing', updated)
+    assert sqlite_db.get_by_id(post.id).username == 'u/other'
+    assert sqlite_db.get_by_id(post.id).number_of_votes == 5
+
+    assert sqlite_db.delete(post.id)
+    assert not sqlite_db.delete(post.id)
+    with pytest.raises(PostNotFoundException):
+        sqlite_db.get_by_id(post.id)
+
+
+def test_add_many_and_filters(sqlite_db: SQLiteDB) -> None:
+    posts = _posts(100)
+    assert sqlite_db.add_many(posts + [replace(posts[0], number_of_votes=7)]) == 101
+    assert sqlite_db.count() == 100
+    assert sqlite_db.get_by_id(posts[0].id).number_of_votes == 7
+
+    pics = sqlite_db.get_filtered({'category': 'r/pics', 'minVotes': '100', 'maxVotes': '500'})
+    assert sorted(post.number_of_votes for post in pics) == [110, 130, 150, 170, 190, 210, 230, 250, 270, 290, 310,
+                                                              330, 350, 370, 390, 410, 430, 450, 470, 490]
+    # first post is at 23:00 UTC, the day of the next one is taken in UTC too
+    assert {post.id for post in sqlite_db.get_filtered({'date': '2021-03-22'})} == {posts[0].id}
+
+    first_page = sqlite_db.get_filtered({'pagination': 'true'})
+    second_page = sqlite_db.get_filtered({'pagination': 'true', 'lastPost': first_page[-1].id})
+    assert len(first_page) == POSTS_PER_PAGE
+    assert [post.id for post in first_page + second_page] == sorted(post.id for post in posts)[:2 * POSTS_PER_PAGE]
+    assert [post.id for post in sqlite_db.iter_posts(batch_size=7)] == sorted(post.id for post in posts)
+
+
+@pytest.mark.parametrize('query, index', [
+    ({'category': 'r/pics', 'pagination': 'true'}, 'posts_category_id_idx'),
+    ({'minVotes': '100', 'maxVotes': '200', 'pagination': 'true'}, 'posts_votes_id_idx'),
+    ({'date': '2021-03-22', 'pagination': 'true'}, 'posts_day_id_idx'),
+])
+def test_filtered_select_uses_index(sqlite_db: SQLiteDB, query: Any, index: str) -> None:
+    assert any(index in detail for detail in sqlite_db.explain_filtered(query))
+
+
+def test_projected(sqlite_db: SQLiteDB) -> None:
+    posts = _posts(100)
+    sqlite_db.add_many(posts)
+    query = {'category': 'r/pics', 'pagination': 'true', 'lastPost': sorted(post.id for post in posts)[10]}
+    for fields in (('id', 'post_date', 'number_of_votes'), ('id', 'username', 'user_karma')):
+        assert sqlite_db.get_projected(query, fields) == \
+            [{field: getattr(post, field) for field in fields} for post in sqlite_db.get_filtered(query)]
+    # users are joined only when a user field is requested
+    assert not any('users' in detail for detail in sqlite_db.explain_projected(query, ('id', 'username')))
+    assert any('users' in detail for detail in sqlite_db.explain_projected(query, ('id', 'user_karma')))
+
+
+def test_iter_filtered(sqlite_db: SQLiteDB) -> None:
+    sqlite_db.add_many(_posts(100))
+    for query in ({}, {'category': 'r/pics', 'minVotes': '100'}, {'pagination': 'true', 'maxVotes': '500'}):
+        expected = sqlite_db.get_filtered({name: value for name, value in query.items() if name != 'pagination'})
+        assert [post.id for post in sqlite_db.iter_filtered(query, batch_size=7)] == [post.id for post in expected]
+
+
+def test_connection_per_thread(sqlite_db: SQLiteDB) -> None:
+    connections: List[sqlite3.Connection] = []
+    errors: List[BaseException] = []
+
+    def add(posts: List[Post]) -> None:
+        try:
+            connections.append(sqlite_db.conn)
+            for post in posts:
+                sqlite_db.add(post)
+        except BaseException as e:
+            errors.append(e)
+
+    posts = _posts(40)
+    threads = [threading.Thread(target=add, args=(posts[number::4],)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len({id(conn) for conn in connections}) == 4
+    assert sqlite_db.count() == 40
+
+
+def test_stats(sqlite_db: SQLiteDB) -> None:
+    posts = [replace(post, user_karma=int(post.username[-1]) * 10, number_of_votes=number ** 3)
+             for number, post in enumerate(_posts(50))]
+    sqlite_db.add_many(posts)
+    # every post of u/user_2 is deleted, the user is left out of top users
+    for post in posts[2::3]:
+        sqlite_db.delete(post.id)
+    expected = StatsAccumulator()
+    for post in posts:
+        if post.username != 'u/user_2':
+            expected.add(post)
+    stats = sqlite_db.stats(top_users=5).as_dict()
+    assert stats == expected.stats(top_users=5).as_dict()
+    assert [user['username'] for user in stats['top_users']] == ['u/user_1', 'u/user_0']
+
+
+def test_changes(sqlite_db: SQLiteDB) -> None:
+    posts = _posts(4)
+    sqlite_db.add(posts[0])
+    sqlite_db.add_many(posts[1:])
+    sqlite_db.update(posts[1].id, replace(posts[1], number_of_votes=7))
+    sqlite_db.delete(posts[2].id)
+    renamed = replace(posts[3], post_url='https://www.reddit.com/r/pics/comments/renamed/title/')
+    sqlite_db.update(posts[3].id, renamed)
+    changes = sqlite_db.changes(0)
+    assert [(change.post_id, change.deleted) for change in changes] == \
+        [(posts[0].id, False), (posts[1].id, False), (posts[2].id, True), (posts[3].id, True), (renamed.id, False)]
+    assert changes[1].post is not None and changes[1].post.number_of_votes == 7
+    assert [change.seq for change in changes] == sorted(change.seq for change in changes)
+    assert [change.post_id for change in sqlite_db.changes(changes[1].seq, limit=2)] == [posts[2].id, posts[3].id]
+    assert sqlite_db.changes(changes[-1].seq) == []
+
+
+def test_changes_of_database_created_before_change_feed(tmp_path: Any) -> None:
+    path = str(tmp_path / 'old.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.executescript('''CREATE TABLE users(username text not null, user_karma integer not null,
+    user_cake_day text not null, post_karma integer not null, comment_karma integer not null, PRIMARY KEY (username));
+CREATE TABLE posts (id text not null, post_url text not null, post_date text not null, post_day text not null,
+    number_of_comments integer not null, number_of_votes integer not null, post_category text not null,
+    user_name text not null, PRIMARY KEY (id));
+INSERT INTO users VALUES ('u/user', 1, 'March 22, 2017', 1, 1);
+INSERT INTO posts VALUES ('b', 'url_b', '2021-03-22T10:00:00+00:00', '2021-03-22', 1, 1, 'r/pics', 'u/user');
+INSERT INTO posts VALUES ('a', 'url_a', '2021-03-22T10:00:00+00:00', '2021-03-22', 1, 1, 'r/pics', 'u/user');
+''')
+    conn.close()
+    db = SQLiteDB(path)
+    assert [(change.seq, change.post_id) for change in db.changes(0)] == [(1, 'b'), (2, 'a')]
+    db.add(_posts(1)[0])
+    assert [change.seq for change in db.changes(2)] == [3]